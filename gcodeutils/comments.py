@@ -0,0 +1,55 @@
+"""Classification of gcode lines by the registered texts found in them, matched in a single pass per line"""
+from array import array
+import re
+
+__author__ = 'olivier'
+
+
+class CommentClassifier(object):
+    """Set of registered patterns, each one with its class flags, matched at once by a combined regular expression.
+
+    The class of a line is the union (bitwise or) of the flags of the patterns found in it, 0 when there's none.
+    Patterns are matched without overlapping, the first registered one winning among the ones starting at the same
+    position, so a text containing another registered text must be registered first, with both flags when both
+    classes apply."""
+
+    def __init__(self):
+        self.patterns = []
+        self.flags = []
+        self.next_flag = 1
+        self._expression = None
+
+    def register(self, text, flags=None):
+        """register a literal text, return its flags (the next free bit when not given)"""
+        return self.register_expression(re.escape(text), flags)
+
+    def register_expression(self, expression, flags=None):
+        """register a regular expression, return its flags (the next free bit when not given)"""
+        if flags is None:
+            flags = self.next_flag
+        while self.next_flag <= flags:
+            self.next_flag <<= 1
+        self.patterns.append(expression)
+        self.flags.append(flags)
+        self._expression = None
+        return flags
+
+    @property
+    def expression(self):
+        if self._expression is None:
+            self._expression = re.compile('|'.join('(?P<p{}>{})'.format(position, pattern)
+                                                   for position, pattern in enumerate(self.patterns)))
+        return self._expression
+
+    def classify(self, text):
+        """return the class of a text"""
+        if not self.patterns:
+            return 0
+        line_class = 0
+        for match in self.expression.finditer(text):
+            line_class |= self.flags[int(match.lastgroup[1:])]
+        return line_class
+
+    def classify_lines(self, lines):
+        """return the classes of the raw text of lines, as an array"""
+        return array('H' if self.next_flag <= 1 << 16 else 'L', (self.classify(line.raw) for line in lines))
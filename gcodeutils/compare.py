@@ -0,0 +1,193 @@
+"""Tolerance aware comparison of GCode programs"""
+from __future__ import division
+
+from array import array
+import bisect
+from collections import namedtuple
+import difflib
+import math
+
+from gcodeutils.gcoder import PyLine, gcode_possible_arguments
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'olivier'
+
+NAN = float('nan')
+
+DiffRegion = namedtuple('DiffRegion', ('layer', 'lhs_start', 'lhs_end', 'rhs_start', 'rhs_end',
+                                       'lhs_lines', 'rhs_lines'))
+
+
+class ProgramColumns(object):
+    """Meaningful (ie non comment) lines of a program as columns: command and numeric arguments, NaN standing
+    for missing arguments. Lines are kept in program order, with the index of the first line of each layer."""
+
+    def __init__(self, gcode):
+        self.lines = []
+        self.commands = []
+        self.keys = []
+        self.values = array('d')
+        self.layer_starts = array('I')
+
+        for layer in gcode.all_layers:
+            self.layer_starts.append(len(self.lines))
+            for line in layer:
+                if line.command is None:
+                    continue
+                bits = tuple(getattr(line, bit) for bit in gcode_possible_arguments)
+                self.lines.append(line)
+                self.commands.append(line.command)
+                self.keys.append((line.command,) + bits)
+                self.values.extend(NAN if bit is None else bit for bit in bits)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def layer_ranges(self):
+        """return the (start, end) line range of layers with at least one meaningful line"""
+        ends = list(self.layer_starts[1:]) + [len(self)]
+        return [(start, end) for start, end in zip(self.layer_starts, ends) if end > start]
+
+    def layer_of(self, line_idx):
+        """return the index of the layer holding the given meaningful line"""
+        return max(0, bisect.bisect_right(self.layer_starts, line_idx) - 1)
+
+
+class GCodeComparator(object):
+    """Compare programs, numeric arguments being considered equal within a tolerance.
+
+    tolerances maps argument names ('x', 'e', ...) to a specific tolerance, other arguments use tolerance,
+    defaulting to PyLine.EQ_EPSILON."""
+
+    def __init__(self, tolerance=None, tolerances=None):
+        self.tolerance = tolerance
+        self.tolerances = tolerances or {}
+
+    def get_tolerances(self):
+        default = PyLine.EQ_EPSILON if self.tolerance is None else self.tolerance
+        return [self.tolerances.get(bit, default) for bit in gcode_possible_arguments]
+
+    def equal(self, lhs, rhs):
+        """return True if both programs have the same meaningful lines, within tolerance"""
+        lhs_columns = ProgramColumns(lhs)
+        rhs_columns = ProgramColumns(rhs)
+
+        # fast path for identical programs
+        if lhs_columns.keys == rhs_columns.keys:
+            return True
+
+        if len(lhs_columns) != len(rhs_columns) or lhs_columns.commands != rhs_columns.commands:
+            return False
+
+        return not self.mismatches(lhs_columns, 0, rhs_columns, 0, len(lhs_columns))
+
+    def mismatches(self, lhs_columns, lhs_start, rhs_columns, rhs_start, count):
+        """return the offsets, in [0, count), of line pairs whose numeric arguments differ by more than the
+        tolerance"""
+        width = len(gcode_possible_arguments)
+        tolerances = self.get_tolerances()
+
+        if numpy is not None:
+            lhs = numpy.frombuffer(lhs_columns.values, dtype=float)[lhs_start * width:(lhs_start + count) * width]
+            rhs = numpy.frombuffer(rhs_columns.values, dtype=float)[rhs_start * width:(rhs_start + count) * width]
+            lhs = lhs.reshape((count, width))
+            rhs = rhs.reshape((count, width))
+            lhs_nan = numpy.isnan(lhs)
+            rhs_nan = numpy.isnan(rhs)
+            with numpy.errstate(invalid='ignore'):
+                too_far = numpy.abs(lhs - rhs) > numpy.array(tolerances)
+            return list(numpy.nonzero((too_far | (lhs_nan != rhs_nan)).any(axis=1))[0])
+
+        result = []
+        for offset in range(count):
+            lhs = lhs_columns.values[(lhs_start + offset) * width:(lhs_start + offset + 1) * width]
+            rhs = rhs_columns.values[(rhs_start + offset) * width:(rhs_start + offset + 1) * width]
+            for lhs_bit, rhs_bit, tolerance in zip(lhs, rhs, tolerances):
+                if math.isnan(lhs_bit) != math.isnan(rhs_bit) or math.fabs(lhs_bit - rhs_bit) > tolerance:
+                    result.append(offset)
+                    break
+        return result
+
+    def diff(self, lhs, rhs):
+        """return the list of all DiffRegion between two programs.
+
+        Layers are aligned one to one when both programs have the same number of (non empty) layers, identical
+        layers being skipped. Within a layer, or over the whole program otherwise, meaningful lines are
+        aligned with a sequence matcher and pairs of lines within tolerance are not reported."""
+        lhs_columns = ProgramColumns(lhs)
+        rhs_columns = ProgramColumns(rhs)
+
+        if lhs_columns.keys == rhs_columns.keys:
+            return []
+
+        lhs_ranges = lhs_columns.layer_ranges()
+        rhs_ranges = rhs_columns.layer_ranges()
+        if len(lhs_ranges) != len(rhs_ranges):
+            lhs_ranges = [(0, len(lhs_columns))]
+            rhs_ranges = [(0, len(rhs_columns))]
+
+        regions = []
+        for (lhs_start, lhs_end), (rhs_start, rhs_end) in zip(lhs_ranges, rhs_ranges):
+            if lhs_columns.keys[lhs_start:lhs_end] == rhs_columns.keys[rhs_start:rhs_end]:
+                continue
+            regions += self.diff_range(lhs_columns, lhs_start, lhs_end, rhs_columns, rhs_start, rhs_end)
+        return regions
+
+    def quantized_keys(self, columns, start, end):
+        """keys used to align lines: numeric arguments rounded to the tolerance grid"""
+        tolerances = [tolerance or PyLine.EQ_EPSILON for tolerance in self.get_tolerances()]
+        return [(key[0],) + tuple(None if bit is None else int(round(bit / tolerance))
+                                  for bit, tolerance in zip(key[1:], tolerances))
+                for key in columns.keys[start:end]]
+
+    def diff_range(self, lhs_columns, lhs_start, lhs_end, rhs_columns, rhs_start, rhs_end):
+        matcher = difflib.SequenceMatcher(None, self.quantized_keys(lhs_columns, lhs_start, lhs_end),
+                                          self.quantized_keys(rhs_columns, rhs_start, rhs_end), autojunk=False)
+        regions = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                continue
+
+            if tag == 'replace' and i2 - i1 == j2 - j1 and \
+                    lhs_columns.commands[lhs_start + i1:lhs_start + i2] == \
+                    rhs_columns.commands[rhs_start + j1:rhs_start + j2]:
+                # lines may only differ because of the rounding used for alignment
+                mismatches = self.mismatches(lhs_columns, lhs_start + i1, rhs_columns, rhs_start + j1, i2 - i1)
+                for offsets in self._group(mismatches):
+                    regions.append(self._region(lhs_columns, lhs_start + i1 + offsets[0],
+                                                lhs_start + i1 + offsets[-1] + 1,
+                                                rhs_columns, rhs_start + j1 + offsets[0],
+                                                rhs_start + j1 + offsets[-1] + 1))
+                continue
+
+            regions.append(self._region(lhs_columns, lhs_start + i1, lhs_start + i2,
+                                        rhs_columns, rhs_start + j1, rhs_start + j2))
+        return regions
+
+    @staticmethod
+    def _group(offsets):
+        """group consecutive offsets"""
+        group = []
+        for offset in offsets:
+            if group and offset != group[-1] + 1:
+                yield group
+                group = []
+            group.append(offset)
+        if group:
+            yield group
+
+    @staticmethod
+    def _region(lhs_columns, lhs_start, lhs_end, rhs_columns, rhs_start, rhs_end):
+        return DiffRegion(lhs_columns.layer_of(lhs_start), lhs_start, lhs_end, rhs_start, rhs_end,
+                          lhs_columns.lines[lhs_start:lhs_end], rhs_columns.lines[rhs_start:rhs_end])
+
+
+def format_region(region):
+    """human readable representation of a DiffRegion"""
+    return "layer #{}, meaningful lines {}-{} vs {}-{}: {} vs {}".format(
+        region.layer, region.lhs_start, region.lhs_end, region.rhs_start, region.rhs_end,
+        [line.raw for line in region.lhs_lines], [line.raw for line in region.rhs_lines])
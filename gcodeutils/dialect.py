@@ -0,0 +1,147 @@
+"""Slicer dialect detection from a bounded number of lines at the beginning and at the end of gcode programs"""
+from __future__ import division
+
+from collections import namedtuple
+import re
+
+from gcodeutils.metadata import DEFAULT_WINDOW, read_head_tail
+
+__author__ = 'olivier'
+
+# lines looked at, at the beginning and at the end of parsed programs
+DEFAULT_LINES = 500
+
+# below that confidence, the dialect is considered unknown
+MIN_CONFIDENCE = 0.5
+
+# slicers by family, families sharing the comment conventions their filters rely on
+FAMILIES = {
+    'cura_legacy': 'cura',
+    'cura': 'cura',
+    'slic3r': 'slic3r',
+    'prusaslicer': 'slic3r',
+    'superslicer': 'slic3r',
+    'simplify3d': 'simplify3d',
+    'skeinforge': 'skeinforge',
+}
+
+# (slicers, weight, pattern) of the clues of a dialect, whose first group is the slicer version if any. Slicers
+# sharing a clue are listed in the order picked when nothing else tells them apart
+EVIDENCES = (
+    # generator comments
+    (('cura_legacy',), 0.95, re.compile(r';Generated with Cura_SteamEngine (1\d\.\S*)')),
+    (('cura',), 0.95, re.compile(r';Generated with Cura_SteamEngine ([2-9]\.\S*)')),
+    (('prusaslicer',), 0.95, re.compile(r'; generated by PrusaSlicer (\S+)')),
+    (('superslicer',), 0.95, re.compile(r'; generated by SuperSlicer (\S+)')),
+    (('slic3r',), 0.95, re.compile(r'; generated by Slic3r (\S+)')),
+    (('simplify3d',), 0.95, re.compile(r'; G-Code generated by Simplify3D\(R\) Version (\S+)')),
+    (('skeinforge',), 0.95, re.compile(r'\(<format> skeinforge gcode ')),
+    (('skeinforge',), 0.3, re.compile(r'\(<version> (\S+) ')),
+    # settings and structure comments
+    (('cura_legacy',), 0.9, re.compile(r';CURA_PROFILE_STRING:')),
+    (('cura', 'cura_legacy'), 0.6, re.compile(r';FLAVOR:')),
+    (('cura', 'cura_legacy'), 0.5, re.compile(r';LAYER_COUNT:')),
+    (('cura', 'cura_legacy'), 0.6, re.compile(r';TYPE:(?:WALL-OUTER|WALL-INNER|SKIN|FILL|SKIRT)\s*$')),
+    (('cura',), 0.4, re.compile(r';(?:MINX|MAXX|MINY|MAXY|MINZ|MAXZ):')),
+    (('prusaslicer', 'superslicer'), 0.6, re.compile(r';TYPE:(?:External perimeter|Perimeter|Solid infill)')),
+    (('prusaslicer', 'superslicer'), 0.4, re.compile(r';LAYER_CHANGE')),
+    (('prusaslicer', 'superslicer'), 0.5, re.compile(r'; (?:total )?filament used \[g\] = ')),
+    (('slic3r', 'prusaslicer', 'superslicer'), 0.7, re.compile(r'; (?:external )?perimeters extrusion width')),
+    (('slic3r', 'prusaslicer', 'superslicer'), 0.3, re.compile(r'.*; (?:perimeter|infill|skirt)\b')),
+    (('simplify3d',), 0.7, re.compile(r'; feature ')),
+    (('simplify3d',), 0.8, re.compile(r';\s+(?:layerHeight|extruderWidth|extruderDiameter),')),
+    (('skeinforge',), 0.8, re.compile(r'\((?:<edgeWidth>|<layerHeight>|<layerThickness>)')),
+    (('skeinforge',), 0.6, re.compile(r'\((?:<layer>|<edge>|<loop>|</extruderInitialization>)')),
+)
+
+
+class Dialect(namedtuple('Dialect', ('slicer', 'version', 'confidence'))):
+    """Slicer (None when unknown) and version (None when not found) of a program, with the confidence between 0 and
+    1 of the detection"""
+    __slots__ = ()
+
+    @property
+    def family(self):
+        return FAMILIES.get(self.slicer)
+
+
+UNKNOWN = Dialect(None, None, 0.)
+
+
+class DialectSniffer(object):
+    """Accumulates the clues found in lines, fed in any order. Each clue counts once, the confidence in a slicer
+    being the probability that at least one of its clues is right"""
+
+    def __init__(self):
+        self.found = set()
+        self.versions = {}
+
+    def feed(self, line):
+        line = line.strip()
+        if not line or (line[0] not in ';(' and ';' not in line):
+            return
+        for evidence, (slicers, _, pattern) in enumerate(EVIDENCES):
+            if evidence in self.found:
+                continue
+            match = pattern.match(line)
+            if match:
+                self.found.add(evidence)
+                if pattern.groups:
+                    for slicer in slicers:
+                        self.versions.setdefault(slicer, match.group(1))
+
+    def dialect(self, min_confidence=MIN_CONFIDENCE):
+        """return the most likely Dialect, UNKNOWN if none reaches min_confidence"""
+        doubts = {}
+        order = []
+        for evidence in sorted(self.found):
+            slicers, weight, _ = EVIDENCES[evidence]
+            for slicer in slicers:
+                if slicer not in doubts:
+                    doubts[slicer] = 1.
+                    order.append(slicer)
+                doubts[slicer] *= 1 - weight
+
+        best = None
+        for slicer in order:
+            if best is None or doubts[slicer] < doubts[best]:
+                best = slicer
+        if best is None or 1 - doubts[best] < min_confidence:
+            return UNKNOWN
+        return Dialect(best, self.versions.get(best), 1 - doubts[best])
+
+
+def sniff_lines(lines, min_confidence=MIN_CONFIDENCE):
+    """return the Dialect of raw lines"""
+    sniffer = DialectSniffer()
+    for line in lines:
+        sniffer.feed(line)
+    return sniffer.dialect(min_confidence)
+
+
+def sniff_gcode(gcode, line_count=DEFAULT_LINES, min_confidence=MIN_CONFIDENCE):
+    """return the Dialect of a GCode from its first and last line_count lines, only the layers holding them being
+    loaded from its layer store"""
+    head = []
+    for layer in gcode.all_layers:
+        head.extend(line.raw for line in layer[:line_count - len(head)])
+        if len(head) >= line_count:
+            break
+
+    tail = []
+    for layer_idx in range(len(gcode.all_layers) - 1, -1, -1):
+        layer = gcode.all_layers[layer_idx]
+        tail[:0] = [line.raw for line in layer[max(0, len(layer) - (line_count - len(tail))):]]
+        if len(tail) >= line_count:
+            break
+
+    return sniff_lines(head + tail, min_confidence)
+
+
+def sniff_file(gcode_file, window=DEFAULT_WINDOW, min_confidence=MIN_CONFIDENCE):
+    """return the Dialect of a seekable file from its first and last window bytes, None if it's not seekable. The
+    file is rewound"""
+    lines = read_head_tail(gcode_file, window)
+    if lines is None:
+        return None
+    return sniff_lines(lines, min_confidence)
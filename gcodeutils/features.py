@@ -0,0 +1,181 @@
+"""Feature types (outer wall, infill, ...) of gcode lines, derived from slicer comments"""
+import bisect
+from array import array
+
+__author__ = 'olivier'
+
+UNKNOWN = 0
+TRAVEL = 1
+OUTER_WALL = 2
+INNER_WALL = 3
+SKIN = 4
+INFILL = 5
+BRIDGE = 6
+GAP_FILL = 7
+SUPPORT = 8
+SUPPORT_INTERFACE = 9
+SKIRT = 10
+PRIME_TOWER = 11
+IRONING = 12
+CUSTOM = 13
+
+FEATURE_NAMES = ('unknown', 'travel', 'outer-wall', 'inner-wall', 'skin', 'infill', 'bridge', 'gap-fill', 'support',
+                 'support-interface', 'skirt', 'prime-tower', 'ironing', 'custom')
+FEATURE_CODES = dict((name, code) for code, name in enumerate(FEATURE_NAMES))
+
+# ;TYPE:<type> comment lines of Cura and PrusaSlicer (and forks), keyed by upper cased type
+TYPE_MARKER = ';TYPE:'
+TYPE_FEATURES = {
+    # Cura
+    'WALL-OUTER': OUTER_WALL,
+    'WALL-INNER': INNER_WALL,
+    'SKIN': SKIN,
+    'FILL': INFILL,
+    'SUPPORT': SUPPORT,
+    'SUPPORT-INFILL': SUPPORT,
+    'SUPPORT-INTERFACE': SUPPORT_INTERFACE,
+    'SKIRT': SKIRT,
+    'PRIME-TOWER': PRIME_TOWER,
+    # PrusaSlicer
+    'EXTERNAL PERIMETER': OUTER_WALL,
+    'OVERHANG PERIMETER': OUTER_WALL,
+    'PERIMETER': INNER_WALL,
+    'INTERNAL INFILL': INFILL,
+    'SOLID INFILL': SKIN,
+    'TOP SOLID INFILL': SKIN,
+    'BRIDGE INFILL': BRIDGE,
+    'INTERNAL BRIDGE INFILL': BRIDGE,
+    'GAP FILL': GAP_FILL,
+    'SKIRT/BRIM': SKIRT,
+    'BRIM': SKIRT,
+    'SUPPORT MATERIAL': SUPPORT,
+    'SUPPORT MATERIAL INTERFACE': SUPPORT_INTERFACE,
+    'WIPE TOWER': PRIME_TOWER,
+    'IRONING': IRONING,
+    'CUSTOM': CUSTOM,
+}
+
+# ; feature <type> comment lines of Simplify3D
+SIMPLIFY3D_MARKER = '; feature '
+SIMPLIFY3D_FEATURES = {
+    'outer perimeter': OUTER_WALL,
+    'inner perimeter': INNER_WALL,
+    'solid layer': SKIN,
+    'infill': INFILL,
+    'bridge': BRIDGE,
+    'gap fill': GAP_FILL,
+    'support': SUPPORT,
+    'dense support': SUPPORT_INTERFACE,
+    'raft': SUPPORT,
+    'skirt': SKIRT,
+    'ooze shield': SKIRT,
+    'prime pillar': PRIME_TOWER,
+}
+
+# trailing comments of Slic3r (--gcode-comments), only describing the line they end. Longest first, as they're
+# matched as prefixes
+SLIC3R_FEATURES = (
+    ('perimeter external', OUTER_WALL),
+    ('perimeter', INNER_WALL),
+    ('top solid infill', SKIN),
+    ('solid infill', SKIN),
+    ('bridge infill', BRIDGE),
+    ('infill', INFILL),
+    ('gap fill', GAP_FILL),
+    ('support material interface', SUPPORT_INTERFACE),
+    ('support material', SUPPORT),
+    ('skirt', SKIRT),
+    ('brim', SKIRT),
+)
+
+
+def comment_feature(raw):
+    """return the feature set by a feature comment line (;TYPE:..., ; feature ...), None for other lines"""
+    if raw.startswith(TYPE_MARKER):
+        return TYPE_FEATURES.get(raw[len(TYPE_MARKER):].strip().upper(), UNKNOWN)
+    if raw.startswith(SIMPLIFY3D_MARKER):
+        return SIMPLIFY3D_FEATURES.get(raw[len(SIMPLIFY3D_MARKER):].strip().lower(), UNKNOWN)
+    return None
+
+
+def trailing_comment_feature(raw):
+    """return the feature given by the trailing Slic3r comment of a line, None without one"""
+    comment_start = raw.find(';')
+    if comment_start > 0:
+        comment = raw[comment_start + 1:].strip()
+        for prefix, feature in SLIC3R_FEATURES:
+            if comment.startswith(prefix):
+                return feature
+    return None
+
+
+class FeatureClassifier(object):
+    """Stateful classifier of parsed lines, fed in program order.
+
+    Feature comment lines (;TYPE:..., ; feature ...) set the feature of the following lines, trailing Slic3r comments
+    set the feature of their own line only and other moves not extruding in the XY plane are travel."""
+
+    def __init__(self):
+        self.feature = UNKNOWN
+
+    def classify(self, line):
+        """return the feature code of a line"""
+        raw = line.raw
+
+        if raw.startswith(';'):
+            feature = comment_feature(raw)
+            if feature is not None:
+                self.feature = feature
+            return self.feature
+
+        feature = trailing_comment_feature(raw)
+        if feature is not None:
+            return feature
+
+        if line.is_move and not (line.extruding and (line.x is not None or line.y is not None)):
+            return TRAVEL
+
+        return self.feature
+
+
+class FeatureRuns(object):
+    """Runs of consecutive lines sharing the same feature, built from a per line feature index.
+
+    Runs are stored as their first line index and feature code, in program order, with the runs of each feature
+    listed separately so that they can be visited without scanning the other lines."""
+
+    def __init__(self, feature_index):
+        self.line_count = len(feature_index)
+        self.starts = array('I')
+        self.codes = array('B')
+        self.by_feature = {}
+
+        previous = None
+        for line_idx, code in enumerate(feature_index):
+            if code != previous:
+                self.by_feature.setdefault(code, array('I')).append(len(self.starts))
+                self.starts.append(line_idx)
+                self.codes.append(code)
+                previous = code
+
+    def __len__(self):
+        return len(self.starts)
+
+    def span(self, run):
+        """return the (start, stop) line indices of a run"""
+        stop = self.starts[run + 1] if run + 1 < len(self.starts) else self.line_count
+        return self.starts[run], stop
+
+    def runs(self, *features):
+        """return the (feature, start, stop) runs of the given features (all if none), in program order"""
+        if features:
+            runs = sorted(run for feature in features for run in self.by_feature.get(feature, ()))
+        else:
+            runs = range(len(self.starts))
+        return [(self.codes[run],) + self.span(run) for run in runs]
+
+    def feature_at(self, line_idx):
+        """return the feature code of a line, given its index in the program"""
+        if not 0 <= line_idx < self.line_count:
+            raise IndexError("line index out of range")
+        return self.codes[bisect.bisect_right(self.starts, line_idx) - 1]
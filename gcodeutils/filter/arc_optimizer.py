@@ -11,7 +11,9 @@ import cmath
 import logging
 from math import sqrt, sin
 
-from gcodeutils.filter.filter import GCodeFilter
+from gcodeutils.filter.cache import NotCacheable
+from gcodeutils.filter.filter import GCodeFilter, KEEP, context_attribute
+from gcodeutils.filter.stream import StreamFilter, end_of_loop
 from gcodeutils.gcoder import Line, move_gcodes, unsplit
 
 
@@ -20,6 +22,7 @@ __author__ = 'Eyck Jentzsch <eyck@jepemuc.de>'
 # constraints for the detection algorithm
 MIN_SEGMENTS = 8  # number is segments forming an arc
 # MAX_SEGMENTS = 32             # number of max segments forming an arc
+MAX_LOOKAHEAD = 1000  # lines buffered ahead when streaming, an arc still growing past them is ended there
 MAX_RADIUS = 200  # mm, maximum radius of the detectable circle
 ALIGNMENT_ERROR = 0.015  # 15 µm, max. offset a point might be off of the resulting circle
 PHASE_ERROR = 5 * cmath.pi / 180  # 5° in radian, max deviation of the angle steps forming a circle
@@ -81,14 +84,22 @@ class Circle(object):
         return "CCW-" + circle_str if self.direction > 0.0 else "CW-" + circle_str
 
 
-class GCodeArcOptimizerFilter(GCodeFilter):
+class GCodeArcOptimizerFilter(GCodeFilter, StreamFilter):
     """filter replacing subsequent G1 moves with G2/G3 (cirle c/cw if applicable"""
 
-    queue = []
-    valid_circle = False
+    # moves which may be part of an arc and whether they form one
+    queue = context_attribute('queue')
+    valid_circle = context_attribute('valid_circle')
 
-    def __init__(self):
-        self.queue = []
+    # when streaming, arcs are looked for within the loop starting at the current line
+    lookahead = staticmethod(end_of_loop)
+    max_lookahead = MAX_LOOKAHEAD
+
+    def new_context(self):
+        context = super(GCodeArcOptimizerFilter, self).new_context()
+        context.queue = []
+        context.valid_circle = False
+        return context
 
     @staticmethod
     def phase_diff(phase1, phase2):
@@ -118,11 +129,23 @@ class GCodeArcOptimizerFilter(GCodeFilter):
 #         """
 #         return opcode
 
-    def parse_gcode(self, gcode, opcode_filter):
-        for layer in gcode.all_layers:
-            self.parse_layer(layer, opcode_filter)
-        if len(self.queue) > 0:
-            layer += self.queue
+    def get_parameters(self):
+        return (MIN_SEGMENTS, MAX_RADIUS, ALIGNMENT_ERROR, PHASE_ERROR, EXTRUSION_ERROR,
+                EXTRUSION_CORRECTION_LIMIT)
+
+    def get_carried_state(self):
+        if self.queue:
+            # pending moves span several layers
+            raise NotCacheable("arc detection queue isn't empty")
+        return self.valid_circle
+
+    def set_carried_state(self, state):
+        self.queue = []
+        self.valid_circle = state
+
+    def flush(self):
+        pending, self.queue = self.queue, []
+        return pending
 
     def get_circle_least_squares(self):
         """
@@ -238,9 +261,17 @@ class GCodeArcOptimizerFilter(GCodeFilter):
         prev = None
         for num, line in enumerate(self.queue):
             if prev is not None:
-                path = round(Point(line.current_x, line.current_y).distance_to(
-                    Point(prev.current_x, prev.current_y)), 7)
-                extrusion = line.e if line.relative_e else (line.current_e - prev.current_e)
+                segment = None
+                if self.segments is not None:
+                    segment = self.segments.segment(line, self.current_layer_idx)
+                if segment is not None:
+                    path = round(segment.xy_length, 7)
+                    extrusion = segment.extrusion
+                else:
+                    # line created or carried over from older layers, not in the segment table
+                    path = round(Point(line.current_x, line.current_y).distance_to(
+                        Point(prev.current_x, prev.current_y)), 7)
+                    extrusion = line.e if line.relative_e else (line.current_e - prev.current_e)
                 extrusions['total']['filament'] += extrusion
                 extrusions['total']['path'] += path
                 extrusions['filament'][num] = extrusion
@@ -325,7 +356,8 @@ class GCodeArcOptimizerFilter(GCodeFilter):
             if (rel - 1) > EXTRUSION_CORRECTION_LIMIT:
                 op2 = Line()
                 op2.command = "G92"
-                op2.e = op2.current_e = end_point.current_e
+                op2.e = end_point.e
+                op2.current_e = end_point.current_e
                 unsplit(op2)
                 op2.raw += "; generated as arc to path relation is %f" % rel
                 result.append(op2)
@@ -388,4 +420,36 @@ class GCodeArcOptimizerFilter(GCodeFilter):
                 result = self.queue
                 self.queue = []
                 self.valid_circle = False
-                return result
\ No newline at end of file
+                return result
+
+    def process(self, window):
+        """
+        stream the lines through opcode_filter from the current one on, until it tells what becomes of the current
+        line: kept as is, or starting an arc replacing the moves after it, which are then consumed
+        :param window: the window of the current line
+        :return: the current line and the generated arc if any
+        """
+        lines = [window.current] + window.upcoming()
+        self.queue = []
+        self.valid_circle = False
+        try:
+            for idx, line in enumerate(lines):
+                result = self.opcode_filter(line)
+                if isinstance(result, list) and not result:
+                    continue
+                if isinstance(result, list) and len(result) > 1 and result[1] is not lines[1]:
+                    # to_gcode replaced the moves up to the one before this line by an arc, this line is streamed
+                    # again as the next current one
+                    window.consume(idx - 1)
+                    return result[:-1] if result[-1] is line else result
+                # the current line was handed back as is, the next ones are streamed again
+                return KEEP
+            if window.to_end or not self.valid_circle:
+                # pending moves are left as is at the end of the input
+                return KEEP
+            # the arc grew past the lookahead: end it before the last buffered line, which starts the next one
+            result = self.to_gcode()
+            window.consume(len(lines) - 2)
+            return result[:-1]
+        finally:
+            self.queue = []
@@ -0,0 +1,152 @@
+"""Persistent cache of per layer filter results"""
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+from gcodeutils.gcoder import machine_state_attributes
+from gcodeutils.layer_store import serialize_layer, deserialize_layer
+
+__author__ = 'olivier'
+
+# machine state attributes of a line used as the entry state of the next layer. The extruder position depends on the
+# extrusion of all the previous layers, cached layers are shifted to it instead
+ENTRY_STATE_ATTRIBUTES = tuple(bit for bit in machine_state_attributes if bit != 'current_e')
+
+CACHE_ENTRY_SUFFIX = '.layer'
+
+logger = logging.getLogger('filter_cache')
+
+
+class NotCacheable(Exception):
+    """raised by filters whose current state doesn't allow to cache the result of a layer"""
+    pass
+
+
+def entry_state(previous_line):
+    """return the machine state at the beginning of a layer and the extruder position, given the last line of the
+    previous layer"""
+    if previous_line is None:
+        return None, 0
+    return tuple(getattr(previous_line, bit) for bit in ENTRY_STATE_ATTRIBUTES), previous_line.current_e or 0
+
+
+def shift_extruder_position(layer, offset):
+    """add offset to the extruder position of the lines of a layer"""
+    if not offset:
+        return
+    for line in layer:
+        if line.current_e is not None:
+            line.current_e += offset
+
+
+class LayerResultCache(object):
+    """On disk cache of filtered layers.
+
+    Entries are keyed by the layer fingerprint, the machine state at the beginning of the layer (but the extruder
+    position) and the filter parameters and carried state. They hold the filtered layer, shifted to the extruder
+    position of the layer it is spliced in, the extruder position at the beginning of the layer and the filter
+    carried state after the layer.
+    When the cache grows above max_size bytes, least recently used entries are removed."""
+
+    def __init__(self, directory, max_size=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, layer_filter, layer, state):
+        """return the cache key of a layer, raise NotCacheable if the filter doesn't support caching"""
+        parameters = layer_filter.get_parameters()
+        if parameters is None:
+            raise NotCacheable("{} doesn't support caching".format(type(layer_filter).__name__))
+
+        key = repr((type(layer_filter).__module__, type(layer_filter).__name__, parameters,
+                    layer.fingerprint(), state[0], layer_filter.get_carried_state()))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def run(self, layer_filter, layer, state, compute):
+        """filter a layer with compute(), unless its result is already known in which case it is spliced in
+        the layer and the filter carried state is restored. state is the machine state at the beginning of the
+        layer, as returned by entry_state()"""
+        try:
+            key = self.key(layer_filter, layer, state)
+        except NotCacheable:
+            compute()
+            return False
+
+        entry = self.get(key)
+        if entry is not None:
+            record, entry_e, carried_state = entry
+            layer[:] = deserialize_layer(record)
+            shift_extruder_position(layer, state[1] - entry_e)
+            layer_filter.set_carried_state(carried_state)
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        compute()
+
+        try:
+            self.put(key, (serialize_layer(layer), state[1], layer_filter.get_carried_state()))
+        except NotCacheable:
+            pass
+        return False
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + CACHE_ENTRY_SUFFIX)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                entry = pickle.load(entry_file)
+            # keep track of usage for eviction
+            os.utime(path, None)
+            return entry
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, key, entry):
+        # write to a temporary file first so that concurrent processes never see partial entries
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as entry_file:
+            pickle.dump(entry, entry_file, 2)
+        os.rename(temp_path, self._path(key))
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self._entries())
+        else:
+            self.size += os.path.getsize(self._path(key))
+
+        if self.size > self.max_size:
+            self.evict()
+
+    def _entries(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_ENTRY_SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        """remove least recently used entries until the cache is back to 3/4 of its maximum size"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self.size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.size <= self.max_size * 3 // 4:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+        logger.debug("cache evicted down to %d bytes", self.size)
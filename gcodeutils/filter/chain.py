@@ -0,0 +1,75 @@
+from gcodeutils.filter.filter import GCodeFilter, KEEP, result_lines, CARRIED_STATE, LAYER_STATE, STATELESS
+
+__author__ = 'olivier'
+
+
+class FilterChain(GCodeFilter):
+    """filter applying several filters in a single traversal of each layer, the lines resulting from a filter being
+    fed to the next one. Equivalent to running the filters one after the other as long as they only look at the
+    lines they're given."""
+
+    def __init__(self, *filters):
+        self.filters = filters
+
+    @property
+    def state_dependency(self):
+        # the state carried by a filter depends on the lines filtered by the previous ones, so that a chain can't be
+        # scanned and carrying state makes it run serially
+        dependencies = set(layer_filter.state_dependency for layer_filter in self.filters)
+        for dependency in (CARRIED_STATE, LAYER_STATE):
+            if dependency in dependencies:
+                return dependency
+        return STATELESS
+
+    def get_parameters(self):
+        parameters = []
+        for layer_filter in self.filters:
+            filter_parameters = layer_filter.get_parameters()
+            if filter_parameters is None:
+                return None
+            parameters.append((type(layer_filter).__module__, type(layer_filter).__name__, filter_parameters))
+        return tuple(parameters)
+
+    def get_carried_state(self):
+        return tuple(layer_filter.get_carried_state() for layer_filter in self.filters)
+
+    def set_carried_state(self, state):
+        for layer_filter, filter_state in zip(self.filters, state):
+            layer_filter.set_carried_state(filter_state)
+
+    def parse_layer(self, layer, opcode_filter):
+        for layer_filter in self.filters:
+            layer_filter.segments = self.segments
+            layer_filter.current_layer_idx = self.current_layer_idx
+        super(FilterChain, self).parse_layer(layer, opcode_filter)
+
+    def _feed(self, lines, start):
+        """return the lines resulting from filtering lines with the filters from the start one, None if they're
+        kept as is"""
+        changed = False
+        for layer_filter in self.filters[start:]:
+            filtered = []
+            for line in lines:
+                result = layer_filter.opcode_filter(line)
+                if result is not KEEP and result is not line:
+                    changed = True
+                filtered += result_lines(line, result)
+            lines = filtered
+        return lines if changed else None
+
+    def opcode_filter(self, opcode):
+        lines = self._feed([opcode], 0)
+        if lines is None:
+            return KEEP
+        if len(lines) == 1 and lines[0] is opcode:
+            return opcode
+        return lines
+
+    def flush(self):
+        pending = []
+        for position, layer_filter in enumerate(self.filters):
+            # lines held back by a filter still go through the next ones, which may hold them back in turn
+            lines = list(layer_filter.flush())
+            filtered = self._feed(lines, position + 1)
+            pending += lines if filtered is None else filtered
+        return pending
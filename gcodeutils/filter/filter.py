@@ -1,33 +1,172 @@
+import threading
+
+from gcodeutils.filter.cache import entry_state
+
 __author__ = 'olivier'
 
+# opcode_filter results other than a line replacing the filtered one or a list of lines expanding it
+KEEP = None
+DROP = ()
+
+# how the filtering of a line depends on the lines before it: not at all, on the lines of the same layer only, or on
+# state carried from the previous layers
+STATELESS = 'stateless'
+LAYER_STATE = 'layer'
+CARRIED_STATE = 'carried'
+
+
+def result_lines(opcode, result):
+    """return the lines resulting from the filtering of an opcode"""
+    if result is KEEP:
+        return [opcode]
+    if isinstance(result, (list, tuple)):
+        return result
+    return [result]
+
+
+class FilterContext(object):
+    """state of a filter during the traversal of a program"""
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+def context_attribute(name):
+    """return a property keeping a filter attribute in its current context"""
+
+    def get(self):
+        return getattr(self.context, name)
+
+    def set(self, value):
+        setattr(self.context, name, value)
+
+    return property(get, set)
+
+
+class ContextualFilter(object):
+    """base class of filters keeping the state of their traversals in FilterContexts, so that a filter can be used
+    by several threads at the same time.
+
+    The state of a traversal is declared with context_attribute and initialized by new_context. Each thread works on
+    its own context, created on first use, unless one is given to it through the context property. Contexts aren't
+    part of pickled filters."""
+
+    def new_context(self):
+        """return the context of a new traversal of a program"""
+        return FilterContext()
+
+    def _get_context(self):
+        local = self.__dict__.get('_local')
+        if local is None:
+            local = self.__dict__.setdefault('_local', threading.local())
+        context = getattr(local, 'context', None)
+        if context is None:
+            context = local.context = self.new_context()
+        return context
 
-class GCodeFilter(object):
+    def _set_context(self, context):
+        self._get_context()
+        self._local.context = context
+
+    context = property(_get_context, _set_context)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_local', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+class GCodeFilter(ContextualFilter):
     """abstract base filter class"""
 
+    # optional LayerResultCache used to skip layers already filtered in a previous run
+    cache = context_attribute('cache')
+
+    # SegmentTable of the program being filtered and index of the layer being filtered
+    segments = context_attribute('segments')
+    current_layer_idx = context_attribute('current_layer_idx')
+
+    # dependency of the filtering on previous lines, see ParallelFilterRunner
+    state_dependency = CARRIED_STATE
+
+    def new_context(self):
+        return FilterContext(cache=None, segments=None, current_layer_idx=None)
+
     def opcode_filter(self, x):
+        """return KEEP to leave a line as is, DROP to remove it, a line to replace it (possibly itself, modified in
+        place) or a list of lines to expand it"""
         raise NotImplementedError
 
-    def filter(self, gcode):
+    def flush(self):
+        """return the lines held back by the filter, appended to the program once all lines are filtered"""
+        return DROP
+
+    def get_parameters(self):
+        """return the filter settings (anything with a stable repr), None if the filter results can't be cached"""
+        return None
+
+    def get_carried_state(self):
+        """return the filter state carried from one layer to the next one, it must be picklable. Raise
+        NotCacheable if the current state can't be captured."""
+        return None
+
+    def set_carried_state(self, state):
+        """restore a state returned by get_carried_state"""
+        pass
+
+    def scan_layer(self, layer):
+        """update the carried state as filtering layer would, without filtering it. Raise NotImplementedError if the
+        state can't be known without filtering."""
+        raise NotImplementedError
+
+    def filter(self, gcode, cache=None):
+        self.cache = cache
         self.parse_gcode(gcode, self.opcode_filter)
 
     def parse_gcode(self, gcode, opcode_filter):
-        for layer in gcode.all_layers:
-            self.parse_layer(layer, opcode_filter)
+        self.segments = gcode.segments
+        state = entry_state(None)
+        for self.current_layer_idx, layer in enumerate(gcode.all_layers):
+            if self.cache is None:
+                self.parse_layer(layer, opcode_filter)
+                continue
+
+            # lines may be modified in place by filtering, get the state for the next layer first
+            next_state = entry_state(layer[-1]) if layer else state
+            self.cache.run(self, layer, state, lambda: self.parse_layer(layer, opcode_filter))
+            state = next_state
+
+        pending = self.flush()
+        if pending and gcode.all_layers:
+            gcode.all_layers[-1] += pending
 
     def parse_layer(self, layer, opcode_filter):
-        dirty_layer = False
-        new_layer = []
-        for opcode in layer:
+        # the new layer is only built from the first line not kept as is
+        new_layer = None
+        modified = False
+        for line_idx, opcode in enumerate(layer):
             opcode_filter_result = opcode_filter(opcode)
 
-            if opcode_filter_result is not None:
-                dirty_layer = True
-                try:
-                    new_layer += opcode_filter_result
-                except TypeError:
-                    new_layer.append(opcode_filter_result)
+            if opcode_filter_result is KEEP or opcode_filter_result is opcode:
+                # a line handed back may have been modified in place
+                modified = modified or opcode_filter_result is opcode
+                if new_layer is not None:
+                    new_layer.append(opcode)
+                continue
+
+            if new_layer is None:
+                new_layer = layer[:line_idx]
+            if isinstance(opcode_filter_result, (list, tuple)):
+                new_layer += opcode_filter_result
             else:
-                new_layer.append(opcode)
+                new_layer.append(opcode_filter_result)
 
-        if dirty_layer:
+        if new_layer is not None:
             layer[:] = new_layer
+        if (modified or new_layer is not None) and self.segments is not None and self.current_layer_idx is not None:
+            # segments of the next layer start at the end of this one
+            self.segments.invalidate(self.current_layer_idx)
+            self.segments.invalidate(self.current_layer_idx + 1)
@@ -0,0 +1,164 @@
+"""Filtering of layers in parallel over a pool of processes or threads"""
+from itertools import chain
+import logging
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+import pickle
+import sys
+
+from gcodeutils.filter.cache import NotCacheable
+from gcodeutils.filter.filter import CARRIED_STATE
+from gcodeutils.layer_store import serialize_layer, deserialize_layer
+from gcodeutils.shared_layers import SHARED_MEMORY, SharedLayers, export_layers, import_all_layers, prepare_workers
+
+__author__ = 'olivier'
+
+# number of chunks of consecutive layers given to each process
+CHUNKS_PER_JOB = 4
+
+logger = logging.getLogger('parallel_filter')
+
+
+def free_threading():
+    """return whether threads run Python code in parallel, as on free-threaded CPython builds with the GIL disabled"""
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def filter_chunk(layer_filter, carried_state, first_layer_idx, layers):
+    """filter a chunk of consecutive layers in place in a new context of the filter"""
+    layer_filter.context = layer_filter.new_context()
+    if layer_filter.state_dependency == CARRIED_STATE:
+        layer_filter.set_carried_state(carried_state)
+
+    for layer_filter.current_layer_idx, layer in enumerate(layers, first_layer_idx):
+        layer_filter.parse_layer(layer, layer_filter.opcode_filter)
+    return layers
+
+
+def filter_records(task):
+    """filter a chunk of consecutive serialized layers in a process, return their serialized result"""
+    pickled_filter, carried_state, first_layer_idx, records = task
+    layers = [deserialize_layer(record, compress=False) for record in records]
+    filter_chunk(pickle.loads(pickled_filter), carried_state, first_layer_idx, layers)
+    return [serialize_layer(layer, compress=False) for layer in layers]
+
+
+def filter_shared(task):
+    """filter a chunk of consecutive layers read from shared memory in a process, return the handle of the filtered
+    layers exported to shared memory"""
+    pickled_filter, carried_state, first_layer_idx, handle, layer_count = task
+    shared = SharedLayers.attach(handle)
+    try:
+        layers = [shared[layer_idx] for layer_idx in range(first_layer_idx, first_layer_idx + layer_count)]
+    finally:
+        shared.close()
+    filter_chunk(pickle.loads(pickled_filter), carried_state, first_layer_idx, layers)
+    return export_layers(layers)
+
+
+class ParallelFilterRunner(object):
+    """Filter the layers of a program over several processes, or threads, with the same result as
+    layer_filter.filter().
+
+    The filter state_dependency tells how layers can be filtered independently. Filters carrying state from a layer
+    to the next one first go through the program with scan_layer, which gives the state at the beginning of each
+    chunk of layers. Filters which can't be scanned run serially.
+
+    Processes get a copy of the filter and of the layers, threads share them and filter each chunk in its own
+    filter context. Threads are used by default on free-threaded Python builds. Layers go to and come back from
+    processes through shared memory where available (see gcodeutils.shared_layers), serialized otherwise."""
+
+    def __init__(self, layer_filter, jobs=None, chunk_size=None, threads=None, shared_memory=None):
+        self.layer_filter = layer_filter
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+        self.threads = free_threading() if threads is None else threads
+        self.shared_memory = SHARED_MEMORY if shared_memory is None else shared_memory
+
+    def get_chunk_size(self, layer_count, jobs):
+        if self.chunk_size is not None:
+            return self.chunk_size
+        return max(1, -(-layer_count // (jobs * CHUNKS_PER_JOB)))
+
+    def get_chunks(self, layers, chunk_size):
+        """return the carried state, first layer index and layers of each chunk of layers, the layers being
+        serialized for processes not using shared memory, None if the filter carries state but can't be scanned. The
+        filter is left in its state after the last layer."""
+        layer_filter = self.layer_filter
+        carried = layer_filter.state_dependency == CARRIED_STATE
+        initial_state = layer_filter.get_carried_state() if carried else None
+        shared = self.threads or self.shared_memory
+
+        chunks = []
+        try:
+            for layer_idx, layer in enumerate(layers):
+                if layer_idx % chunk_size == 0:
+                    chunks.append((layer_filter.get_carried_state() if carried else None, layer_idx, []))
+                chunks[-1][-1].append(layer if shared else serialize_layer(layer, compress=False))
+                if carried:
+                    layer_filter.scan_layer(layer)
+        except (NotImplementedError, NotCacheable):
+            layer_filter.set_carried_state(initial_state)
+            return None
+        return chunks
+
+    def filter(self, gcode):
+        layer_filter = self.layer_filter
+        layers = gcode.all_layers
+        jobs = self.jobs or cpu_count()
+
+        chunks = None
+        if jobs > 1 and len(layers) > 1:
+            # the filter is sent to the processes as it is before filtering, without its context
+            pickled_filter = None if self.threads else pickle.dumps(layer_filter, pickle.HIGHEST_PROTOCOL)
+            chunks = self.get_chunks(layers, self.get_chunk_size(len(layers), jobs))
+            if chunks is None:
+                logger.info("%s can't be scanned, filtering serially", type(layer_filter).__name__)
+        if chunks is None:
+            layer_filter.filter(gcode)
+            return
+
+        if self.threads:
+            pool = ThreadPool(jobs)
+            try:
+                results = pool.map(lambda chunk: filter_chunk(layer_filter, *chunk), chunks)
+            finally:
+                pool.close()
+                pool.join()
+
+            # layers are filtered in place, hand them back in case they come from a layer store
+            for layer_idx, layer in enumerate(chain.from_iterable(results)):
+                layers[layer_idx] = layer
+        elif self.shared_memory:
+            # filtered layers are new objects, assign them by index so that a layer store keeps them
+            prepare_workers()
+            shared = SharedLayers.create(chain.from_iterable(chunk[-1] for chunk in chunks))
+            pool = Pool(jobs)
+            try:
+                filtered_layers = import_all_layers(pool.imap(filter_shared, [
+                    (pickled_filter, carried_state, first_layer_idx, shared.handle, len(chunk_layers))
+                    for carried_state, first_layer_idx, chunk_layers in chunks]))
+            finally:
+                pool.close()
+                pool.join()
+                shared.unlink()
+
+            for layer_idx, layer in enumerate(filtered_layers):
+                layers[layer_idx] = layer
+        else:
+            pool = Pool(jobs)
+            try:
+                results = pool.map(filter_records, [(pickled_filter,) + chunk for chunk in chunks])
+            finally:
+                pool.close()
+                pool.join()
+
+            for layer_idx, record in enumerate(chain.from_iterable(results)):
+                layers[layer_idx] = deserialize_layer(record, compress=False)
+
+        pending = layer_filter.flush()
+        if pending and layers:
+            layers[-1] += pending
+        # chunks are filtered without the segment table, which may not match the filtered layers anymore
+        gcode.segments.invalidate()
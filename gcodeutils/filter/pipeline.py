@@ -0,0 +1,150 @@
+"""Pipelined filtering: reading, parsing, filtering and serialization run in their own threads, connected by bounded
+queues of layer-sized batches of lines, so that the program is written while it is still being read"""
+from itertools import chain
+import logging
+import threading
+
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
+
+from gcodeutils.filter.stream import parse_lines, run_pipeline
+
+__author__ = 'olivier'
+
+# most lines in a batch, batches otherwise ending with layers
+DEFAULT_BATCH_SIZE = 2000
+
+# most batches waiting between two stages, a stage blocking when the next one lags behind
+DEFAULT_QUEUE_SIZE = 4
+
+# seconds between checks of a failure in another stage while waiting on a queue
+POLL_INTERVAL = 0.1
+
+# end of stream marker
+END = object()
+
+logger = logging.getLogger('pipeline')
+
+
+def read_batches(input_file, batch_size=DEFAULT_BATCH_SIZE):
+    """yield lists of batch_size raw lines of input_file, which can be any file object such as a gzip.open one, its
+    decompression then taking place in the reading stage"""
+    batch = []
+    for raw in input_file:
+        batch.append(raw)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def layer_batches(lines, batch_size=DEFAULT_BATCH_SIZE):
+    """yield lists of lines, a new list being started by moves changing Z or after batch_size lines"""
+    batch = []
+    z = None
+    for line in lines:
+        if line.is_move and line.current_z != z:
+            z = line.current_z
+            if batch:
+                yield batch
+                batch = []
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def serialize_batches(batches):
+    """yield the text of batches of lines"""
+    for batch in batches:
+        yield "".join(line.raw + "\n" for line in batch)
+
+
+class Pipeline(object):
+    """run streaming filters (see gcodeutils.filter.stream) over a program with one thread per stage.
+
+    Stages only wait on their neighbours through bounded queues, which keeps memory bounded and lets I/O (and
+    decompression) overlap with parsing and filtering. The first failing stage stops the whole pipeline and its
+    exception is raised by run."""
+
+    def __init__(self, filters=(), batch_size=DEFAULT_BATCH_SIZE, queue_size=DEFAULT_QUEUE_SIZE):
+        self.filters = filters
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.stopped = threading.Event()
+        self.errors = []
+
+    def stages(self, input_file):
+        """return the functions turning an iterator of batches into the iterator of batches of the next stage, the
+        first one ignoring its argument"""
+        return [lambda _: read_batches(input_file, self.batch_size),
+                lambda batches: layer_batches(parse_lines(chain.from_iterable(batches)), self.batch_size),
+                lambda batches: layer_batches(run_pipeline(chain.from_iterable(batches), *self.filters),
+                                              self.batch_size),
+                serialize_batches]
+
+    def run(self, input_file, output_file):
+        """filter input_file into output_file"""
+        self.stopped.clear()
+        self.errors = []
+
+        queue = None
+        threads = []
+        for stage in self.stages(input_file):
+            target = Queue(self.queue_size)
+            thread = threading.Thread(target=self._run_stage, args=(stage, queue, target))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+            queue = target
+
+        try:
+            for text in self._receive(queue):
+                output_file.write(text)
+        finally:
+            self.stopped.set()
+            for thread in threads:
+                thread.join()
+
+        if self.errors:
+            raise self.errors[0]
+
+    def _run_stage(self, stage, source, target):
+        try:
+            for batch in stage(self._receive(source) if source is not None else None):
+                if not self._send(target, batch):
+                    return
+        except Exception as error:  # pylint: disable=broad-except
+            logger.exception("pipeline stage failed")
+            self.errors.append(error)
+            self.stopped.set()
+            return
+        self._send(target, END)
+
+    def _send(self, queue, item):
+        """put item in queue once there's room for it, return False if the pipeline stopped in the meantime"""
+        while not self.stopped.is_set():
+            try:
+                queue.put(item, timeout=POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _receive(self, queue):
+        """yield the items of queue until its end or a stop of the pipeline"""
+        while True:
+            try:
+                item = queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                if self.stopped.is_set():
+                    return
+                continue
+            if item is END:
+                return
+            yield item
@@ -0,0 +1,77 @@
+import bisect
+import logging
+
+from gcodeutils.filter.filter import GCodeFilter
+from gcodeutils.planner import estimate_gcode
+
+__author__ = 'olivier'
+
+PROGRESS_COMMAND = 'M73'
+
+
+class GCodeProgressFilter(GCodeFilter):
+    """filter inserting M73 progress markers (completed percentage and remaining minutes) at regular intervals.
+
+    Insertion points are found by binary search on the cumulative time index computed while parsing the program,
+    or on the durations estimated by a motion planner when a MachineProfile is given, and markers are inserted in
+    bulk."""
+
+    def __init__(self, interval=1, profile=None):
+        self.interval = interval
+        self.profile = profile
+
+    def get_cumulative_times(self, gcode):
+        if self.profile is not None:
+            cumulative_times = []
+            elapsed = 0.
+            for duration in estimate_gcode(gcode, self.profile).line_durations:
+                elapsed += duration
+                cumulative_times.append(elapsed)
+            return cumulative_times
+
+        if not gcode.has_current_index():
+            raise ValueError("time index doesn't match the program anymore, insert progress markers before "
+                             "modifying it or use a machine profile")
+        return gcode.time_index
+
+    def get_markers(self, cumulative_times):
+        """return the (line index, percentage, remaining minutes) of markers, markers being inserted after the
+        line, -1 standing for the beginning of the program"""
+        if not cumulative_times:
+            return []
+
+        total = cumulative_times[-1]
+        markers = [(-1, 0, int(round(total / 60.)))]
+        for percentage in list(range(self.interval, 100, self.interval)) + [100]:
+            # rounding may put the last threshold past the total time
+            line_idx = min(bisect.bisect_left(cumulative_times, total * percentage / 100.),
+                           len(cumulative_times) - 1)
+            remaining = int(round((total - cumulative_times[line_idx]) / 60.))
+            if markers[-1][0] == line_idx:
+                # several thresholds reached by the same line, keep the last one
+                markers.pop()
+            markers.append((line_idx, percentage, remaining))
+        return markers
+
+    def filter(self, gcode, cache=None):
+        markers = self.get_markers(self.get_cumulative_times(gcode))
+
+        # translate program line indices into layer positions
+        layer_starts = []
+        start = 0
+        for layer in gcode.all_layers:
+            layer_starts.append(start)
+            start += len(layer)
+
+        insertions = []
+        for line_idx, percentage, remaining in markers:
+            position = line_idx + 1
+            layer_idx = max(0, bisect.bisect_right(layer_starts, position) - 1)
+            if position == start:
+                # after the very last line, stay in the last non empty layer
+                layer_idx = bisect.bisect_left(layer_starts, position) - 1
+            insertions.append((layer_idx, position - layer_starts[layer_idx],
+                               ["{} P{:d} R{:d}".format(PROGRESS_COMMAND, percentage, remaining)]))
+
+        logging.debug("inserting %d progress markers", len(insertions))
+        gcode.insert_lines(insertions)
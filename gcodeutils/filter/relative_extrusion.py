@@ -1,6 +1,7 @@
 from decimal import Decimal
 
-from gcodeutils.filter.filter import GCodeFilter
+from gcodeutils.filter.filter import GCodeFilter, CARRIED_STATE, context_attribute
+from gcodeutils.filter.stream import StreamFilter
 from gcodeutils.gcoder import GCODE_SET_POSITION_COMMAND, GCODE_RELATIVE_POSITIONING_COMMAND, move_gcodes, split, Line, \
     GCODE_ABSOLUTE_EXTRUSION_COMMAND, \
     GCODE_RELATIVE_EXTRUSION_COMMAND, raw_to_line, unsplit
@@ -8,10 +9,42 @@ from gcodeutils.gcoder import GCODE_SET_POSITION_COMMAND, GCODE_RELATIVE_POSITIO
 __author__ = 'olivier'
 
 
-class GCodeToRelativeExtrusionFilter(GCodeFilter):
-    def __init__(self):
-        self.relative_extrusion = False
-        self.current_extrusion_distance = Decimal()
+class GCodeToRelativeExtrusionFilter(GCodeFilter, StreamFilter):
+    # the extrusion distance goes on from one layer to the next one
+    state_dependency = CARRIED_STATE
+
+    relative_extrusion = context_attribute('relative_extrusion')
+    current_extrusion_distance = context_attribute('current_extrusion_distance')
+
+    def new_context(self):
+        context = super(GCodeToRelativeExtrusionFilter, self).new_context()
+        context.relative_extrusion = False
+        context.current_extrusion_distance = Decimal()
+        return context
+
+    def get_parameters(self):
+        return ()
+
+    def get_carried_state(self):
+        return self.relative_extrusion, str(self.current_extrusion_distance)
+
+    def set_carried_state(self, state):
+        self.relative_extrusion, current_extrusion_distance = state
+        self.current_extrusion_distance = Decimal(current_extrusion_distance)
+
+    def scan_layer(self, layer):
+        for opcode in layer:
+            if opcode.command == GCODE_RELATIVE_EXTRUSION_COMMAND:
+                self.relative_extrusion = True
+            elif opcode.command == GCODE_ABSOLUTE_EXTRUSION_COMMAND:
+                self.relative_extrusion = False
+            elif opcode.command == GCODE_SET_POSITION_COMMAND:
+                if opcode.e is not None:
+                    self.current_extrusion_distance = Decimal(opcode.e)
+                elif opcode.x is None and opcode.y is None and opcode.z is None:
+                    self.current_extrusion_distance = Decimal()
+            elif opcode.command in move_gcodes and not self.relative_extrusion and opcode.e is not None:
+                self.current_extrusion_distance = Decimal(opcode.e)
 
     def opcode_filter(self, opcode):
         if opcode.command == GCODE_RELATIVE_EXTRUSION_COMMAND:
@@ -0,0 +1,150 @@
+"""Streaming filters: generator stages consuming and yielding lines with bounded lookahead and lookbehind windows, so
+that pipelines run in constant memory over unbounded input"""
+from collections import deque
+
+from gcodeutils.filter.filter import DROP, result_lines
+from gcodeutils.gcoder import GCode
+
+__author__ = 'olivier'
+
+# most lines buffered ahead by filters looking ahead until a given line
+DEFAULT_MAX_LOOKAHEAD = 10000
+
+
+def end_of_loop(line):
+    """lookahead limit of filters working on whole loops: anything but an extruding move or a comment, such as the
+    next travel or Z move, ends the current loop"""
+    return line.command is not None and not (line.is_move and line.e is not None)
+
+
+def parse_lines(raw_lines):
+    """yield the lines of an iterable of raw lines, parsed with their machine state (current_x, ...) like in a
+    GCode, without keeping them"""
+    state = GCode()
+    for raw in raw_lines:
+        line = state.append(raw, store=False)
+        if line is not None:
+            yield line
+
+
+def run_pipeline(lines, *filters):
+    """return the lines resulting from streaming lines through StreamFilters one after the other"""
+    for stream_filter in filters:
+        lines = stream_filter.stream(lines)
+    return lines
+
+
+class Window(object):
+    """Lines around the line being filtered by a StreamFilter: the input lines before it (up to its lookbehind) and
+    after it (up to its lookahead)"""
+
+    def __init__(self, behind, ahead):
+        self._behind = behind
+        self._ahead = ahead
+        # whether the lines after the current one go up to the end of the input
+        self.to_end = False
+        self.consumed = 0
+
+    @property
+    def current(self):
+        return self._ahead[0]
+
+    def ahead(self, offset=1):
+        """return the line offset lines after the current one, None past the window"""
+        return self._ahead[offset] if offset < len(self._ahead) else None
+
+    def behind(self, offset=1):
+        """return the line offset lines before the current one, None past the window"""
+        return self._behind[-offset] if offset <= len(self._behind) else None
+
+    def upcoming(self):
+        """return the lines after the current one in the window"""
+        return list(self._ahead)[1:]
+
+    def previous(self):
+        """return the lines before the current one in the window"""
+        return list(self._behind)
+
+    def consume(self, count):
+        """tell that the result of the current line replaces the count lines after it as well, which are then not
+        filtered"""
+        if not 0 <= count < len(self._ahead):
+            raise IndexError("only the lines of the window can be consumed")
+        self.consumed = count
+
+
+class StreamFilter(object):
+    """abstract base streaming filter class.
+
+    lookahead is either a number of lines or a predicate telling the last line needed after the current one
+    (e.g. end_of_loop), in which case up to max_lookahead lines are buffered. lookbehind is a number of lines. The
+    stream method owns the buffer and hands each line to process within its Window."""
+
+    lookahead = 0
+    lookbehind = 0
+    max_lookahead = DEFAULT_MAX_LOOKAHEAD
+
+    def process(self, window):
+        """return the filtering result of window.current, following the opcode_filter protocol (KEEP, DROP, a
+        replacing line or a list of lines). Filters working line by line, as GCodeFilters do, filter it with their
+        opcode_filter."""
+        return self.opcode_filter(window.current)
+
+    def flush(self):
+        """return the lines held back by the filter once all lines are processed"""
+        return DROP
+
+    def stream(self, lines):
+        """yield the filtered lines"""
+        lines = iter(lines)
+        behind = deque(maxlen=self.lookbehind or 0)
+        ahead = deque()
+        window = Window(behind, ahead)
+
+        until = self.lookahead if callable(self.lookahead) else None
+        # whether each buffered line ends the lookahead, and how many of the lines after the current one do
+        stops = deque()
+        stop_count = 0
+
+        while True:
+            while not window.to_end:
+                if until is None:
+                    if len(ahead) > self.lookahead:
+                        break
+                elif ahead and (stop_count or len(ahead) > self.max_lookahead):
+                    break
+                try:
+                    line = next(lines)
+                except StopIteration:
+                    window.to_end = True
+                    break
+                ahead.append(line)
+                if until is not None:
+                    stop = len(ahead) > 1 and bool(until(line))
+                    stops.append(stop)
+                    stop_count += stop
+
+            if not ahead:
+                break
+
+            current = ahead[0]
+            window.consumed = 0
+            result = self.process(window)
+
+            # the current line and the ones consumed with it leave the window
+            for _ in range(1 + window.consumed):
+                line = ahead.popleft()
+                if until is not None:
+                    stop_count -= stops.popleft()
+                if self.lookbehind:
+                    behind.append(line)
+            if until is not None and stops and stops[0]:
+                # the next line becomes the current one, it doesn't end its own lookahead
+                stops[0] = False
+                stop_count -= 1
+
+            for line in result_lines(current, result):
+                yield line
+
+        for line in self.flush():
+            yield line
@@ -1,22 +1,63 @@
 import logging
 
-from gcodeutils.filter.filter import GCodeFilter
+from gcodeutils.filter.filter import GCodeFilter, CARRIED_STATE, context_attribute
+from gcodeutils.filter.stream import StreamFilter
 from gcodeutils.gcoder import move_gcodes, split, unsplit, GCODE_ABSOLUTE_POSITIONING_COMMAND, \
     GCODE_RELATIVE_POSITIONING_COMMAND, GCODE_SET_POSITION_COMMAND, Line, raw_to_line
 
 __author__ = 'olivier'
 
 
-class GCodeXYTranslateFilter(GCodeFilter):
+class GCodeXYTranslateFilter(GCodeFilter, StreamFilter):
     """filter translating moves in the X/Y plane"""
 
-    def __init__(self, x=None, y=None, **kwargs):
-        self.translate_x = x or 0.
-        self.translate_y = y or 0.
+    state_dependency = CARRIED_STATE
+
+    # translation left to apply, reset by position setting
+    translate_x = context_attribute('translate_x')
+    translate_y = context_attribute('translate_y')
 
-        self.first_move_after_home = False
+    first_move_after_home = context_attribute('first_move_after_home')
+    absolute_distance_mode = context_attribute('absolute_distance_mode')  # None if when it is unknown
 
-        self.absolute_distance_mode = None  # None if when it is unknown
+    def __init__(self, x=None, y=None, **kwargs):
+        self.x = x or 0.
+        self.y = y or 0.
+
+    def new_context(self):
+        context = super(GCodeXYTranslateFilter, self).new_context()
+        context.translate_x = self.x
+        context.translate_y = self.y
+        context.first_move_after_home = False
+        context.absolute_distance_mode = None
+        return context
+
+    def get_parameters(self):
+        # the translation itself is part of the carried state as it is reset by position setting
+        return ()
+
+    def get_carried_state(self):
+        return self.translate_x, self.translate_y, self.first_move_after_home, self.absolute_distance_mode
+
+    def set_carried_state(self, state):
+        self.translate_x, self.translate_y, self.first_move_after_home, self.absolute_distance_mode = state
+
+    def scan_layer(self, layer):
+        for opcode in layer:
+            if opcode.command in move_gcodes:
+                if self.absolute_distance_mode is False:
+                    self.first_move_after_home = False
+            elif opcode.command == GCODE_ABSOLUTE_POSITIONING_COMMAND:
+                self.absolute_distance_mode = True
+            elif opcode.command == GCODE_RELATIVE_POSITIONING_COMMAND:
+                self.absolute_distance_mode = False
+            elif opcode.command == GCODE_SET_POSITION_COMMAND:
+                # no coordinate given is equivalent to all 0
+                reset = opcode.x is None and opcode.y is None and opcode.z is None
+                if reset or opcode.x is not None:
+                    self.translate_x = 0
+                if reset or opcode.y is not None:
+                    self.translate_y = 0
 
     def generate_translation(self):
         return raw_to_line("G0 X%.4f Y%.4f" % (self.translate_x, self.translate_y))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Check gcode programs for moves outside of the build volume, cold extrusion, extrusion jumps and excessive speeds"""
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import functools
+import logging
+import sys
+from array import array
+from collections import namedtuple
+from multiprocessing import Pool
+
+from gcodeutils.gcoder import Arc, GCode, arc_move_gcodes
+from gcodeutils.planner import AXES, load_profile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'Olivier Jolly <olivier@pcedev.com>'
+
+# commands setting the hotend temperature
+HEATER_COMMANDS = ('M104', 'M109')
+
+DEFAULT_MAX_E_JUMP = 10.
+
+# tolerance on positions (mm) and speeds (relative)
+EPSILON = 1e-3
+
+# per program columns built from the segment table
+LINT_COLUMNS = ('start_x', 'start_y', 'end_x', 'end_y', 'end_z', 'direction_x', 'direction_y', 'direction_z', 'length',
+                'extrusion', 'feedrate')
+
+Violation = namedtuple('Violation', ('line_number', 'check', 'message', 'raw'))
+
+
+class BuildVolume(namedtuple('BuildVolume', ('xmin', 'ymin', 'zmin', 'xmax', 'ymax', 'zmax'))):
+    """Reachable space of a machine, in mm"""
+    __slots__ = ()
+
+    @classmethod
+    def from_size(cls, size, origin=(0., 0., 0.)):
+        """return the volume of the given (x, y, z) size, starting at origin"""
+        return cls(*(tuple(origin) + tuple(start + length for start, length in zip(origin, size))))
+
+    def contains(self, x, y, z):
+        return (self.xmin - EPSILON <= x <= self.xmax + EPSILON and self.ymin - EPSILON <= y <= self.ymax + EPSILON and
+                self.zmin - EPSILON <= z <= self.zmax + EPSILON)
+
+
+class GCodeLinter(object):
+    """Sanity checks of a parsed program, run as array operations over the columns of its segment table
+    (vectorized with numpy when available):
+
+    - volume: moves, arc extents included, must stay inside the build volume (when given). Moves not changing the
+      position, such as retractions, aren't reported again
+    - cold-extrusion: no extrusion before a hotend heater command
+    - e-jump: the extrusion of a move, as written by GCodeToRelativeExtrusionFilter, must stay below max_e_jump
+    - speed: per axis speeds must stay below the max_velocity of the machine profile (when given)"""
+
+    def __init__(self, build_volume=None, max_e_jump=DEFAULT_MAX_E_JUMP, profile=None):
+        self.build_volume = build_volume
+        self.max_e_jump = max_e_jump
+        self.profile = profile
+
+    def lint(self, gcode, line_numbers=None):
+        """return the Violations of a GCode sorted by line number. line_numbers maps the program line indices to
+        the line numbers to report, defaulting to the 1 based line indices"""
+        lines = []
+        is_move = array('B')
+        columns = dict((column, array('d')) for column in LINT_COLUMNS)
+        for layer_idx, layer in enumerate(gcode.all_layers):
+            segments = gcode.segments.layer(layer_idx)
+            lines.extend(segments.lines)
+            is_move.extend(1 if line.is_move else 0 for line in segments.lines)
+            for column in LINT_COLUMNS:
+                columns[column].extend(getattr(segments, column))
+
+        if not lines:
+            return []
+
+        if numpy is not None:
+            flagged = self._numpy_rows(is_move, columns)
+        else:
+            flagged = self._python_rows(is_move, columns)
+
+        violations = []
+
+        def report(row, check, message):
+            line_number = line_numbers[row] if line_numbers is not None else row + 1
+            violations.append(Violation(line_number, check, message, lines[row].raw))
+
+        for row in flagged['volume']:
+            report(row, 'volume', "move to X{:.3f} Y{:.3f} Z{:.3f} outside of the build volume".format(
+                columns['end_x'][row], columns['end_y'][row], columns['end_z'][row]))
+
+        if self.build_volume is not None:
+            # arcs may sweep out of the volume between in bounds end points
+            flagged_rows = set(flagged['volume'])
+            for row, line in enumerate(lines):
+                if line.command in arc_move_gcodes and row not in flagged_rows:
+                    arc = Arc.from_move(columns['start_x'][row], columns['start_y'][row], columns['end_x'][row],
+                                        columns['end_y'][row], line.i, line.j, line.r, line.command == "G2")
+                    if arc is None:
+                        continue
+                    xmin, xmax, ymin, ymax = arc.bounds()
+                    z = columns['end_z'][row]
+                    if not (self.build_volume.contains(xmin, ymin, z) and self.build_volume.contains(xmax, ymax, z)):
+                        report(row, 'volume', "arc sweeping outside of the build volume")
+
+        first_extrusion = flagged['first_extrusion']
+        if first_extrusion is not None:
+            heated = False
+            for line in lines[:first_extrusion]:
+                if line.command in HEATER_COMMANDS:
+                    heated = True
+                    break
+            if not heated:
+                report(first_extrusion, 'cold-extrusion', "extrusion before any heater command ({})".format(
+                    ", ".join(HEATER_COMMANDS)))
+
+        for row in flagged['e-jump']:
+            report(row, 'e-jump', "extrusion of {:.3f}mm above {:.3f}mm".format(columns['extrusion'][row],
+                                                                              self.max_e_jump))
+
+        for axis, rows, speeds in flagged['speed']:
+            for row, speed in zip(rows, speeds):
+                report(row, 'speed', "{} speed {:.1f}mm/s above the machine limit of {:.1f}mm/s".format(
+                    axis.upper(), speed, self.profile.max_velocity[axis]))
+
+        violations.sort(key=lambda violation: violation.line_number)
+        return violations
+
+    def _numpy_rows(self, is_move, columns):
+        moves = numpy.frombuffer(is_move, dtype=numpy.uint8).astype(bool)
+        values = dict((column, numpy.frombuffer(columns[column], dtype=float)) for column in LINT_COLUMNS)
+        flagged = {'volume': [], 'speed': []}
+
+        if self.build_volume is not None:
+            volume = self.build_volume
+            inside = numpy.ones(len(moves), dtype=bool)
+            for column, low, high in (('end_x', volume.xmin, volume.xmax), ('end_y', volume.ymin, volume.ymax),
+                                      ('end_z', volume.zmin, volume.zmax)):
+                inside &= (values[column] >= low - EPSILON) & (values[column] <= high + EPSILON)
+            flagged['volume'] = numpy.flatnonzero(moves & (values['length'] > 0) & ~inside).tolist()
+
+        extruding = numpy.flatnonzero(moves & (values['extrusion'] > 0))
+        flagged['first_extrusion'] = int(extruding[0]) if len(extruding) else None
+
+        flagged['e-jump'] = numpy.flatnonzero(numpy.abs(values['extrusion']) > self.max_e_jump).tolist()
+
+        if self.profile is not None:
+            speeds = values['feedrate'] / 60.
+            lengths = values['length']
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                e_ratios = numpy.where(lengths > 0, numpy.abs(values['extrusion']) / lengths,
+                                       (values['extrusion'] != 0).astype(float))
+            for axis in AXES:
+                ratios = e_ratios if axis == 'e' else numpy.abs(values['direction_' + axis])
+                axis_speeds = speeds * ratios
+                rows = numpy.flatnonzero(moves & (axis_speeds > self.profile.max_velocity[axis] * (1 + EPSILON)))
+                if len(rows):
+                    flagged['speed'].append((axis, rows.tolist(), axis_speeds[rows].tolist()))
+
+        return flagged
+
+    def _python_rows(self, is_move, columns):
+        rows = range(len(is_move))
+        flagged = {'volume': [], 'speed': []}
+
+        if self.build_volume is not None:
+            end_x, end_y, end_z, length = columns['end_x'], columns['end_y'], columns['end_z'], columns['length']
+            flagged['volume'] = [row for row in rows if is_move[row] and length[row] > 0 and
+                                 not self.build_volume.contains(end_x[row], end_y[row], end_z[row])]
+
+        extrusion = columns['extrusion']
+        flagged['first_extrusion'] = next((row for row in rows if is_move[row] and extrusion[row] > 0), None)
+
+        flagged['e-jump'] = [row for row in rows if abs(extrusion[row]) > self.max_e_jump]
+
+        if self.profile is not None:
+            feedrate, length = columns['feedrate'], columns['length']
+            for axis in AXES:
+                limit = self.profile.max_velocity[axis] * (1 + EPSILON)
+                axis_rows = []
+                axis_speeds = []
+                for row in rows:
+                    if not is_move[row]:
+                        continue
+                    if axis == 'e':
+                        ratio = abs(extrusion[row]) / length[row] if length[row] > 0 else float(extrusion[row] != 0)
+                    else:
+                        ratio = abs(columns['direction_' + axis][row])
+                    speed = feedrate[row] / 60. * ratio
+                    if speed > limit:
+                        axis_rows.append(row)
+                        axis_speeds.append(speed)
+                if axis_rows:
+                    flagged['speed'].append((axis, axis_rows, axis_speeds))
+
+        return flagged
+
+
+def lint_lines(gcode_lines, linter):
+    """return the Violations of an iterable of raw gcode lines, with their line numbers in the iterable"""
+    line_numbers = array('I')
+    program = []
+    for line_number, raw in enumerate(gcode_lines, 1):
+        raw = raw.strip()
+        if raw:
+            line_numbers.append(line_number)
+            program.append(raw)
+    return linter.lint(GCode(program), line_numbers)
+
+
+def lint_file(filename, linter):
+    """return the (filename, Violations) of a gcode file"""
+    with open(filename) as gcode_file:
+        return filename, lint_lines(gcode_file, linter)
+
+
+def main():
+    """command line entry point"""
+    parser = argparse.ArgumentParser(description='Check gcode programs before sending them to a printer')
+    parser.add_argument('infiles', nargs='*', metavar='infile',
+                        help='Program filenames to check. Defaults to standard input.')
+    parser.add_argument('--volume', type=float, nargs=3, metavar=('X', 'Y', 'Z'), default=None,
+                        help='Size of the build volume (mm). Defaults to no volume check.')
+    parser.add_argument('--origin', type=float, nargs=3, metavar=('X', 'Y', 'Z'), default=[0., 0., 0.],
+                        help='Lowest coordinates of the build volume (mm). Defaults to %(default)s.')
+    parser.add_argument('--max_e_jump', type=float, default=DEFAULT_MAX_E_JUMP,
+                        help='Maximum extrusion of a single move (mm). Defaults to %(default)s.')
+    parser.add_argument('--machine', metavar='PROFILE', default=None,
+                        help='Check speeds against the limits of a machine, either a builtin profile (marlin, '
+                             'marlin_jerk, klipper) or a JSON file. Defaults to no speed check.')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Number of files checked concurrently. Defaults to %(default)s.')
+
+    parser.add_argument('--verbose', '-v', action='count', default=1, help='Verbose mode')
+    parser.add_argument('--quiet', '-q', action='count', default=0, help='Quiet mode')
+
+    args = parser.parse_args()
+
+    # count verbose and quiet flags to determine logging level
+    args.verbose -= args.quiet
+
+    if args.verbose > 1:
+        logging.root.setLevel(logging.DEBUG)
+    elif args.verbose > 0:
+        logging.root.setLevel(logging.INFO)
+
+    logging.basicConfig(format="%(levelname)s:%(message)s")
+
+    linter = GCodeLinter(build_volume=BuildVolume.from_size(args.volume, args.origin) if args.volume else None,
+                         max_e_jump=args.max_e_jump,
+                         profile=load_profile(args.machine) if args.machine is not None else None)
+
+    if not args.infiles:
+        results = [('<stdin>', lint_lines(sys.stdin, linter))]
+    elif args.jobs > 1:
+        pool = Pool(args.jobs)
+        try:
+            results = pool.map(functools.partial(lint_file, linter=linter), args.infiles)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [lint_file(filename, linter) for filename in args.infiles]
+
+    violation_count = 0
+    for filename, violations in results:
+        for violation in violations:
+            print("{}:{}: {}: {}".format(filename, violation.line_number, violation.check, violation.message))
+        violation_count += len(violations)
+        logging.info("%s: %d violations", filename, len(violations))
+
+    sys.exit(1 if violation_count else 0)
+
+
+if __name__ == "__main__":
+    main()
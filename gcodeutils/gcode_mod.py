@@ -7,15 +7,31 @@ from __future__ import division
 import argparse
 import logging
 import sys
+from gcodeutils.filter.chain import FilterChain
+from gcodeutils.filter.parallel import ParallelFilterRunner
+from gcodeutils.filter.progress import GCodeProgressFilter
 from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.pipeline import Pipeline
 
 from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.layer_store import DiskLayerStore
+from gcodeutils.planner import load_profile
+from gcodeutils.raster import embed_thumbnails
 
 __author__ = 'Olivier Jolly <olivier@pcedev.com>'
 
 from gcoder import GCode  # pylint: disable=relative-import
 
 
+def thumbnail_size(value):
+    """parse a WIDTHxHEIGHT thumbnail size"""
+    try:
+        width, height = [int(bit) for bit in value.lower().split('x')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("thumbnail size must be given as WIDTHxHEIGHT, e.g. 220x124")
+    return width, height
+
+
 def main():
     """command line entry point"""
     parser = argparse.ArgumentParser(description='Modify gcode program')
@@ -25,12 +41,34 @@ def main():
                         help='Move all gcode program by <amount> units in the Y axis.')
 
     parser.add_argument('-e', action='count', default=0, help='Convert all extrusion to relative')
+    parser.add_argument('--progress', type=int, metavar='PERCENT',
+                        help='Insert M73 progress markers every <PERCENT> percent of the printing time.')
+    parser.add_argument('--machine', metavar='PROFILE',
+                        help='Estimate the printing time used by progress markers with a motion planner for the '
+                             'given machine, either a builtin profile (marlin, marlin_jerk, klipper) or a JSON '
+                             'file.')
+    parser.add_argument('--thumbnail', type=thumbnail_size, action='append', metavar='WIDTHxHEIGHT',
+                        help='Embed a thumbnail of the given size at the beginning of the program, as slicers do. '
+                             'Can be given several times.')
 
     parser.add_argument('infile', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
                         help='Program filename to be modified. Defaults to standard input.')
     parser.add_argument('outfile', nargs='?', type=argparse.FileType('w'), default=sys.stdout,
                         help='Modified program. Defaults to standard output.')
 
+    parser.add_argument('--memory_budget', type=int, metavar='MB',
+                        help='Keep at most <MB> megabytes of parsed layers in memory, the other ones being stored in '
+                             'a temporary file. Defaults to keeping the whole program in memory.')
+
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Number of processes, or threads on free-threaded Python builds, filtering layers '
+                             'concurrently. Defaults to %(default)s.')
+
+    parser.add_argument('--stream', action='store_true',
+                        help='Filter the program line by line in constant memory, reading, filtering and writing it '
+                             'at the same time, which is only possible with the -x, -y and -e modifications. '
+                             'Defaults to parsing the whole program first.')
+
     parser.add_argument('--verbose', '-v', action='count', default=1,
                         help='Verbose mode')
     parser.add_argument('--quiet', '-q', action='count', default=0, help='Quiet mode')
@@ -47,17 +85,48 @@ def main():
 
     logging.basicConfig(format="%(levelname)s:%(message)s")
 
-    # read original GCode
-    gcode = GCode(args.infile.readlines())
+    if args.stream and (args.progress or args.thumbnail):
+        parser.error("--progress and --thumbnail need the whole program and can't be used with --stream")
 
+    # line filters are chained to go through the program once
+    line_filters = []
     if args.x is not None or args.y is not None:
-        GCodeXYTranslateFilter(**vars(args)).filter(gcode)
+        line_filters.append(GCodeXYTranslateFilter(**vars(args)))
 
     if args.e:
-        GCodeToRelativeExtrusionFilter().filter(gcode)
+        line_filters.append(GCodeToRelativeExtrusionFilter())
 
-    # write back modified gcode
-    gcode.write(args.outfile)
+    if args.stream:
+        Pipeline(line_filters).run(args.infile, args.outfile)
+        return
+
+    # read original GCode
+    if args.memory_budget is not None:
+        gcode = GCode(args.infile, layer_store=DiskLayerStore(args.memory_budget * 1024 * 1024))
+    else:
+        gcode = GCode(args.infile.readlines())
+
+    try:
+        # progress markers rely on the time index computed while parsing, insert them first
+        if args.progress:
+            profile = load_profile(args.machine) if args.machine is not None else None
+            GCodeProgressFilter(args.progress, profile).filter(gcode)
+
+        # thumbnails are drawn within the bounding box computed while parsing, before any translation
+        if args.thumbnail:
+            embed_thumbnails(gcode, args.thumbnail)
+
+        if line_filters and args.jobs > 1:
+            # filters carrying state from a layer to the next one can only be spread over processes one at a time
+            for line_filter in line_filters:
+                ParallelFilterRunner(line_filter, args.jobs).filter(gcode)
+        elif line_filters:
+            FilterChain(*line_filters).filter(gcode)
+
+        # write back modified gcode
+        gcode.write(args.outfile)
+    finally:
+        gcode.close()
 
 
 if __name__ == "__main__":
@@ -3,20 +3,28 @@ import logging
 import sys
 import os
 import re
-from multiprocessing import Process
+from itertools import chain
+from multiprocessing import Pool
 
 
+from gcodeutils.filter.cache import LayerResultCache
 from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
 from gcodeutils.gcoder import GCode
 from gcodeutils.filter.arc_optimizer import GCodeArcOptimizerFilter
+from gcodeutils.metadata import read_metadata, seekable
+from gcodeutils.shared_layers import SHARED_MEMORY, export_layers, import_all_layers, prepare_workers
 
 __author__ = 'Eyck Jentzsch <eyck@jepemuc.de>'
 
-def worker(tempFile):
+def worker(task):
+    """optimize a chunk of a program, return its layers exported to shared memory where available, otherwise the
+    layers themselves (pickled as compact records, see Layer.__reduce__)"""
+    lines, cache_dir, cache_size = task
     logging.info("Parsing gcode...")
-    gcode = GCode(open(tempFile).readlines())
-    GCodeArcOptimizerFilter().filter(gcode)
-    gcode.write(open(tempFile, 'w') )
+    gcode = GCode(lines)
+    cache = LayerResultCache(cache_dir, cache_size) if cache_dir else None
+    GCodeArcOptimizerFilter().filter(gcode, cache)
+    return export_layers(gcode.all_layers) if SHARED_MEMORY else gcode.all_layers
 
 def main():
     """command line entry point"""
@@ -30,6 +38,12 @@ def main():
 
     parser.add_argument('--verbose', '-v', action='count', default=1, help='Verbose mode')
     parser.add_argument('--quiet', '-q', action='count', default=0, help='Quiet mode')
+    parser.add_argument('--cache_dir', metavar='DIR',
+                        help='Directory where filtered layers are cached so that layers unchanged since a previous '
+                             'run are not filtered again. Defaults to no cache.')
+    parser.add_argument('--cache_size', type=int, default=512, metavar='MB',
+                        help='Maximum size of the layer cache, defaults to %(default)sMB.')
+
     parser.add_argument('--compact', '-c', action='store_true', help='Removes white spaces and decimal places. Comments are not affected')
 
     args = parser.parse_args()
@@ -47,44 +61,41 @@ def main():
     cpus = len(os.sched_getaffinity(0))
     logging.info("Number of CPUs %s" % cpus)
     
-    for line in args.infile:
-        if line.startswith(";LAYER_COUNT"):
-            layers = (int) (line.split(":")[1])
-            logging.info("Number of Layers: %s" % layers)
+    # only the header and footer are read to find the layer count, a program which can't be rewound (piped) is
+    # scanned in full for it and kept in memory for the chunking
+    infile = args.infile if seekable(args.infile) else args.infile.readlines()
+    layers = read_metadata(infile, required=('layer_count',)).get('layer_count', 0)
+    logging.info("Number of Layers: %s" % layers)
 
     layersPerThread = (int) (layers / cpus) + 1
     logging.info("Number of Layers Per Thread: %s" % layersPerThread)
     
-    args.infile.seek(0)
-    
-    gcodes = []
-    tempFiles = []
-    procs = []
-    i = 0
-    tempFiles.append(open(args.infile.name + str(i), 'w'))
-    for line in args.infile:
+    chunks = [[]]
+    for line in infile:
         if line.startswith(";LAYER:"):
             layerNum = int(line.split(":")[1])
-            if layerNum > (i + 1) * layersPerThread:
-                tempFiles[i].close()
-                i += 1
-                tempFiles.append(open(args.infile.name + str(i), 'w'))
-        tempFiles[i].write(line)
-    tempFiles[i].close()
-        
-    for tempFile in tempFiles:
-        p = Process(target=worker, args=(tempFile.name,))
-        procs.append(p)
-        p.start()
-        
-    for proc in procs:
-        proc.join()
+            if layerNum > len(chunks) * layersPerThread:
+                chunks.append([])
+        chunks[-1].append(line)
+
+    tasks = [(chunk, args.cache_dir, args.cache_size * 1024 * 1024) for chunk in chunks]
+    if SHARED_MEMORY:
+        prepare_workers()
+    pool = Pool(cpus)
+    try:
+        if SHARED_MEMORY:
+            optimized_layers = import_all_layers(pool.imap(worker, tasks))
+        else:
+            optimized_layers = list(chain.from_iterable(pool.map(worker, tasks)))
+    finally:
+        pool.close()
+        pool.join()
+
     # write back modified gcode
     outFile = open(args.infile.name, 'w') if args.inplace is True and args.infile != sys.stdin else args.outfile
-    
-    for tempFile in tempFiles:
-        tempFile = open(tempFile.name)
-        for line in tempFile:
+
+    for layer in optimized_layers:
+        for line in layer.raw_lines():
             if args.compact:
                 lines = line.split(";")
                 lines[0] = re.sub("(F\\d+)(\\.\\d+)", "\\1", lines[0])
@@ -93,11 +104,7 @@ def main():
                     line = lines[0] + ";" + lines[1]
                 else:
                     line = lines[0]
-                outFile.write(line)
-            else:
-                outFile.write(line)
-            
-        os.remove(tempFile.name)
+            outFile.write(line + "\n")
     outFile.flush()
     outFile.close()
 if __name__ == "__main__":
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Stream gcode programs once and output per layer and per feature statistics as JSON"""
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import functools
+import json
+import logging
+import math
+import sys
+from multiprocessing import Pool
+
+from gcodeutils.features import FEATURE_NAMES, FeatureClassifier
+from gcodeutils.gcoder import Arc, GCode, arc_move_gcodes, P
+from gcodeutils.planner import MotionPlanner, load_profile
+
+__author__ = 'Olivier Jolly <olivier@pcedev.com>'
+
+
+class Counters(object):
+    """Accumulated statistics over a set of moves"""
+    __slots__ = ('time', 'filament', 'travel', 'retractions', 'moves')
+
+    def __init__(self):
+        self.time = 0.
+        self.filament = 0.
+        self.travel = 0.
+        self.retractions = 0
+        self.moves = 0
+
+    def as_dict(self):
+        return dict((bit, getattr(self, bit)) for bit in self.__slots__)
+
+
+class GCodeStats(object):  # pylint: disable=too-many-instance-attributes
+    """Streaming statistics of a gcode program, fed one raw line at a time.
+
+    Lines are parsed with their machine state as in a GCode, without keeping them, and get their feature from a
+    FeatureClassifier (see gcodeutils.features), the non extruding moves being accounted as travel.
+
+    Move durations are nominal ones (length over feedrate), without any acceleration modeling, unless a
+    MachineProfile is given in which case they are computed by a motion planner once the whole program is read."""
+
+    def __init__(self, profile=None):
+        self.state = GCode()
+        self.classifier = FeatureClassifier()
+        self.position = (0., 0., 0.)
+        self.current_e = 0.
+        self.feature = FEATURE_NAMES[self.classifier.feature]
+
+        self.layers = []
+        self.layer = None
+        self.layer_z = None
+        self.features = {}
+        self.totals = Counters()
+
+        self.planner = MotionPlanner(profile) if profile is not None else None
+        # layer and feature counters of each planned move
+        self.planned_counters = []
+
+    def feed(self, raw):
+        """account for one raw line of gcode"""
+        line = self.state.append(raw, store=False)
+        if line is None:
+            return
+
+        self.feature = FEATURE_NAMES[self.classifier.classify(line)]
+        if line.command is None:
+            return
+
+        if line.is_move:
+            self.move(line)
+        elif self.planner is not None:
+            self.account('time', self.planner.handle_command(line))
+        elif line.command == 'G4':
+            self.account('time', (P(line) or 0) / 1000.)
+
+    def move(self, line):
+        start = self.position
+        self.position = (line.current_x, line.current_y, line.current_z)
+        delta_e = line.current_e - self.current_e
+        self.current_e = line.current_e
+
+        arc = None
+        if line.command in arc_move_gcodes:
+            arc = Arc.from_move(start[0], start[1], self.position[0], self.position[1], line.i, line.j, line.r,
+                                line.command == 'G2')
+        if arc is not None:
+            xy_length = arc.length
+        else:
+            xy_length = math.hypot(self.position[0] - start[0], self.position[1] - start[1])
+        length = math.sqrt(xy_length ** 2 + (self.position[2] - start[2]) ** 2) or abs(delta_e)
+
+        extruding = delta_e > 0 and xy_length > 0
+        if extruding and self.position[2] != self.layer_z:
+            self.new_layer(self.position[2])
+
+        self.account('moves', 1)
+        if self.planner is not None:
+            self.planner.add_move(self.position[0] - start[0], self.position[1] - start[1],
+                                  self.position[2] - start[2], delta_e, line.current_f,
+                                  length if arc is not None else None)
+            self.planned_counters.append((self.layer, self.feature_counters()))
+        else:
+            self.account('time', length / (line.current_f / 60.) if line.current_f else 0.)
+        if delta_e > 0:
+            self.account('filament', delta_e)
+        elif delta_e < 0:
+            self.account('retractions', 1)
+        if not extruding:
+            self.account('travel', xy_length)
+
+    def new_layer(self, z):
+        self.layer_z = z
+        self.layer = Counters()
+        self.layers.append((z, self.layer))
+
+    def account(self, bit, value):
+        """add value to the given counter of the program, the current layer and the current feature"""
+        if self.layer is None:
+            self.new_layer(None)
+        for counters in (self.totals, self.layer, self.feature_counters()):
+            setattr(counters, bit, getattr(counters, bit) + value)
+
+    def feature_counters(self):
+        feature = self.features.get(self.feature)
+        if feature is None:
+            feature = self.features[self.feature] = Counters()
+        return feature
+
+    def finish(self):
+        """account for the planned move durations"""
+        if self.planner is None:
+            return
+        for (layer, feature), duration in zip(self.planned_counters, self.planner.durations()):
+            for counters in (self.totals, layer, feature):
+                counters.time += duration
+        self.planner = MotionPlanner(self.planner.profile)
+        self.planned_counters = []
+
+    def as_dict(self):
+        self.finish()
+        layers = []
+        for layer_idx, (z, counters) in enumerate(self.layers):
+            layer = counters.as_dict()
+            layer.update(index=layer_idx, z=z)
+            layers.append(layer)
+        return {
+            'totals': self.totals.as_dict(),
+            'layer_count': len(self.layers),
+            'layers': layers,
+            'features': dict((name, counters.as_dict()) for name, counters in self.features.items()),
+        }
+
+
+def analyze(gcode_lines, profile=None):
+    """return statistics of an iterable of raw gcode lines as a dictionary"""
+    stats = GCodeStats(profile)
+    for raw in gcode_lines:
+        stats.feed(raw)
+    return stats.as_dict()
+
+
+def analyze_file(filename, profile=None):
+    """return statistics of a gcode file as a dictionary"""
+    with open(filename) as gcode_file:
+        result = analyze(gcode_file, profile)
+    result['file'] = filename
+    return result
+
+
+def main():
+    """command line entry point"""
+    parser = argparse.ArgumentParser(description='Output statistics of gcode programs as JSON')
+    parser.add_argument('infiles', nargs='*', metavar='infile',
+                        help='Program filenames to analyze. Defaults to standard input.')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Number of files analyzed concurrently. Defaults to %(default)s.')
+    parser.add_argument('--machine', metavar='PROFILE', default=None,
+                        help='Estimate durations with a motion planner for the given machine, either a builtin '
+                             'profile (marlin, marlin_jerk, klipper) or a JSON file. Defaults to nominal '
+                             'durations.')
+    parser.add_argument('--indent', type=int, default=None, help='Indentation of the JSON output.')
+
+    parser.add_argument('--verbose', '-v', action='count', default=1, help='Verbose mode')
+    parser.add_argument('--quiet', '-q', action='count', default=0, help='Quiet mode')
+
+    args = parser.parse_args()
+
+    # count verbose and quiet flags to determine logging level
+    args.verbose -= args.quiet
+
+    if args.verbose > 1:
+        logging.root.setLevel(logging.DEBUG)
+    elif args.verbose > 0:
+        logging.root.setLevel(logging.INFO)
+
+    logging.basicConfig(format="%(levelname)s:%(message)s")
+
+    profile = load_profile(args.machine) if args.machine is not None else None
+
+    if not args.infiles:
+        result = analyze(sys.stdin, profile)
+    elif len(args.infiles) == 1:
+        result = analyze_file(args.infiles[0], profile)
+    elif args.jobs > 1:
+        pool = Pool(args.jobs)
+        try:
+            result = pool.map(functools.partial(analyze_file, profile=profile), args.infiles)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        result = [analyze_file(filename, profile) for filename in args.infiles]
+
+    json.dump(result, sys.stdout, indent=args.indent, sort_keys=True)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,20 +2,45 @@ import argparse
 import logging
 import sys
 
+from gcodeutils.dialect import sniff_gcode
+from gcodeutils.filter.cache import LayerResultCache
 from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
 from gcodeutils.gcoder import GCode
-from gcodeutils.stretch.stretch import Slic3rStretchFilter, CuraStretchFilter
+from gcodeutils.layer_store import DiskLayerStore
+from gcodeutils.stretch.stretch import Slic3rStretchFilter, CuraStretchFilter, SkeinforgeStretchFilter
 
 __author__ = 'olivier'
 
+# stretch filters by slicer family, programs of other families can't be stretched. Slic3rStretchFilter is used when
+# the slicer can't be detected
+STRETCH_FILTERS = {
+    'cura': CuraStretchFilter,
+    'skeinforge': SkeinforgeStretchFilter,
+    'slic3r': Slic3rStretchFilter,
+}
+DEFAULT_STRETCH_FILTER = Slic3rStretchFilter
+
 
 def is_cura_gcode(gcode):  # pylint: disable=redefined-outer-name
-    """Detect cura generated gcode by looking for the profile string"""
-    for layer in gcode.all_layers:
-        for opcode in layer:
-            if 'CURA_PROFILE_STRING' in opcode.raw:
-                return True
-    return False
+    """Detect cura generated gcode from the comments at its beginning and end"""
+    return sniff_gcode(gcode).family == 'cura'
+
+
+def stretch_filter_class(gcode, family=None):  # pylint: disable=redefined-outer-name
+    """return the StretchFilter subclass of a slicer family, detected from the program when None. Raise ValueError
+    when the program comes from a slicer no filter handles"""
+    if family is None:
+        dialect = sniff_gcode(gcode)
+        if dialect.slicer is None:
+            logging.warning("slicer not detected, stretching as %s", DEFAULT_STRETCH_FILTER.__name__)
+            return DEFAULT_STRETCH_FILTER
+        logging.info("detected slicer %s %s (confidence %.2f)", dialect.slicer, dialect.version or '',
+                     dialect.confidence)
+        family = dialect.family
+    if family not in STRETCH_FILTERS:
+        raise ValueError("{} programs can't be stretched, supported slicers are {}".format(
+            family, ', '.join(sorted(STRETCH_FILTERS))))
+    return STRETCH_FILTERS[family]
 
 
 def main():
@@ -47,6 +72,20 @@ def main():
                         help='Stretching stretch factor. This is the first setting you\'ll want to change to '
                              'modify the hole size')
 
+    parser.add_argument('--cache_dir', metavar='DIR',
+                        help='Directory where filtered layers are cached so that layers unchanged since a previous '
+                             'run are not filtered again. Defaults to no cache.')
+    parser.add_argument('--cache_size', type=int, default=512, metavar='MB',
+                        help='Maximum size of the layer cache, defaults to %(default)sMB.')
+
+    parser.add_argument('--memory_budget', type=int, metavar='MB',
+                        help='Keep at most <MB> megabytes of parsed layers in memory, the other ones being stored in '
+                             'a temporary file. Defaults to keeping the whole program in memory.')
+
+    parser.add_argument('--slicer', choices=sorted(STRETCH_FILTERS), default=None,
+                        help='Slicer family whose comments are used to find perimeters. Defaults to detecting it '
+                             'from the beginning and end of the program.')
+
     parser.add_argument('--verbose', '-v', action='count', default=1,
                         help='Verbose mode')
     parser.add_argument('--quiet', '-q', action='count', default=0, help='Quiet mode')
@@ -64,16 +103,23 @@ def main():
     logging.basicConfig(format="%(levelname)s:%(message)s")
 
     # read original GCode
-    gcode = GCode(args.infile.readlines())  # pylint: disable=redefined-outer-name
+    if args.memory_budget is not None:
+        gcode = GCode(args.infile, layer_store=DiskLayerStore(args.memory_budget * 1024 * 1024))
+    else:
+        gcode = GCode(args.infile.readlines())  # pylint: disable=redefined-outer-name
+
+    try:
+        filter_class = stretch_filter_class(gcode, args.slicer)
+    except ValueError as error:
+        parser.error("{}, use --slicer to stretch it anyway".format(error))
 
     # First convert to relative extrusion
     GCodeToRelativeExtrusionFilter().filter(gcode)
 
+    cache = LayerResultCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None
+
     # Then perform the stretching
-    if is_cura_gcode(gcode):
-        CuraStretchFilter(**vars(args)).filter(gcode)
-    else:
-        Slic3rStretchFilter(**vars(args)).filter(gcode)
+    filter_class(**vars(args)).filter(gcode, cache)
 
     # write back modified gcode
     gcode.write(args.outfile)
@@ -20,11 +20,16 @@ import sys
 import math
 import datetime
 import logging
+import hashlib
+import marshal
 from array import array
+from collections import namedtuple
 
 import re
 
-gcode_parsed_args = ["x", "y", "e", "f", "z", "i", "j"]
+from gcodeutils.features import FeatureClassifier, FeatureRuns
+
+gcode_parsed_args = ["x", "y", "e", "f", "z", "i", "j", "r"]
 gcode_parsed_nonargs = ["g", "t", "m", "n"]
 to_parse = "".join(gcode_parsed_args + gcode_parsed_nonargs)
 gcode_exp = re.compile("\([^\(\)]*\)|^\(.*\)$|;.*|[/\*].*\n|([%s])([-+]?[0-9]*\.?[0-9]*)" % to_parse)
@@ -33,7 +38,8 @@ m114_exp = re.compile("\([^\(\)]*\)|[/\*].*\n|([XYZ]):?([-+]?[0-9]*\.?[0-9]*)")
 specific_exp = "(?:\([^\(\)]*\))|(?:;.*)|(?:[/\*].*\n)|(%s[-+]?[0-9]*\.?[0-9]*)"
 move_gcodes = ["G0", "G1", "G2", "G3"]
 linear_move_gcodes = ["G0", "G1"]
-gcode_possible_arguments = ['x', 'y', 'z', 'e', 'f', 'i', 'j']
+arc_move_gcodes = ["G2", "G3"]
+gcode_possible_arguments = ['x', 'y', 'z', 'e', 'f', 'i', 'j', 'r']
 
 GCODE_ABSOLUTE_POSITIONING_COMMAND = 'G90'
 GCODE_RELATIVE_POSITIONING_COMMAND = 'G91'
@@ -44,7 +50,7 @@ GCODE_RELATIVE_EXTRUSION_COMMAND = 'M83'
 
 
 class PyLine(object):
-    __slots__ = ('x', 'y', 'z', 'e', 'f', 'i', 'j',
+    __slots__ = ('x', 'y', 'z', 'e', 'f', 'i', 'j', 'r',
                  'raw', 'command', 'is_move',
                  'relative', 'relative_e',
                  'current_x', 'current_y', 'current_z', 'extruding',
@@ -57,8 +63,18 @@ class PyLine(object):
         self.raw = l
 
     def __getattr__(self, name):
+        # unset attributes read as None, but protocol lookups (__getstate__, __reduce_ex__, ...) must fail
+        if name[:2] == '__' == name[-2:]:
+            raise AttributeError(name)
         return None
 
+    def __getstate__(self):
+        return dict((bit, getattr(self, bit)) for bit in PICKLED_LINE_ATTRIBUTES if getattr(self, bit) is not None)
+
+    def __setstate__(self, state):
+        for bit, value in state.items():
+            setattr(self, bit, value)
+
     def __eq__(self, other):
         if not isinstance(other, PyLine):
             return False
@@ -101,8 +117,104 @@ class PyLightLine(object):
         self.raw = l
 
     def __getattr__(self, name):
+        if name[:2] == '__' == name[-2:]:
+            raise AttributeError(name)
         return None
 
+    def __getstate__(self):
+        return self.raw, self.command
+
+    def __setstate__(self, state):
+        self.raw, self.command = state
+
+
+# pickled line attributes, gcview_end_vertex is a viewer only attribute
+PICKLED_LINE_ATTRIBUTES = tuple(bit for bit in PyLine.__slots__ if bit != 'gcview_end_vertex')
+
+# attributes of packed lines (see pack_lines) besides their raw representation and command: floats, flags and tool
+PACKED_FLOAT_ATTRIBUTES = ('x', 'y', 'z', 'e', 'f', 'i', 'j', 'r',
+                           'current_x', 'current_y', 'current_z', 'current_e', 'current_f')
+PACKED_FLAG_ATTRIBUTES = ('is_move', 'relative', 'relative_e', 'extruding')
+# bitmask positions of the flags presence and value, and of the tool presence
+PACKED_FLAG_BIT = len(PACKED_FLOAT_ATTRIBUTES)
+PACKED_FLAG_VALUE_BIT = PACKED_FLAG_BIT + len(PACKED_FLAG_ATTRIBUTES)
+PACKED_TOOL_MASK = 1 << (PACKED_FLAG_VALUE_BIT + len(PACKED_FLAG_ATTRIBUTES))
+# command code of lines without command
+PACKED_NO_COMMAND = 0xffff
+
+
+def _array_bytes(values):
+    return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
+
+
+def pack_line(line, commands, floats, tools):
+    """return the command code and attribute bitmask of a line, appending its float attributes and tool to the floats
+    and tools arrays, commands maps the command names to their codes"""
+    command = line.command
+    code = PACKED_NO_COMMAND if command is None else commands.setdefault(command, len(commands))
+
+    mask = 0
+    for bit, name in enumerate(PACKED_FLOAT_ATTRIBUTES):
+        value = getattr(line, name)
+        if value is not None:
+            mask |= 1 << bit
+            floats.append(value)
+    for bit, name in enumerate(PACKED_FLAG_ATTRIBUTES):
+        value = getattr(line, name)
+        if value is not None:
+            mask |= 1 << (PACKED_FLAG_BIT + bit)
+            if value:
+                mask |= 1 << (PACKED_FLAG_VALUE_BIT + bit)
+    if line.current_tool is not None:
+        mask |= PACKED_TOOL_MASK
+        tools.append(line.current_tool)
+    return code, mask
+
+
+def unpack_line(raw, code, mask, command_names, floats, tools):
+    """rebuild a line packed by pack_line, floats and tools being iterators over the packed values"""
+    line = Line(raw)
+    if code != PACKED_NO_COMMAND:
+        line.command = command_names[code]
+    for bit, name in enumerate(PACKED_FLOAT_ATTRIBUTES):
+        if mask & (1 << bit):
+            setattr(line, name, next(floats))
+    for bit, name in enumerate(PACKED_FLAG_ATTRIBUTES):
+        if mask & (1 << (PACKED_FLAG_BIT + bit)):
+            setattr(line, name, bool(mask & (1 << (PACKED_FLAG_VALUE_BIT + bit))))
+    if mask & PACKED_TOOL_MASK:
+        line.current_tool = next(tools)
+    return line
+
+
+def pack_lines(lines):
+    """return a compact binary record of lines: the raw lines, and for each line a command code, a bitmask of the
+    attributes set and the packed values of these attributes"""
+    commands = {}
+    codes = array('H')
+    masks = array('I')
+    floats = array('d')
+    tools = array('i')
+    raws = []
+    for line in lines:
+        code, mask = pack_line(line, commands, floats, tools)
+        codes.append(code)
+        masks.append(mask)
+        raws.append(line.raw)
+
+    command_names = sorted(commands, key=commands.get)
+    return marshal.dumps((command_names, raws, _array_bytes(codes), _array_bytes(masks), _array_bytes(floats),
+                          _array_bytes(tools)))
+
+
+def unpack_lines(record):
+    """return the lines of a record made by pack_lines"""
+    command_names, raws, codes, masks, floats, tools = marshal.loads(record)
+    floats = iter(array('d', floats))
+    tools = iter(array('i', tools))
+    return [unpack_line(raw, code, mask, command_names, floats, tools)
+            for raw, code, mask in zip(raws, array('H', codes), array('I', masks))]
+
 
 # TODO: reenable loading of C optimised representation of GCode
 # try:
@@ -184,12 +296,252 @@ def parse_coordinates(line, split_raw, imperial=False, force=False):
             setattr(line, code, unit_factor * float(bit[1]))
 
 
+class Arc(namedtuple('Arc', ('center_x', 'center_y', 'radius', 'start_angle', 'sweep'))):
+    """Geometry of a G2/G3 move in the XY plane, sweep being negative for clockwise arcs"""
+    __slots__ = ()
+
+    @classmethod
+    def from_move(cls, start_x, start_y, end_x, end_y, i=None, j=None, r=None, clockwise=True):
+        """return the arc going from start to end around a center given relative to the start (i, j) or by its
+        radius (r, negative for arcs above 180 degrees). Return None for degenerated arcs"""
+        if i is None and j is None and r:
+            # center on the perpendicular bisector of the chord, as computed by the firmwares
+            dx = end_x - start_x
+            dy = end_y - start_y
+            chord = math.hypot(dx, dy)
+            if chord == 0:
+                return None
+            h = math.sqrt(max(0., r * r - chord * chord / 4))
+            side = -1 if clockwise != (r < 0) else 1
+            i = dx / 2. - side * h * dy / chord
+            j = dy / 2. + side * h * dx / chord
+
+        i = i or 0.
+        j = j or 0.
+        radius = math.hypot(i, j)
+        if radius == 0:
+            return None
+
+        center_x = start_x + i
+        center_y = start_y + j
+        start_angle = math.atan2(-j, -i)
+        end_angle = math.atan2(end_y - center_y, end_x - center_x)
+
+        if clockwise:
+            sweep = -((start_angle - end_angle) % (2 * math.pi))
+        else:
+            sweep = (end_angle - start_angle) % (2 * math.pi)
+        if abs(sweep) < 1e-9:
+            # same start and end points describe a full circle
+            sweep = -2 * math.pi if clockwise else 2 * math.pi
+
+        return cls(center_x, center_y, radius, start_angle, sweep)
+
+    @property
+    def length(self):
+        return abs(self.sweep) * self.radius
+
+    def tangent(self, angle):
+        """unit vector along the move direction at the given angle"""
+        direction = 1 if self.sweep > 0 else -1
+        return -direction * math.sin(angle), direction * math.cos(angle)
+
+    def start_tangent(self):
+        return self.tangent(self.start_angle)
+
+    def end_tangent(self):
+        return self.tangent(self.start_angle + self.sweep)
+
+    def bounds(self):
+        """return the (xmin, xmax, ymin, ymax) bounding box of the arc"""
+        end_angle = self.start_angle + self.sweep
+        xs = [self.center_x + self.radius * math.cos(self.start_angle),
+              self.center_x + self.radius * math.cos(end_angle)]
+        ys = [self.center_y + self.radius * math.sin(self.start_angle),
+              self.center_y + self.radius * math.sin(end_angle)]
+
+        # add the axis extremes swept by the arc
+        for quadrant in range(4):
+            angle = quadrant * math.pi / 2
+            if self.sweep > 0:
+                swept = (angle - self.start_angle) % (2 * math.pi) <= self.sweep
+            else:
+                swept = (self.start_angle - angle) % (2 * math.pi) <= -self.sweep
+            if swept:
+                xs.append(self.center_x + self.radius * math.cos(angle))
+                ys.append(self.center_y + self.radius * math.sin(angle))
+
+        return min(xs), max(xs), min(ys), max(ys)
+
+
 class Layer(list):
-    __slots__ = ("duration", "z")
+    __slots__ = ("duration", "z", "shared")
 
     def __init__(self, lines, z=None):
         super(Layer, self).__init__(lines)
         self.z = z
+        self.shared = None
+
+    def __reduce__(self):
+        # pickled as a packed record rather than line objects, shared layers being materialized
+        self.materialize()
+        return unpack_layer, (pack_lines(self), self.z, getattr(self, 'duration', None))
+
+    def _get_template(self):
+        return self.shared[0] if self.shared is not None else None
+
+    template = property(_get_template)
+
+    def materialize(self):
+        """make sure the layer lines are available as a plain list (no-op for regular layers)"""
+        pass
+
+    def raw_lines(self):
+        """return the raw representation of the layer lines"""
+        return [line.raw for line in self]
+
+    def fingerprint(self):
+        """return a digest of the layer content"""
+        return hashlib.sha1('\n'.join(self.raw_lines()).encode('utf-8')).hexdigest()
+
+
+# matches the Z word in the command part of a line, comments are split out beforehand
+z_word_exp = re.compile(r'([Zz])([-+]?[0-9]*\.?[0-9]*)')
+Z_WORD_PLACEHOLDER = '\0'
+
+# PyLine attributes which must be the same for two lines to be considered identical modulo Z
+# attributes describing the machine state after a line
+machine_state_attributes = ('relative', 'relative_e', 'current_tool', 'current_x', 'current_y', 'current_z',
+                            'current_e', 'current_f')
+
+layer_sharing_attributes = ('command', 'is_move', 'x', 'y', 'e', 'f', 'i', 'j', 'r',
+                            'relative', 'relative_e', 'current_x', 'current_y', 'current_tool', 'current_f',
+                            'extruding')
+LAYER_SHARING_EPSILON = 1e-6
+
+
+def z_normalize(raw):
+    """Split a raw line into its Z normalized form (Z values replaced by a placeholder) and the list of
+    Z values found, as strings, in order"""
+    comment_idx = raw.find(';')
+    code, comment = (raw, '') if comment_idx < 0 else (raw[:comment_idx], raw[comment_idx:])
+    z_words = []
+
+    def _replace(match):
+        z_words.append(match.group(2))
+        return match.group(1) + Z_WORD_PLACEHOLDER
+
+    return z_word_exp.sub(_replace, code) + comment, z_words
+
+
+def unpack_layer(record, z, duration):
+    """rebuild a pickled layer"""
+    layer = Layer(unpack_lines(record), z)
+    if duration is not None:
+        layer.duration = duration
+    return layer
+
+
+class LayerTemplate(object):
+    """Content shared by several layers identical modulo Z: Z normalized raw lines and the parsed lines
+    of the first layer seen with this content"""
+    __slots__ = ('raws', 'lines')
+
+    def __init__(self, raws, lines):
+        self.raws = raws
+        self.lines = lines
+
+    def raw_lines(self, z_words):
+        """rebuild raw lines with the given Z values"""
+        z_words = iter(z_words)
+        result = []
+        for raw in self.raws:
+            while Z_WORD_PLACEHOLDER in raw:
+                raw = raw.replace(Z_WORD_PLACEHOLDER, next(z_words), 1)
+            result.append(raw)
+        return result
+
+    def match(self, layer, z_words):
+        """return the (Z, E) offsets between the template and a layer, or None if the layer isn't identical
+        to the template modulo Z"""
+        dz = de = None
+        words = iter(z_words)
+        for raw, tpl_line, line in zip(self.raws, self.lines, layer):
+            for bit in layer_sharing_attributes:
+                if getattr(tpl_line, bit) != getattr(line, bit):
+                    return None
+
+            line_z_words = [next(words) for _ in range(raw.count(Z_WORD_PLACEHOLDER))]
+            if line.z is not None and (not line_z_words or float(line_z_words[-1]) != line.z):
+                # Z attribute can't be rebuilt from the raw line (imperial units for instance)
+                return None
+
+            line_dz = (line.current_z or 0) - (tpl_line.current_z or 0)
+            line_de = (line.current_e or 0) - (tpl_line.current_e or 0)
+            if dz is None:
+                dz, de = line_dz, line_de
+            elif abs(line_dz - dz) > LAYER_SHARING_EPSILON or abs(line_de - de) > LAYER_SHARING_EPSILON:
+                return None
+
+        return dz or 0, de or 0
+
+    def materialize(self, z_words, dz, de):
+        """return fresh copies of the template lines for a layer with the given Z values and offsets"""
+        lines = []
+        for raw, tpl_line in zip(self.raw_lines(z_words), self.lines):
+            line = Line(raw)
+            for bit in PyLine.__slots__:
+                value = getattr(tpl_line, bit)
+                if value is not None and bit != 'raw':
+                    setattr(line, bit, value)
+            if tpl_line.current_z is not None:
+                line.current_z = tpl_line.current_z + dz
+            if tpl_line.current_e is not None:
+                line.current_e = tpl_line.current_e + de
+            if tpl_line.z is not None:
+                line.z = float(z_word_exp.findall(raw.split(';', 1)[0])[-1][1])
+            lines.append(line)
+        return lines
+
+
+def _materializing(name):
+    list_method = getattr(list, name)
+
+    def method(self, *args):
+        self.materialize()
+        return list_method(self, *args)
+
+    method.__name__ = name
+    return method
+
+
+class SharedLayer(Layer):
+    """Layer whose lines are stored once in a LayerTemplate along with other layers identical modulo Z.
+
+    Lines are only materialized (and the layer turned back into a plain Layer) when the layer is accessed
+    or modified, so that filters and writers see normal layers."""
+    __slots__ = ()
+
+    def __len__(self):
+        return len(self.shared[0].raws)
+
+    def materialize(self):
+        template, z_words, dz, de = self.shared
+        self.__class__ = Layer
+        self.shared = None
+        list.extend(self, template.materialize(z_words, dz, de))
+
+    def raw_lines(self):
+        template, z_words, _, _ = self.shared
+        return template.raw_lines(z_words)
+
+    for _name in ('__getitem__', '__setitem__', '__delitem__', '__getslice__', '__setslice__', '__delslice__',
+                  '__iter__', '__reversed__', '__contains__', '__iadd__', '__imul__', '__add__', '__mul__',
+                  '__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__', '__repr__',
+                  'append', 'extend', 'insert', 'pop', 'remove', 'index', 'count', 'reverse', 'sort'):
+        if hasattr(list, _name):
+            locals()[_name] = _materializing(_name)
+    del _name
 
 
 class GCode(object):
@@ -200,6 +552,17 @@ class GCode(object):
     all_layers = None
     layer_idxs = None
     line_idxs = None
+    # cumulative duration (seconds) and filament (mm) at the end of each line, in program order
+    time_index = None
+    filament_index = None
+    # feature code of each line, see gcodeutils.features
+    feature_index = None
+    feature_classifier = None
+    _feature_runs = None
+    _segments = None
+    _layer_index = None
+    _spatial = None
+    _loops = None
     append_layer = None
     append_layer_id = None
 
@@ -298,19 +661,46 @@ class GCode(object):
     layers_count = property(_get_layers_count)
 
     def __init__(self, data=None, home_pos=None,
-                 layer_callback=None, deferred=False, line_callback=None):
+                 layer_callback=None, deferred=False, line_callback=None, share_layers=False, layer_store=None):
         if not deferred:
-            self.prepare(data, home_pos, layer_callback, line_callback)
-
-    def prepare(self, data=None, home_pos=None, layer_callback=None, line_callback=None):
+            self.prepare(data, home_pos, layer_callback, line_callback, share_layers, layer_store)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # lazily built indexes are rebuilt on demand
+        for name in ('_segments', '_layer_index', '_spatial', '_loops', '_feature_runs'):
+            state.pop(name, None)
+        # lines are pickled once, within their layers
+        if state.get('lines') is not None:
+            state['lines'] = True
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.lines is True:
+            self.lines = [line for layer in self.all_layers for line in layer]
+
+    def prepare(self, data=None, home_pos=None, layer_callback=None, line_callback=None, share_layers=False,
+                layer_store=None):
+        """Parse the program given as an iterable of raw lines.
+
+        When a layer_store (see gcodeutils.layer_store) is given, layers are spilled into it as soon as they're
+        parsed and the flat `lines` list isn't kept so that the whole program never sits in memory."""
         self.home_pos = home_pos
-        if data:
+        if data and layer_store is not None:
+            line_class = self.line_class
+            self.lines = None
+            self._preprocess((line_class(l2) for l2 in (l.strip() for l in data) if l2), build_layers=True,
+                             layer_callback=layer_callback, line_callback=line_callback, layer_store=layer_store)
+        elif data:
             line_class = self.line_class
             self.lines = [line_class(l2) for l2 in
                           (l.strip() for l in data)
                           if l2]
             self._preprocess(build_layers=True,
                              layer_callback=layer_callback, line_callback=line_callback)
+            if share_layers:
+                self.share_identical_layers()
         else:
             self.lines = []
             self.append_layer_id = 0
@@ -320,13 +710,26 @@ class GCode(object):
             self.layers = {}
             self.layer_idxs = array('I', [])
             self.line_idxs = array('I', [])
+            self.time_index = array('d')
+            self.filament_index = array('d')
+            self.feature_index = array('B')
+            self.feature_classifier = FeatureClassifier()
 
     def __len__(self):
         return len(self.line_idxs)
 
     def __iter__(self):
+        if self.lines is None:
+            # out-of-core program or shared layers, lines are only available through layers
+            return (line for layer in self.all_layers for line in layer)
         return self.lines.__iter__()
 
+    def close(self):
+        """release the resources held by the program, such as the temporary file of its layer store"""
+        close = getattr(self.all_layers, 'close', None)
+        if close is not None:
+            close()
+
     def prepend_to_layer(self, commands, layer_idx):
         # Prepend commands in reverse order
         commands = [c.strip() for c in commands[::-1] if c.strip()]
@@ -350,7 +753,8 @@ class GCode(object):
             # Insert gline at beginning of layer
             layer.insert(0, gline)
             # Insert gline at beginning of list
-            self.lines.insert(start_index, gline)
+            if self.lines is not None:
+                self.lines.insert(start_index, gline)
             # Update indices arrays & global gcodes list
             self.layer_idxs.insert(end_index + i, layer_idx)
             self.line_idxs.insert(end_index + i, end_line + i + 1)
@@ -372,7 +776,8 @@ class GCode(object):
         self.layer_idxs = self.layer_idxs[:start_index] + array('I', len(commands) * [layer_idx]) + self.layer_idxs[
                                                                                                     end_index:]
         self.line_idxs = self.line_idxs[:start_index] + array('I', range(len(commands))) + self.line_idxs[end_index:]
-        del self.lines[start_index:end_index]
+        if self.lines is not None:
+            del self.lines[start_index:end_index]
         del layer[:]
         for i, command in enumerate(commands):
             gline = Line(command)
@@ -383,7 +788,8 @@ class GCode(object):
             # Insert gline at beginning of layer
             layer.insert(0, gline)
             # Insert gline at beginning of list
-            self.lines.insert(start_index, gline)
+            if self.lines is not None:
+                self.lines.insert(start_index, gline)
         return commands[::-1]
 
     def append(self, command, store=True):
@@ -393,14 +799,158 @@ class GCode(object):
         gline = Line(command)
         self._preprocess([gline])
         if store:
-            self.lines.append(gline)
+            if self.lines is not None:
+                self.lines.append(gline)
             self.append_layer.append(gline)
             self.layer_idxs.append(self.append_layer_id)
             self.line_idxs.append(len(self.append_layer))
+            for index in (self.time_index, self.filament_index):
+                index.append(index[-1] if index else 0.)
+            self.feature_index.append(self.feature_classifier.classify(gline))
         return gline
 
+    def insert_lines(self, insertions):
+        """insert commands in bulk, insertions being (layer index, position in the layer, commands) tuples, with
+        positions relative to the layer before any insertion.
+
+        Each touched layer is rebuilt once, as are the flat line list and the indices. Inserted lines take the
+        machine state, the cumulative time and filament and the feature of the line they follow."""
+        by_layer = {}
+        for layer_idx, position, commands in insertions:
+            by_layer.setdefault(layer_idx, []).append((position, commands))
+
+        layer_idxs = array('I')
+        line_idxs = array('I')
+        indexes = []
+        if self.has_current_index():
+            indexes = [(index, array(index.typecode))
+                       for index in (self.time_index, self.filament_index, self.feature_index)]
+        lines = [] if self.lines is not None else None
+
+        start = 0
+        previous_line = None
+        for layer_idx, layer in enumerate(self.all_layers):
+            layer_insertions = by_layer.get(layer_idx)
+            if layer_insertions:
+                # position of each line of the new layer in the original one, None for inserted lines
+                sources = []
+                new_layer = []
+                done = 0
+                for position, commands in sorted(layer_insertions, key=lambda insertion: insertion[0]):
+                    sources += range(done, position)
+                    new_layer += layer[done:position]
+                    reference = layer[position - 1] if position else previous_line
+                    for command in commands:
+                        gline = raw_to_line(command.strip())
+                        if reference is not None:
+                            for bit in machine_state_attributes:
+                                setattr(gline, bit, getattr(reference, bit))
+                        sources.append(None)
+                        new_layer.append(gline)
+                    done = position
+                sources += range(done, len(layer))
+                new_layer += layer[done:]
+                original_length = len(layer)
+                layer[:] = new_layer
+            else:
+                sources = range(len(layer))
+                original_length = len(layer)
+
+            for line_idx, source in enumerate(sources):
+                layer_idxs.append(layer_idx)
+                line_idxs.append(line_idx)
+                for old_index, new_index in indexes:
+                    if source is not None:
+                        new_index.append(old_index[start + source])
+                    else:
+                        new_index.append(new_index[-1] if new_index else 0)
+
+            if lines is not None:
+                lines += layer
+            if layer:
+                previous_line = layer[-1]
+            start += original_length
+
+        self.layer_idxs = layer_idxs
+        self.line_idxs = line_idxs
+        if lines is not None:
+            self.lines = lines
+        if indexes:
+            self.time_index, self.filament_index, self.feature_index = [new_index for _, new_index in indexes]
+        else:
+            self.time_index = self.filament_index = self.feature_index = None
+
+    @property
+    def segments(self):
+        """SegmentTable of the program, see gcodeutils.segments"""
+        if self._segments is None:
+            from gcodeutils.segments import SegmentTable
+
+            self._segments = SegmentTable(self)
+        return self._segments
+
+    @property
+    def spatial(self):
+        """SpatialIndex (per layer grids of the moves) of the program, see gcodeutils.spatial"""
+        if self._spatial is None:
+            from gcodeutils.spatial import SpatialIndex
+
+            self._spatial = SpatialIndex(self)
+        return self._spatial
+
+    @property
+    def loops(self):
+        """LoopIndex (per layer closed extruding loops as polygons) of the program, see gcodeutils.loops"""
+        if self._loops is None:
+            from gcodeutils.loops import LoopIndex
+
+            self._loops = LoopIndex(self)
+        return self._loops
+
+    @property
+    def layer_index(self):
+        """LayerIndex (Z index and layer bounding boxes) of the program, see gcodeutils.query"""
+        if self._layer_index is None or not self._layer_index.is_current(self):
+            from gcodeutils.query import LayerIndex
+
+            self._layer_index = LayerIndex(self)
+        return self._layer_index
+
+    def invalidate_layer_index(self):
+        self._layer_index = None
+
+    def query(self, layers=None, z=None, commands=None, features=None, bbox=None):
+        """return a view of the lines matching the given criteria, see gcodeutils.query.query"""
+        from gcodeutils.query import query
+
+        return query(self, layers, z, commands, features, bbox)
+
+    @property
+    def feature_runs(self):
+        """FeatureRuns of the program, built from the feature index on first access and after lines are appended
+        or inserted"""
+        if not self.has_current_index():
+            raise ValueError("feature index doesn't match the program anymore")
+        if self._feature_runs is None or self._feature_runs.line_count != len(self.feature_index):
+            self._feature_runs = FeatureRuns(self.feature_index)
+        return self._feature_runs
+
+    def feature_lines(self, *features):
+        """return an iterator on the (layer index, line) of the given features, visiting only their runs"""
+        for _, start, stop in self.feature_runs.runs(*features):
+            for line_idx in range(start, stop):
+                layer_idx, layer_line = self.idxs(line_idx)
+                yield layer_idx, self.all_layers[layer_idx][layer_line]
+
+    def has_current_index(self):
+        """return whether the cumulative time, filament and feature indices still match the program lines, filters
+        modifying layers don't maintain them"""
+        if self.time_index is None:
+            return False
+        return len(self.time_index) == sum(len(layer) for layer in self.all_layers)
+
     def _preprocess(self, lines=None, build_layers=False,
-                    layer_callback=None, line_callback=None):
+                    layer_callback=None, line_callback=None, layer_store=None):
         """Checks for imperial/relativeness settings and tool changes"""
         if not lines:
             lines = self.lines
@@ -456,10 +1006,16 @@ class GCode(object):
             layerbeginduration = 0.0
 
             # Initialize layers
-            all_layers = self.all_layers = []
+            all_layers = self.all_layers = layer_store if layer_store is not None else []
+            all_layers_z = []
             all_zs = self.all_zs = set()
-            layer_idxs = self.layer_idxs = []
-            line_idxs = self.line_idxs = []
+            layer_idxs = self.layer_idxs = array('I')
+            line_idxs = self.line_idxs = array('I')
+            time_index = self.time_index = array('d')
+            filament_index = self.filament_index = array('d')
+            feature_index = self.feature_index = array('B')
+            self.feature_classifier = FeatureClassifier()
+            classify_feature = self.feature_classifier.classify
 
             layer_id = 0
             layer_line = 0
@@ -506,7 +1062,10 @@ class GCode(object):
                     parse_coordinates(line, split_raw, imperial)
 
                 # Compute current position
+                arc = None
                 if line.is_move:
+                    start_x = current_x
+                    start_y = current_y
                     x = line.x
                     y = line.y
                     z = line.z
@@ -527,6 +1086,10 @@ class GCode(object):
                     if y is not None: current_y = y
                     if z is not None: current_z = z
 
+                    if build_layers and line.command in arc_move_gcodes:
+                        arc = Arc.from_move(start_x, start_y, current_x, current_y, line.i, line.j, line.r,
+                                            line.command == "G2")
+
                 elif line.command == "G28":
                     home_all = not any([line.x, line.y, line.z])
                     if home_all or line.x is not None:
@@ -564,29 +1127,35 @@ class GCode(object):
                         max_e = max(max_e, total_e)
                         cur_layer_has_extrusion |= line.extruding
                     elif line.command == "G92":
-                        offset_e = line.e #current_e - line.e
+                        offset_e = current_e - line.e
                 line.current_e = current_e
                 # # Create layers and perform global computations
                 if build_layers:
                     # Update bounding box
                     if line.is_move:
+                        if arc is not None:
+                            # arcs may sweep past their end points
+                            move_xmin, move_xmax, move_ymin, move_ymax = arc.bounds()
+                        else:
+                            move_xmin = move_xmax = line.current_x
+                            move_ymin = move_ymax = line.current_y
                         if line.extruding:
                             if line.current_x is not None:
-                                xmin_e = min(xmin_e, line.current_x)
-                                xmax_e = max(xmax_e, line.current_x)
+                                xmin_e = min(xmin_e, move_xmin)
+                                xmax_e = max(xmax_e, move_xmax)
                             if line.current_y is not None:
-                                ymin_e = min(ymin_e, line.current_y)
-                                ymax_e = max(ymax_e, line.current_y)
+                                ymin_e = min(ymin_e, move_ymin)
+                                ymax_e = max(ymax_e, move_ymax)
                         if max_e <= 0:
                             if line.current_x is not None:
-                                xmin = min(xmin, line.current_x)
-                                xmax = max(xmax, line.current_x)
+                                xmin = min(xmin, move_xmin)
+                                xmax = max(xmax, move_xmax)
                             if line.current_y is not None:
-                                ymin = min(ymin, line.current_y)
-                                ymax = max(ymax, line.current_y)
+                                ymin = min(ymin, move_ymin)
+                                ymax = max(ymax, move_ymax)
 
                     # Compute duration
-                    if line.command == "G0" or line.command == "G1":
+                    if line.is_move:
                         x = line.x if line.x is not None else lastx
                         y = line.y if line.y is not None else lasty
                         z = line.z if line.z is not None else lastz
@@ -611,10 +1180,17 @@ class GCode(object):
                         # of the previous one
                         dx = x - lastx
                         dy = y - lasty
-                        if dx * lastdx + dy * lastdy <= 0:
-                            lastf = 0
-
-                        currenttravel = math.hypot(dx, dy)
+                        if arc is not None:
+                            # compare directions along the arc tangents, without linearizing it
+                            start_dx, start_dy = arc.start_tangent()
+                            if start_dx * lastdx + start_dy * lastdy <= 0:
+                                lastf = 0
+                            dx, dy = arc.end_tangent()
+                            currenttravel = arc.length
+                        else:
+                            if dx * lastdx + dy * lastdy <= 0:
+                                lastf = 0
+                            currenttravel = math.hypot(dx, dy)
                         if currenttravel == 0:
                             if line.z is not None:
                                 currenttravel = abs(line.z) if line.relative else abs(line.z - lastz)
@@ -670,7 +1246,7 @@ class GCode(object):
                             offset = self.est_layer_height if self.est_layer_height else 0.01
                             if abs(prev_z - last_layer_z) < offset:
                                 if self.est_layer_height is None:
-                                    zs = sorted([l.z for l in all_layers if l.z is not None])
+                                    zs = sorted([z for z in all_layers_z if z is not None])
                                     heights = [round(zs[i + 1] - zs[i], 3) for i in range(len(zs) - 1)]
                                     heights = [height for height in heights if height]
                                     if len(heights) >= 2:
@@ -690,6 +1266,7 @@ class GCode(object):
                             new_layer.duration = totalduration - layerbeginduration
                             layerbeginduration = totalduration
                             all_layers.append(new_layer)
+                            all_layers_z.append(base_z)
                             if cur_layer_has_extrusion and prev_z not in all_zs:
                                 all_zs.add(prev_z)
                             cur_lines = []
@@ -706,6 +1283,9 @@ class GCode(object):
                 cur_lines.append(true_line)
                 layer_idxs.append(layer_id)
                 line_idxs.append(layer_line)
+                time_index.append(totalduration)
+                filament_index.append(max_e)
+                feature_index.append(classify_feature(line))
                 layer_line += 1
                 prev_z = cur_z
 
@@ -747,8 +1327,8 @@ class GCode(object):
             self.append_layer = Layer([])
             self.append_layer.duration = 0
             all_layers.append(self.append_layer)
-            self.layer_idxs = array('I', layer_idxs)
-            self.line_idxs = array('I', line_idxs)
+            self.layer_idxs = layer_idxs
+            self.line_idxs = line_idxs
 
             # Compute bounding box
             all_zs = self.all_zs.union(set([zmin])).difference(set([None]))
@@ -777,70 +1357,104 @@ class GCode(object):
             totaltime = datetime.timedelta(seconds=int(totalduration))
             self.duration = totaltime
 
+    def share_identical_layers(self):
+        """Store layers identical modulo Z only once.
+
+        Layers are grouped by a hash of their Z normalized content, then each layer matching the first one of
+        its group (same commands and state, constant Z and E offsets) is turned into a SharedLayer. Shared
+        layers are materialized back transparently when accessed.
+        As for out-of-core programs, the flat `lines` list is then dropped: it would keep every line in memory, lines
+        are only available through layers.
+
+        Return the number of layers now shared."""
+        if not isinstance(self.all_layers, list):
+            logging.debug("layer sharing isn't available for out-of-core programs")
+            return 0
+
+        candidates = {}
+        for layer_idx, layer in enumerate(self.all_layers):
+            if layer.shared is not None or layer is self.append_layer or not layer:
+                continue
+            normalized = [z_normalize(line.raw) for line in layer]
+            raws = tuple(raw for raw, _ in normalized)
+            z_words = tuple(word for _, words in normalized for word in words)
+            key = hashlib.md5('\n'.join(raws).encode('utf-8')).digest()
+            candidates.setdefault(key, []).append((layer_idx, raws, z_words))
+
+        shared_count = 0
+        for group in candidates.values():
+            if len(group) < 2:
+                continue
+
+            # a group may hold several templates, for instance if the entry state of the first layer differs
+            templates = []
+            for layer_idx, raws, z_words in group:
+                layer = self.all_layers[layer_idx]
+                for template, members in templates:
+                    if raws != template.raws:
+                        # hash collision
+                        continue
+                    offsets = template.match(layer, z_words)
+                    if offsets is not None:
+                        members.append((layer, z_words, offsets))
+                        break
+                else:
+                    templates.append((LayerTemplate(raws, list(layer)), [(layer, z_words, (0, 0))]))
+
+            for template, members in templates:
+                if len(members) < 2:
+                    continue
+                for layer, z_words, offsets in members:
+                    layer.shared = (template, z_words) + offsets
+                    del layer[:]
+                    layer.__class__ = SharedLayer
+                    shared_count += 1
+
+        if shared_count:
+            self.lines = None
+
+        logging.debug("%d layers shared out of %d", shared_count, len(self.all_layers))
+        return shared_count
+
     def idxs(self, i):
         return self.layer_idxs[i], self.line_idxs[i]
 
-    def estimate_duration(self):
-        return self.layers_count, self.duration
+    def estimate_duration(self, profile=None):
+        """return the layer count and the duration of the program, estimated with a motion planner when a
+        MachineProfile is given"""
+        if profile is None:
+            return self.layers_count, self.duration
+
+        from gcodeutils.planner import estimate_gcode
+
+        return self.layers_count, estimate_gcode(self, profile).duration
 
     def write(self, output_file=sys.stdout):
         """write the gcode program to a file like object"""
         for layer in self.all_layers:
-            for line in layer:
-                print(line.raw, file=output_file)
+            for raw in layer.raw_lines():
+                print(raw, file=output_file)
 
     def diff(self, other):
+        """return a description of all differences with another program, None if they are equal"""
+        from gcodeutils.compare import GCodeComparator, format_region
+
         if not isinstance(other, GCode):
             raise ValueError
 
-        meaningful_lines1 = self.comment_stripper_generator()
-        meaningful_lines2 = other.comment_stripper_generator()
-
-        for line_number, (l1, l2) in enumerate(zip(meaningful_lines1, meaningful_lines2)):
-            # checking the raw representation of lines is a bit naive
-            # that will have to evolve as required
-            if l1 != l2:
-                return "First difference after {} meaningful lines: '{}' vs '{}' ".format(line_number, l1.raw, l2.raw)
-
-        # check that generators are empty
-        # that's probably more contrived than it should be
-        try:
-            l1 = meaningful_lines1.next()
-            return "Remaining line(s) for self: '{}'".format(l1)
-        except StopIteration:
-            try:
-                l2 = meaningful_lines2.next()
-                return "Remaining line(s) for other: '{}'".format(l2)
-            except StopIteration:
-                pass
+        regions = GCodeComparator().diff(self, other)
+        if not regions:
+            return None
 
-        return None
+        return "{} difference(s): {}".format(len(regions), "; ".join(format_region(region) for region in regions))
 
     def __eq__(self, other):
+        from gcodeutils.compare import GCodeComparator
+
         if not isinstance(other, GCode):
             return False
 
-        meaningful_lines1 = self.comment_stripper_generator()
-        meaningful_lines2 = other.comment_stripper_generator()
-
-        for l1, l2 in zip(meaningful_lines1, meaningful_lines2):
-            # checking the raw representation of lines is a bit naive
-            # that will have to evolve as required
-            if l1 != l2:
-                return False
-
-        # check that generators are empty
-        # that's probably more contrived than it should be
-        try:
-            meaningful_lines1.next()
-            return False
-        except StopIteration:
-            try:
-                meaningful_lines2.next()
-                return False
-            except StopIteration:
-                pass
-        return True
+        return GCodeComparator().equal(self, other)
 
     def comment_stripper_generator(self):
         """return only non comment lines"""
@@ -0,0 +1,249 @@
+"""Out-of-core storage of GCode layers"""
+from collections import OrderedDict
+from array import array
+import bisect
+import hashlib
+import logging
+import marshal
+import sys
+import tempfile
+import zlib
+
+from gcodeutils.gcoder import Layer, PyLine, Line
+
+__author__ = 'olivier'
+
+# serialized line attributes, gcview_end_vertex is a viewer only attribute
+SERIALIZED_ATTRIBUTES = tuple(bit for bit in PyLine.__slots__ if bit != 'gcview_end_vertex')
+
+# rough memory footprint of a materialized line, besides its raw representation
+LINE_OVERHEAD = 256
+
+# type of the file offsets, Python 2 arrays have no 64 bits integers but longs are 64 bits on 64 bits Linux
+try:
+    array('q')
+    OFFSET_TYPECODE = 'q'
+except ValueError:
+    OFFSET_TYPECODE = 'l'
+
+logger = logging.getLogger('layer_store')
+
+
+def serialize_layer(layer, compress=True):
+    """return a compact binary representation of a layer"""
+    record = marshal.dumps((layer.z, getattr(layer, 'duration', None),
+                            [tuple(getattr(line, bit) for bit in SERIALIZED_ATTRIBUTES) for line in layer]))
+    return zlib.compress(record, 1) if compress else record
+
+
+def deserialize_layer(record, compress=True):
+    """rebuild a layer out of its binary representation"""
+    z, duration, lines = marshal.loads(zlib.decompress(record) if compress else record)
+    layer = Layer([], z)
+    layer.duration = duration
+    for values in lines:
+        line = Line()
+        for bit, value in zip(SERIALIZED_ATTRIBUTES, values):
+            if value is not None:
+                setattr(line, bit, value)
+        layer.append(line)
+    return layer
+
+
+def layer_footprint(layer):
+    """estimate the memory used by a materialized layer"""
+    return sum(len(line.raw or '') for line in layer) + LINE_OVERHEAD * len(layer)
+
+
+class DiskLayerStore(object):
+    """List like container of layers kept in a temporary file.
+
+    Only a LRU cache of materialized layers, bounded by memory_budget (in bytes), is kept in memory. Layers
+    handed out may be modified in place as with a plain list of layers: they are written back to disk when
+    evicted from the cache, unless their record is unchanged. Evicted layers still referenced elsewhere are held
+    until they are released, or the layer is replaced, so that later modifications aren't lost, and are handed out
+    again when accessed. The most recently used layer is never evicted so that layer sequential filters can keep
+    working on it, its footprint is updated once another layer is accessed. Space freed by records which moved or
+    shrank is reused."""
+
+    def __init__(self, memory_budget=256 * 1024 * 1024, directory=None, compress=True):
+        self.memory_budget = memory_budget
+        self.compress = compress
+        self.file = tempfile.TemporaryFile(prefix='gcodeutils-layers-', dir=directory)
+        self.file_size = 0
+
+        # position and length of each layer record in the file
+        self.offsets = array(OFFSET_TYPECODE)
+        self.lengths = array(OFFSET_TYPECODE)
+        # sorted (offset, length) of the unused areas of the file
+        self.free_areas = []
+
+        self.cache = OrderedDict()
+        self.footprints = {}
+        # layers evicted from the cache while still referenced elsewhere, written back once released
+        self.held = {}
+        # digest of the uncompressed record of the cached layers read from the file, not set for new layers
+        self.digests = {}
+        self.cache_footprint = 0
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        for layer_idx in range(len(self)):
+            yield self[layer_idx]
+
+    def _normalize_index(self, layer_idx):
+        if layer_idx < 0:
+            layer_idx += len(self)
+        if not 0 <= layer_idx < len(self):
+            raise IndexError("layer index out of range")
+        return layer_idx
+
+    def __getitem__(self, layer_idx):
+        if isinstance(layer_idx, slice):
+            return [self[idx] for idx in range(*layer_idx.indices(len(self)))]
+
+        layer_idx = self._normalize_index(layer_idx)
+
+        if self.cache and next(reversed(self.cache)) != layer_idx:
+            # the most recently used layer may have been modified in place since it was cached
+            self._update_footprint(next(reversed(self.cache)))
+
+        layer = self.cache.pop(layer_idx, None)
+        if layer is None:
+            layer = self.held.pop(layer_idx, None)
+            if layer is None:
+                layer, self.digests[layer_idx] = self._read(layer_idx)
+            self._cache(layer_idx, layer)
+        else:
+            self.cache[layer_idx] = layer
+        return layer
+
+    def __setitem__(self, layer_idx, layer):
+        layer_idx = self._normalize_index(layer_idx)
+        self._uncache(layer_idx)
+        self._cache(layer_idx, layer)
+
+    def append(self, layer):
+        """add a layer at the end of the store"""
+        layer.materialize()
+        self.offsets.append(-1)
+        self.lengths.append(0)
+        self._cache(len(self) - 1, layer)
+
+    def flush(self):
+        """write back all cached and held layers"""
+        for layer_idx, layer in self.cache.items():
+            self._write(layer_idx, layer)
+            self._update_footprint(layer_idx)
+        self._release_held()
+        for layer_idx, layer in self.held.items():
+            self._write(layer_idx, layer)
+
+    def close(self):
+        """drop the layers and delete the temporary file"""
+        self.cache.clear()
+        self.held.clear()
+        self.footprints.clear()
+        self.digests.clear()
+        self.cache_footprint = 0
+        self.file.close()
+
+    def _cache(self, layer_idx, layer):
+        footprint = layer_footprint(layer)
+        self.cache[layer_idx] = layer
+        self.footprints[layer_idx] = footprint
+        self.cache_footprint += footprint
+
+        while self.cache_footprint > self.memory_budget and len(self.cache) > 1:
+            self._evict()
+        self._release_held()
+
+    def _evict(self):
+        """move the least recently used layer from the cache to the held layers"""
+        evicted_idx, evicted_layer = self.cache.popitem(last=False)
+        self.cache_footprint -= self.footprints.pop(evicted_idx)
+        self.held[evicted_idx] = evicted_layer
+
+    def _release_held(self):
+        """write back and drop the held layers only referenced by the store"""
+        for layer_idx in list(self.held):
+            # references from the held dictionary and the getrefcount argument
+            if sys.getrefcount(self.held[layer_idx]) <= 2:
+                self._write(layer_idx, self.held.pop(layer_idx))
+
+    def _update_footprint(self, layer_idx):
+        footprint = layer_footprint(self.cache[layer_idx])
+        self.cache_footprint += footprint - self.footprints[layer_idx]
+        self.footprints[layer_idx] = footprint
+
+    def _uncache(self, layer_idx):
+        self.digests.pop(layer_idx, None)
+        self.held.pop(layer_idx, None)
+        if self.cache.pop(layer_idx, None) is not None:
+            self.cache_footprint -= self.footprints.pop(layer_idx)
+
+    def _read(self, layer_idx):
+        """return a layer read from the file and the digest of its uncompressed record"""
+        self.file.seek(self.offsets[layer_idx])
+        record = self.file.read(self.lengths[layer_idx])
+        if self.compress:
+            record = zlib.decompress(record)
+        return deserialize_layer(record, compress=False), hashlib.sha1(record).digest()
+
+    def _write(self, layer_idx, layer):
+        record = serialize_layer(layer, compress=False)
+        digest = hashlib.sha1(record).digest()
+        if self.digests.get(layer_idx) == digest:
+            # unchanged since read
+            return
+        self.digests[layer_idx] = digest
+        if self.compress:
+            record = zlib.compress(record, 1)
+
+        # overwrite in place when the record still fits, else move it to a free area or the end of the file
+        offset, length = self.offsets[layer_idx], self.lengths[layer_idx]
+        if offset >= 0 and len(record) <= length:
+            self._release(offset + len(record), length - len(record))
+        else:
+            if offset >= 0:
+                self._release(offset, length)
+            offset = self._allocate(len(record))
+
+        self.file.seek(offset)
+        self.file.write(record)
+        self.offsets[layer_idx] = offset
+        self.lengths[layer_idx] = len(record)
+
+    def _allocate(self, length):
+        """return the offset of an unused area of the file of the given length"""
+        for area_idx, (offset, area_length) in enumerate(self.free_areas):
+            if area_length >= length:
+                if area_length == length:
+                    del self.free_areas[area_idx]
+                else:
+                    self.free_areas[area_idx] = (offset + length, area_length - length)
+                return offset
+
+        offset = self.file_size
+        self.file_size += length
+        return offset
+
+    def _release(self, offset, length):
+        """mark an area of the file as unused, merging it with the adjacent unused areas"""
+        if not length:
+            return
+        area_idx = bisect.bisect(self.free_areas, (offset, length))
+        if area_idx < len(self.free_areas) and offset + length == self.free_areas[area_idx][0]:
+            length += self.free_areas.pop(area_idx)[1]
+        if area_idx and sum(self.free_areas[area_idx - 1]) == offset:
+            area_idx -= 1
+            offset, previous_length = self.free_areas.pop(area_idx)
+            length += previous_length
+
+        if offset + length == self.file_size:
+            self.file_size = offset
+            self.file.truncate(offset)
+        else:
+            self.free_areas.insert(area_idx, (offset, length))
@@ -0,0 +1,301 @@
+"""Closed extruding loops of the layers as polygons, with their signed area, perimeter and containment nesting"""
+from __future__ import division
+
+from array import array
+import math
+
+from gcodeutils.gcoder import Arc, arc_move_gcodes
+from gcodeutils.spatial import ARC_TOLERANCE, arc_chords, point_segment_distance
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'olivier'
+
+# maximum distance between the start and the end of an extruding path for it to be a loop (mm)
+CLOSING_TOLERANCE = 0.05
+
+# maximum distance between a loop and the loop containing it for them to be perimeters of the same shell (mm)
+DEFAULT_SHELL_DISTANCE = 1.0
+
+# points tested together against the edges close to them, see points_near_polygon
+POINT_BLOCK = 64
+
+COUNTER_CLOCKWISE = 1
+CLOCKWISE = -1
+
+
+def shoelace_areas(xs, ys, offsets):
+    """return the signed areas of polygons whose points, first one not repeated, are stored from offsets[i] to
+    offsets[i + 1] of the coordinate columns. Areas are positive for counter clockwise polygons"""
+    count = len(offsets) - 1
+    if count <= 0:
+        return array('d')
+
+    if numpy is not None:
+        xs = numpy.asarray(xs, dtype=float)
+        ys = numpy.asarray(ys, dtype=float)
+        starts = numpy.asarray(offsets[:-1], dtype=int)
+        stops = numpy.asarray(offsets[1:], dtype=int)
+        # index of the next point of each point, wrapping around each polygon
+        following = numpy.arange(1, len(xs) + 1)
+        following[stops - 1] = starts
+        crosses = xs * ys[following] - xs[following] * ys
+        return array('d', (numpy.add.reduceat(crosses, starts) / 2).tolist())
+
+    areas = array('d')
+    for polygon in range(count):
+        start, stop = offsets[polygon], offsets[polygon + 1]
+        area = 0.
+        for point in range(start, stop):
+            following = point + 1 if point + 1 < stop else start
+            area += xs[point] * ys[following] - xs[following] * ys[point]
+        areas.append(area / 2)
+    return areas
+
+
+def points_in_polygon(pxs, pys, xs, ys):
+    """return, for each point of the pxs and pys columns, whether it lies inside the polygon given by its xs and ys
+    columns (even-odd rule, points on edges being undetermined)"""
+    if numpy is not None:
+        pxs = numpy.asarray(pxs, dtype=float)[:, None]
+        pys = numpy.asarray(pys, dtype=float)[:, None]
+        x0s = numpy.asarray(xs, dtype=float)
+        y0s = numpy.asarray(ys, dtype=float)
+        x1s = numpy.roll(x0s, -1)
+        y1s = numpy.roll(y0s, -1)
+        # edges straddling the horizontal line of each point, crossed at its right
+        straddling = (y0s > pys) != (y1s > pys)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            cross_xs = x0s + (pys - y0s) * (x1s - x0s) / (y1s - y0s)
+        return ((straddling & (pxs < cross_xs)).sum(axis=1) % 2 == 1).tolist()
+
+    inside = []
+    count = len(xs)
+    for px, py in zip(pxs, pys):
+        crossings = 0
+        for point in range(count):
+            x0, y0 = xs[point], ys[point]
+            x1, y1 = xs[(point + 1) % count], ys[(point + 1) % count]
+            if (y0 > py) != (y1 > py) and px < x0 + (py - y0) * (x1 - x0) / (y1 - y0):
+                crossings += 1
+        inside.append(crossings % 2 == 1)
+    return inside
+
+
+
+def points_near_polygon(pxs, pys, xs, ys, distance):
+    """return whether any point of the pxs and pys columns lies within distance of the edges of the polygon given by
+    its xs and ys columns. Points are tested by blocks, each one against the edges whose bounding box comes within
+    distance of the block bounding box only"""
+    count = len(xs)
+    if not count or not len(pxs):
+        return False
+
+    if numpy is not None:
+        pxs = numpy.asarray(pxs, dtype=float)
+        pys = numpy.asarray(pys, dtype=float)
+        x0s = numpy.asarray(xs, dtype=float)
+        y0s = numpy.asarray(ys, dtype=float)
+        x1s = numpy.roll(x0s, -1)
+        y1s = numpy.roll(y0s, -1)
+        edge_xmins, edge_xmaxs = numpy.minimum(x0s, x1s), numpy.maximum(x0s, x1s)
+        edge_ymins, edge_ymaxs = numpy.minimum(y0s, y1s), numpy.maximum(y0s, y1s)
+        for start in range(0, len(pxs), POINT_BLOCK):
+            bxs, bys = pxs[start:start + POINT_BLOCK], pys[start:start + POINT_BLOCK]
+            edges = numpy.nonzero((edge_xmins <= bxs.max() + distance) & (edge_xmaxs >= bxs.min() - distance) &
+                                  (edge_ymins <= bys.max() + distance) & (edge_ymaxs >= bys.min() - distance))[0]
+            if not len(edges):
+                continue
+            ex0s, ey0s = x0s[edges], y0s[edges]
+            dxs, dys = x1s[edges] - ex0s, y1s[edges] - ey0s
+            lengths_2 = dxs * dxs + dys * dys
+            # projection of each point of the block (rows) on each edge (columns), clamped to the edge
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                ratios = ((bxs[:, None] - ex0s) * dxs + (bys[:, None] - ey0s) * dys) / lengths_2
+            ratios = numpy.clip(numpy.nan_to_num(ratios), 0., 1.)
+            distances = numpy.hypot(bxs[:, None] - ex0s - ratios * dxs, bys[:, None] - ey0s - ratios * dys)
+            if (distances <= distance).any():
+                return True
+        return False
+
+    edges = [(min(xs[edge], xs[(edge + 1) % count]), min(ys[edge], ys[(edge + 1) % count]),
+              max(xs[edge], xs[(edge + 1) % count]), max(ys[edge], ys[(edge + 1) % count]), edge)
+             for edge in range(count)]
+    for start in range(0, len(pxs), POINT_BLOCK):
+        bxs, bys = pxs[start:start + POINT_BLOCK], pys[start:start + POINT_BLOCK]
+        xmin, ymin, xmax, ymax = min(bxs) - distance, min(bys) - distance, max(bxs) + distance, max(bys) + distance
+        for edge_xmin, edge_ymin, edge_xmax, edge_ymax, edge in edges:
+            if edge_xmin > xmax or edge_xmax < xmin or edge_ymin > ymax or edge_ymax < ymin:
+                continue
+            x0, y0 = xs[edge], ys[edge]
+            x1, y1 = xs[(edge + 1) % count], ys[(edge + 1) % count]
+            if any(point_segment_distance(px, py, x0, y0, x1, y1) <= distance for px, py in zip(bxs, bys)):
+                return True
+    return False
+
+def _move_points(segments, row, arc_tolerance):
+    """return the XY points of an extruding move, None when it doesn't move in the XY plane"""
+    line = segments.lines[row]
+    start_x, start_y = segments.start_x[row], segments.start_y[row]
+    end_x, end_y = segments.end_x[row], segments.end_y[row]
+    if line.command in arc_move_gcodes:
+        arc = Arc.from_move(start_x, start_y, end_x, end_y, line.i, line.j, line.r, line.command == "G2")
+        if arc is not None:
+            return arc_chords(arc, arc_tolerance)
+    if start_x == end_x and start_y == end_y:
+        return None
+    return [(start_x, start_y), (end_x, end_y)]
+
+
+class LayerLoops(object):
+    """Closed extruding paths of a layer, as polygons stored in flat columns.
+
+    A loop is a run of consecutive extruding moves (arcs being split into chords) ending within closing_tolerance of
+    its start. The points of loop i are xs and ys from offsets[i] to offsets[i + 1], the closing point not being
+    repeated, and its moves are the rows first_rows[i] to last_rows[i] of the LayerSegments.
+
+    Each loop has its signed area (positive when counter clockwise), perimeter, bounds, parent (smallest loop
+    containing it, -1 if none) and depth (number of loops containing it). Loops nested within shell_distance of
+    their parent are perimeters of the same shell and share its level. Other ones start a new level, even levels
+    being outlines and odd levels holes."""
+
+    def __init__(self, segments, closing_tolerance=CLOSING_TOLERANCE, shell_distance=DEFAULT_SHELL_DISTANCE,
+                 arc_tolerance=ARC_TOLERANCE):
+        self.segments = segments
+
+        self.xs = array('d')
+        self.ys = array('d')
+        self.offsets = array('I', [0])
+        self.first_rows = array('I')
+        self.last_rows = array('I')
+
+        path = []
+        first_row = None
+        for row, line in enumerate(segments.lines):
+            if not line.is_move:
+                continue
+            points = _move_points(segments, row, arc_tolerance) if segments.extrusion[row] > 0 else None
+            if points is None:
+                # retractions and moves along Z don't break paths, travels do
+                if segments.extrusion[row] <= 0 and (segments.start_x[row] != segments.end_x[row] or
+                                                     segments.start_y[row] != segments.end_y[row]):
+                    self._close(path, first_row, row - 1, closing_tolerance)
+                    path = []
+                continue
+            if not path:
+                path = [points[0]]
+                first_row = row
+            path.extend(points[1:])
+            last_row = row
+            if len(path) > 3 and math.hypot(path[-1][0] - path[0][0], path[-1][1] - path[0][1]) <= closing_tolerance:
+                self._close(path, first_row, last_row, closing_tolerance)
+                path = []
+        self._close(path, first_row, len(segments.lines) - 1, closing_tolerance)
+
+        self.areas = shoelace_areas(self.xs, self.ys, self.offsets)
+        self.perimeters = array('d')
+        self.bounds = []
+        for loop in range(len(self)):
+            start, stop = self.offsets[loop], self.offsets[loop + 1]
+            xs, ys = self.xs[start:stop], self.ys[start:stop]
+            self.perimeters.append(sum(math.hypot(xs[(point + 1) % len(xs)] - xs[point],
+                                                  ys[(point + 1) % len(ys)] - ys[point])
+                                       for point in range(len(xs))))
+            self.bounds.append((min(xs), min(ys), max(xs), max(ys)))
+
+        self._nest(shell_distance)
+
+    def _close(self, path, first_row, last_row, closing_tolerance):
+        """store a path as a loop when it's closed"""
+        if len(path) < 4 or math.hypot(path[-1][0] - path[0][0], path[-1][1] - path[0][1]) > closing_tolerance:
+            return
+        # the last point of a closed path being its first one
+        for x, y in path[:-1]:
+            self.xs.append(x)
+            self.ys.append(y)
+        self.offsets.append(len(self.xs))
+        self.first_rows.append(first_row)
+        # rows of the moves ending the loop, not of the travels after it
+        while last_row > first_row and not (self.segments.lines[last_row].is_move and
+                                            self.segments.extrusion[last_row] > 0):
+            last_row -= 1
+        self.last_rows.append(last_row)
+
+    def _loop_columns(self, loop):
+        start, stop = self.offsets[loop], self.offsets[loop + 1]
+        return self.xs[start:stop], self.ys[start:stop]
+
+    def _contained(self, outer, inners):
+        """return the loops of inners contained by loop outer, their first points being tested all at once"""
+        outer_bounds = self.bounds[outer]
+        candidates = [inner for inner in inners
+                      if abs(self.areas[outer]) > abs(self.areas[inner]) and
+                      outer_bounds[0] <= self.bounds[inner][0] and outer_bounds[1] <= self.bounds[inner][1] and
+                      self.bounds[inner][2] <= outer_bounds[2] and self.bounds[inner][3] <= outer_bounds[3]]
+        if not candidates:
+            return []
+        xs, ys = self._loop_columns(outer)
+        inside = points_in_polygon([self.xs[self.offsets[inner]] for inner in candidates],
+                                   [self.ys[self.offsets[inner]] for inner in candidates], xs, ys)
+        return [inner for inner, is_inside in zip(candidates, inside) if is_inside]
+
+    def _nest(self, shell_distance):
+        count = len(self)
+        self.parents = array('i', [-1]) * count
+        self.depths = array('I', [0]) * count
+        self.levels = array('I', [0]) * count
+
+        # from the largest loop, so that the last container found for a loop is the smallest one
+        by_size = sorted(range(count), key=lambda loop: -abs(self.areas[loop]))
+        for position, outer in enumerate(by_size):
+            for inner in self._contained(outer, by_size[position + 1:]):
+                self.parents[inner] = outer
+
+        # parents being larger, they're nested before their children
+        for inner in by_size:
+            outer = self.parents[inner]
+            if outer < 0:
+                continue
+            self.depths[inner] = self.depths[outer] + 1
+            inner_xs, inner_ys = self._loop_columns(inner)
+            outer_xs, outer_ys = self._loop_columns(outer)
+            same_shell = points_near_polygon(inner_xs, inner_ys, outer_xs, outer_ys, shell_distance)
+            self.levels[inner] = self.levels[outer] + (0 if same_shell else 1)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def polygon(self, loop):
+        """return the (x, y) points of a loop"""
+        start, stop = self.offsets[loop], self.offsets[loop + 1]
+        return list(zip(self.xs[start:stop], self.ys[start:stop]))
+
+    def winding(self, loop):
+        """return COUNTER_CLOCKWISE or CLOCKWISE"""
+        return COUNTER_CLOCKWISE if self.areas[loop] > 0 else CLOCKWISE
+
+    def is_hole(self, loop):
+        return self.levels[loop] % 2 == 1
+
+    def rows(self, loop):
+        """return the rows of the LayerSegments of the moves of a loop"""
+        return range(self.first_rows[loop], self.last_rows[loop] + 1)
+
+
+class LoopIndex(object):
+    """Lazily built LayerLoops of a GCode, following the invalidation of the segment table they're built from"""
+
+    def __init__(self, gcode):
+        self.gcode = gcode
+        self.layers = {}
+
+    def layer(self, layer_idx):
+        """return the LayerLoops of a layer"""
+        segments = self.gcode.segments.layer(layer_idx)
+        loops = self.layers.get(layer_idx)
+        if loops is None or loops.segments is not segments:
+            loops = self.layers[layer_idx] = LayerLoops(segments)
+        return loops
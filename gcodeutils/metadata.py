@@ -0,0 +1,178 @@
+"""Slicer metadata (estimated time, filament used, layer count, settings) read from gcode header and footer comments"""
+from __future__ import division
+
+import io
+import os
+import re
+
+__author__ = 'olivier'
+
+# bytes read at the beginning and at the end of seekable files
+DEFAULT_WINDOW = 64 * 1024
+
+# (slicer, pattern on the generator comment), the version being the first group if any
+SLICER_PATTERNS = (
+    ('cura', re.compile(r';Generated with Cura_SteamEngine (\S+)')),
+    ('prusaslicer', re.compile(r'; generated by PrusaSlicer (\S+)')),
+    ('superslicer', re.compile(r'; generated by SuperSlicer (\S+)')),
+    ('slic3r', re.compile(r'; generated by Slic3r (\S+)')),
+    ('simplify3d', re.compile(r'; G-Code generated by Simplify3D\(R\) Version (\S+)')),
+    ('skeinforge', re.compile(r'\(<format> skeinforge gcode ')),
+)
+
+DURATION_UNITS_EXP = re.compile(r'(\d+(?:\.\d+)?)\s*(d|h|m|s|day|hour|minute|second)s?\b')
+DURATION_UNITS = {'d': 86400, 'day': 86400, 'h': 3600, 'hour': 3600, 'm': 60, 'minute': 60, 's': 1, 'second': 1}
+
+
+def parse_duration(value):
+    """return the seconds of a duration such as "1d 2h 3m 4s" or "1 hours 2 minutes", None if there's no unit"""
+    bits = DURATION_UNITS_EXP.findall(value)
+    if not bits:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in bits)
+
+
+def _meters(value):
+    return float(value) * 1000
+
+
+# (key, pattern, converter of the first group) of the normalized metadata, the first match of a key winning
+METADATA_PATTERNS = (
+    # Cura
+    ('estimated_time', re.compile(r';TIME:(\d+(?:\.\d+)?)\s*$'), float),
+    ('filament_used', re.compile(r';Filament used: ([\d.]+)m'), _meters),
+    ('layer_count', re.compile(r';LAYER_COUNT:(\d+)'), int),
+    ('layer_height', re.compile(r';Layer height: ([\d.]+)'), float),
+    # PrusaSlicer, SuperSlicer and Slic3r
+    ('estimated_time', re.compile(r'; estimated printing time(?: \(normal mode\))? = (.*)$'), parse_duration),
+    ('filament_used', re.compile(r'; filament used(?: \[mm\])? = ([\d.]+)'), float),
+    ('filament_weight', re.compile(r'; (?:total )?filament used \[g\] = ([\d.]+)'), float),
+    ('layer_count', re.compile(r'; total layers count = (\d+)'), int),
+    ('layer_height', re.compile(r'; layer_height = ([\d.]+)'), float),
+    ('extrusion_width', re.compile(r'; external perimeters extrusion width\s*=\s*([\d.]+)mm'), float),
+    ('nozzle_diameter', re.compile(r'; nozzle_diameter = ([\d.]+)'), float),
+    # Simplify3D
+    ('estimated_time', re.compile(r';\s+Build time: (.*)$'), parse_duration),
+    ('filament_used', re.compile(r';\s+Filament length: ([\d.]+) mm'), float),
+    ('filament_weight', re.compile(r';\s+Plastic weight: ([\d.]+) g'), float),
+    ('layer_height', re.compile(r';\s+layerHeight,([\d.]+)'), float),
+    ('extrusion_width', re.compile(r';\s+extruderWidth,([\d.]+)'), float),
+    ('nozzle_diameter', re.compile(r';\s+extruderDiameter,([\d.]+)'), float),
+    # Skeinforge
+    ('slicer_version', re.compile(r'\(<version> (\S+) '), str),
+    ('layer_height', re.compile(r'\(<layerHeight> ([\d.]+)'), float),
+    ('extrusion_width', re.compile(r'\(<edgeWidth> ([\d.]+)'), float),
+)
+
+# comments starting a new layer, counted by streaming scans when no layer count is found
+LAYER_MARKERS = (';LAYER:', ';LAYER_CHANGE', '(<layer>')
+
+
+class MetadataExtractor(object):
+    """Accumulates the metadata found in comment lines, fed in any order"""
+
+    def __init__(self):
+        self.metadata = {}
+        self.layer_markers = 0
+
+    def feed(self, line):
+        line = line.strip()
+        if not line or line[0] not in ';(':
+            return
+
+        if line.startswith(LAYER_MARKERS):
+            self.layer_markers += 1
+
+        metadata = self.metadata
+        if 'slicer' not in metadata:
+            for slicer, pattern in SLICER_PATTERNS:
+                match = pattern.match(line)
+                if match:
+                    metadata['slicer'] = slicer
+                    if pattern.groups:
+                        metadata['slicer_version'] = match.group(1)
+                    return
+
+        for key, pattern, converter in METADATA_PATTERNS:
+            if key in metadata:
+                continue
+            match = pattern.match(line)
+            if match:
+                value = converter(match.group(1))
+                if value is not None:
+                    metadata[key] = value
+                return
+
+
+def _decode(data):
+    return data if isinstance(data, str) else data.decode('utf-8', 'replace')
+
+
+def seekable(gcode_file):
+    """return whether a file can be rewound, so that read_metadata doesn't consume it"""
+    binary_file = getattr(gcode_file, 'buffer', gcode_file)
+    try:
+        binary_file.seek(0, os.SEEK_CUR)
+    except (AttributeError, IOError, OSError, ValueError, io.UnsupportedOperation):
+        return False
+    return True
+
+
+def read_head_tail(gcode_file, window=DEFAULT_WINDOW):
+    """return the complete lines of the first and last window bytes of a seekable file (all its lines when it's
+    smaller than twice the window), None if it's not seekable. The file is rewound"""
+    # read text files through their binary buffer so that any offset can be seeked to
+    binary_file = getattr(gcode_file, 'buffer', gcode_file)
+    try:
+        binary_file.seek(0, os.SEEK_END)
+        size = binary_file.tell()
+        binary_file.seek(0)
+    except (AttributeError, IOError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+
+    try:
+        if size <= 2 * window:
+            return _decode(binary_file.read()).splitlines()
+
+        # drop the lines cut by the windows
+        head = _decode(binary_file.read(window)).splitlines()[:-1]
+        binary_file.seek(size - window)
+        tail = _decode(binary_file.read()).splitlines()[1:]
+        return head + tail
+    finally:
+        gcode_file.seek(0)
+
+
+def read_metadata(gcode_file, window=DEFAULT_WINDOW, required=()):
+    """return a dictionary of the metadata found in the header and footer comments of a gcode file, whose keys are
+    among slicer (cura, prusaslicer, superslicer, slic3r, simplify3d, skeinforge), slicer_version, estimated_time
+    (seconds), filament_used (mm), filament_weight (g), layer_count, layer_height, extrusion_width and
+    nozzle_diameter.
+
+    Only the first and last window bytes of seekable files are read, the whole file being scanned (and rewound
+    when possible) when it isn't seekable or when a required key isn't found. Layer count then defaults to the
+    number of layer change comments. Files which aren't seekable are consumed, see seekable."""
+    extractor = MetadataExtractor()
+
+    lines = read_head_tail(gcode_file, window)
+    if lines is not None:
+        for line in lines:
+            extractor.feed(line)
+        if all(key in extractor.metadata for key in required):
+            return extractor.metadata
+        extractor = MetadataExtractor()
+
+    for line in gcode_file:
+        extractor.feed(_decode(line))
+    if lines is not None:
+        gcode_file.seek(0)
+
+    if 'layer_count' not in extractor.metadata and extractor.layer_markers:
+        extractor.metadata['layer_count'] = extractor.layer_markers
+    return extractor.metadata
+
+
+def read_file_metadata(filename, window=DEFAULT_WINDOW, required=()):
+    """return the metadata of a gcode file, see read_metadata"""
+    with open(filename, 'rb') as gcode_file:
+        return read_metadata(gcode_file, window, required)
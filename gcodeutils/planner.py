@@ -0,0 +1,390 @@
+"""Time estimation with a firmware like trapezoidal motion planner"""
+from __future__ import division
+
+from array import array
+import datetime
+import json
+import math
+import os
+
+from gcodeutils.gcoder import arc_move_gcodes, find_specific_code, P
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'olivier'
+
+AXES = ('x', 'y', 'z', 'e')
+
+INFINITY = float('inf')
+
+# commands after which the machine is at standstill
+BLOCKING_COMMANDS = ('G4', 'G28', 'G29', 'M400', 'M109', 'M190', 'M600')
+
+# cosine of the angle between two moves above which they are considered aligned (or reversed)
+ALIGNED_COSINE = 0.999999
+
+
+class MachineProfile(object):
+    """Kinematic limits of a machine.
+
+    Velocities are in mm/s, accelerations in mm/s^2, per axis limits being dictionaries indexed by axis name
+    ('x', 'y', 'z', 'e'). Cornering speed is limited by junction_deviation (Marlin), square_corner_velocity
+    (Klipper) or, when none of them is set, by max_jerk, the per axis instantaneous velocity change (Marlin
+    classic jerk)."""
+
+    def __init__(self, max_velocity=None, max_acceleration=None, max_jerk=None, acceleration=3000.,
+                 travel_acceleration=None, retract_acceleration=None, junction_deviation=None,
+                 square_corner_velocity=None):
+        self.max_velocity = dict((axis, INFINITY) for axis in AXES)
+        self.max_velocity.update(max_velocity or {})
+        self.max_acceleration = dict((axis, INFINITY) for axis in AXES)
+        self.max_acceleration.update(max_acceleration or {})
+        self.max_jerk = dict((axis, INFINITY) for axis in AXES)
+        self.max_jerk.update(max_jerk or {})
+        self.acceleration = acceleration
+        self.travel_acceleration = travel_acceleration or acceleration
+        self.retract_acceleration = retract_acceleration or acceleration
+        self.junction_deviation = junction_deviation
+        self.square_corner_velocity = square_corner_velocity
+
+    def get_junction_deviation(self, acceleration):
+        """return the junction deviation to use with a given acceleration, None for classic jerk cornering"""
+        if self.junction_deviation is not None:
+            return self.junction_deviation
+        if self.square_corner_velocity is not None:
+            # Klipper derives the junction deviation from the velocity at a 90 degrees corner
+            return self.square_corner_velocity ** 2 * (math.sqrt(2.) - 1.) / acceleration
+        return None
+
+    @classmethod
+    def from_file(cls, filename):
+        """load a profile out of a JSON file whose keys are the constructor arguments"""
+        with open(filename) as profile_file:
+            return cls(**json.load(profile_file))
+
+
+PROFILES = {
+    'marlin': MachineProfile(max_velocity={'x': 300., 'y': 300., 'z': 5., 'e': 25.},
+                             max_acceleration={'x': 3000., 'y': 3000., 'z': 100., 'e': 10000.},
+                             max_jerk={'x': 10., 'y': 10., 'z': .3, 'e': 5.},
+                             acceleration=3000., junction_deviation=.013),
+    'marlin_jerk': MachineProfile(max_velocity={'x': 300., 'y': 300., 'z': 5., 'e': 25.},
+                                  max_acceleration={'x': 3000., 'y': 3000., 'z': 100., 'e': 10000.},
+                                  max_jerk={'x': 10., 'y': 10., 'z': .3, 'e': 5.},
+                                  acceleration=3000.),
+    'klipper': MachineProfile(max_velocity={'x': 300., 'y': 300., 'z': 5., 'e': 120.},
+                              max_acceleration={'z': 100., 'e': 5000.},
+                              acceleration=3000., square_corner_velocity=5.),
+}
+
+
+def load_profile(name):
+    """return a builtin profile, by name, or a profile loaded from a JSON file"""
+    if name in PROFILES:
+        return PROFILES[name]
+    if os.path.exists(name):
+        return MachineProfile.from_file(name)
+    raise ValueError("unknown machine profile {}, use a JSON file or one of {}".format(
+        name, ", ".join(sorted(PROFILES))))
+
+
+def trapezoid_time(length, entry, cruise, exit, acceleration):
+    """return the duration of a move accelerating from the entry speed toward the cruise speed and decelerating
+    to the exit speed"""
+    accelerate = (cruise ** 2 - entry ** 2) / (2 * acceleration)
+    decelerate = (cruise ** 2 - exit ** 2) / (2 * acceleration)
+    if accelerate + decelerate <= length:
+        return (cruise - entry) / acceleration + (cruise - exit) / acceleration + \
+            (length - accelerate - decelerate) / cruise
+    # triangle profile, cruise speed is never reached
+    peak = math.sqrt(acceleration * length + (entry ** 2 + exit ** 2) / 2)
+    return (2 * peak - entry - exit) / acceleration
+
+
+class MotionPlanner(object):
+    """Accumulate moves and compute their duration as a lookahead trapezoidal planner would.
+
+    Segment lengths, speed and acceleration limits and junction speeds are computed over the whole move sequence
+    at once, vectorized with numpy when available. Forward and backward passes then bound entry speeds by what
+    can be reached with the move acceleration. Arcs are planned with their actual length, their junctions being
+    considered along their chord."""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.acceleration = profile.acceleration
+        self.travel_acceleration = profile.travel_acceleration
+        self.retract_acceleration = profile.retract_acceleration
+
+        # dx, dy, dz, de of each move
+        self.deltas = array('d')
+        # length of curved moves, negative for straight ones
+        self.path_lengths = array('d')
+        # requested feedrate (mm/s) and acceleration of each move
+        self.feedrates = array('d')
+        self.accelerations = array('d')
+        # whether the move starts from standstill
+        self.stops = array('b')
+        self.stop_next = True
+
+    def __len__(self):
+        return len(self.feedrates)
+
+    def add_move(self, dx, dy, dz, de, feedrate, length=None):
+        """add a move, feedrate being in mm/min as in gcode. length is the length of curved moves, straight ones
+        being measured from their deltas"""
+        if dx or dy or dz:
+            acceleration = self.acceleration if de > 0 else self.travel_acceleration
+        else:
+            acceleration = self.retract_acceleration
+        self.deltas.extend((dx, dy, dz, de))
+        self.path_lengths.append(-1. if length is None else length)
+        self.feedrates.append((feedrate or 0.) / 60.)
+        self.accelerations.append(acceleration)
+        self.stops.append(self.stop_next)
+        self.stop_next = False
+
+    def stop(self):
+        """the next move starts from standstill"""
+        self.stop_next = True
+
+    def handle_command(self, line):
+        """update the planner settings according to a non move command. Return the dwell duration of the
+        command, if any"""
+        if line.command == 'M204':
+            bits = dict((code, find_specific_code(line, code)) for code in 'SPTR')
+            if bits['S'] is not None:
+                self.acceleration = self.travel_acceleration = bits['S']
+            if bits['P'] is not None:
+                self.acceleration = bits['P']
+            if bits['T'] is not None:
+                self.travel_acceleration = bits['T']
+            if bits['R'] is not None:
+                self.retract_acceleration = bits['R']
+        elif line.command in BLOCKING_COMMANDS:
+            self.stop()
+            if line.command == 'G4':
+                return (P(line) or 0) / 1000.
+        return 0.
+
+    def durations(self):
+        """return the duration, in seconds, of each move"""
+        if not len(self):
+            return array('d')
+
+        if numpy is not None:
+            lengths, cruises, accelerations, junctions = self._numpy_segments()
+        else:
+            lengths, cruises, accelerations, junctions = self._python_segments()
+
+        entries = self._plan(lengths, cruises, accelerations, junctions)
+        exits = entries[1:] + [0.]
+
+        if numpy is not None:
+            return array('d', self._numpy_durations(lengths, entries, cruises, exits, accelerations))
+
+        return array('d', [trapezoid_time(*move) if move[0] > 0 and move[2] > 0 else 0.
+                           for move in zip(lengths, entries, cruises, exits, accelerations)])
+
+    def _plan(self, lengths, cruises, accelerations, junctions):
+        """return the entry speed of each move, given the maximum speed at each junction"""
+        entries = list(junctions)
+        count = len(entries)
+
+        # backward pass: moves must be able to decelerate to the entry speed of the next one
+        next_entry = 0.
+        for idx in range(count - 1, -1, -1):
+            entries[idx] = min(entries[idx], math.sqrt(next_entry ** 2 + 2 * accelerations[idx] * lengths[idx]))
+            next_entry = entries[idx]
+
+        # forward pass: moves must be able to accelerate to the entry speed of the next one
+        for idx in range(count - 1):
+            reachable = math.sqrt(entries[idx] ** 2 + 2 * accelerations[idx] * lengths[idx])
+            if entries[idx + 1] > reachable:
+                entries[idx + 1] = reachable
+
+        return entries
+
+    def _numpy_segments(self):
+        profile = self.profile
+        deltas = numpy.frombuffer(self.deltas, dtype=float).reshape((-1, len(AXES)))
+        feedrates = numpy.frombuffer(self.feedrates, dtype=float)
+        accelerations = numpy.frombuffer(self.accelerations, dtype=float)
+
+        xyz_lengths = numpy.sqrt((deltas[:, :3] ** 2).sum(axis=1))
+        extrusion_only = xyz_lengths == 0
+        chord_lengths = numpy.where(extrusion_only, numpy.abs(deltas[:, 3]), xyz_lengths)
+        path_lengths = numpy.frombuffer(self.path_lengths, dtype=float)
+        lengths = numpy.where(path_lengths < 0, chord_lengths, path_lengths)
+        moving = lengths > 0
+        safe_lengths = numpy.where(moving, lengths, 1.)
+
+        # fraction of the move length along each axis
+        ratios = numpy.abs(deltas) / safe_lengths[:, numpy.newaxis]
+
+        with numpy.errstate(divide='ignore'):
+            max_velocity = numpy.array([profile.max_velocity[axis] for axis in AXES])
+            max_acceleration = numpy.array([profile.max_acceleration[axis] for axis in AXES])
+            cruises = numpy.minimum(feedrates, (max_velocity / ratios).min(axis=1))
+            accelerations = numpy.minimum(accelerations, (max_acceleration / ratios).min(axis=1))
+
+        # junctions only consider the direction in space, extrusion only moves going along the E axis
+        directions = deltas / numpy.where(chord_lengths > 0, chord_lengths, 1.)[:, numpy.newaxis]
+        directions[~extrusion_only, 3] = 0.
+
+        previous = directions[:-1]
+        current = directions[1:]
+        if profile.junction_deviation is not None or profile.square_corner_velocity is not None:
+            cosines = numpy.clip(-(previous * current).sum(axis=1), -1., 1.)
+            sin_half = numpy.sqrt(.5 * (1. - cosines))
+            junction_accelerations = accelerations[1:]
+            deviations = profile.get_junction_deviation(junction_accelerations)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                junctions = numpy.sqrt(junction_accelerations * deviations * sin_half / (1. - sin_half))
+            junctions[cosines < -ALIGNED_COSINE] = INFINITY
+            junctions[cosines > ALIGNED_COSINE] = 0.
+        else:
+            max_jerk = numpy.array([profile.max_jerk[axis] for axis in AXES])
+            with numpy.errstate(divide='ignore'):
+                junctions = (max_jerk / numpy.abs(current - previous)).min(axis=1)
+
+        junctions = numpy.minimum(junctions, numpy.minimum(cruises[:-1], cruises[1:]))
+        junctions = numpy.concatenate(([0.], junctions))
+        junctions[numpy.frombuffer(self.stops, dtype=numpy.int8) != 0] = 0.
+        junctions[~moving] = 0.
+        junctions[numpy.concatenate((~moving[1:], [False]))] = 0.
+
+        return lengths.tolist(), cruises.tolist(), accelerations.tolist(), junctions.tolist()
+
+    def _python_segments(self):
+        profile = self.profile
+        width = len(AXES)
+        lengths = []
+        cruises = []
+        accelerations = []
+        directions = []
+
+        for idx in range(len(self)):
+            deltas = self.deltas[idx * width:(idx + 1) * width]
+            xyz_length = math.sqrt(sum(delta ** 2 for delta in deltas[:3]))
+            chord_length = xyz_length or abs(deltas[3])
+            length = chord_length if self.path_lengths[idx] < 0 else self.path_lengths[idx]
+            cruise = self.feedrates[idx]
+            acceleration = self.accelerations[idx]
+            direction = [0.] * width
+            if length:
+                for axis, delta in zip(AXES, deltas):
+                    ratio = abs(delta) / length
+                    if ratio:
+                        cruise = min(cruise, profile.max_velocity[axis] / ratio)
+                        acceleration = min(acceleration, profile.max_acceleration[axis] / ratio)
+            if chord_length:
+                direction = [delta / chord_length for delta in deltas]
+                if xyz_length:
+                    direction[3] = 0.
+            lengths.append(length)
+            cruises.append(cruise)
+            accelerations.append(acceleration)
+            directions.append(direction)
+
+        junctions = [0.]
+        for idx in range(1, len(self)):
+            previous = directions[idx - 1]
+            current = directions[idx]
+            if self.stops[idx] or not lengths[idx] or not lengths[idx - 1]:
+                junctions.append(0.)
+                continue
+
+            deviation = profile.get_junction_deviation(accelerations[idx])
+            if deviation is not None:
+                cosine = max(-1., min(1., -sum(lhs * rhs for lhs, rhs in zip(previous, current))))
+                if cosine < -ALIGNED_COSINE:
+                    junction = INFINITY
+                elif cosine > ALIGNED_COSINE:
+                    junction = 0.
+                else:
+                    sin_half = math.sqrt(.5 * (1. - cosine))
+                    junction = math.sqrt(accelerations[idx] * deviation * sin_half / (1. - sin_half))
+            else:
+                junction = INFINITY
+                for axis, lhs, rhs in zip(AXES, previous, current):
+                    if lhs != rhs:
+                        junction = min(junction, profile.max_jerk[axis] / abs(rhs - lhs))
+
+            junctions.append(min(junction, cruises[idx - 1], cruises[idx]))
+
+        return lengths, cruises, accelerations, junctions
+
+    @staticmethod
+    def _numpy_durations(lengths, entries, cruises, exits, accelerations):
+        lengths = numpy.array(lengths)
+        entries = numpy.array(entries)
+        cruises = numpy.array(cruises)
+        exits = numpy.array(exits)
+        accelerations = numpy.array(accelerations)
+
+        valid = (lengths > 0) & (cruises > 0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            accelerate = (cruises ** 2 - entries ** 2) / (2 * accelerations)
+            decelerate = (cruises ** 2 - exits ** 2) / (2 * accelerations)
+            trapezoid = (2 * cruises - entries - exits) / accelerations + \
+                (lengths - accelerate - decelerate) / cruises
+            peaks = numpy.sqrt(accelerations * lengths + (entries ** 2 + exits ** 2) / 2)
+            triangle = (2 * peaks - entries - exits) / accelerations
+            durations = numpy.where(accelerate + decelerate <= lengths, trapezoid, triangle)
+        return numpy.where(valid, durations, 0.).tolist()
+
+
+class TimeEstimate(object):
+    """Duration of each line, in program order, and of each layer of a GCode"""
+
+    def __init__(self, line_durations, layer_durations):
+        self.line_durations = line_durations
+        self.layer_durations = layer_durations
+
+    @property
+    def total(self):
+        return sum(self.layer_durations)
+
+    @property
+    def duration(self):
+        return datetime.timedelta(seconds=int(self.total))
+
+
+def estimate_gcode(gcode, profile):
+    """return the TimeEstimate of a GCode on a machine described by a MachineProfile"""
+    planner = MotionPlanner(profile)
+    line_durations = array('d')
+    # line index of each planned move
+    move_lines = array('I')
+    layer_ends = []
+
+    for layer_idx, layer in enumerate(gcode.all_layers):
+        segments = gcode.segments.layer(layer_idx)
+        for row, line in enumerate(layer):
+            line_durations.append(0.)
+            if line.command is None:
+                continue
+
+            if line.is_move:
+                segment = segments[row]
+                planner.add_move(segment.end_x - segment.start_x, segment.end_y - segment.start_y,
+                                 segment.end_z - segment.start_z, segment.extrusion, segment.feedrate,
+                                 segment.length if line.command in arc_move_gcodes else None)
+                move_lines.append(len(line_durations) - 1)
+            else:
+                line_durations[-1] = planner.handle_command(line)
+        layer_ends.append(len(line_durations))
+
+    for line_idx, duration in zip(move_lines, planner.durations()):
+        line_durations[line_idx] = duration
+
+    layer_durations = []
+    layer_start = 0
+    for layer_end in layer_ends:
+        layer_durations.append(sum(line_durations[layer_start:layer_end]))
+        layer_start = layer_end
+
+    return TimeEstimate(line_durations, layer_durations)
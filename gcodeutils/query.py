@@ -0,0 +1,178 @@
+"""Selection of the lines of a GCode by layer, Z, command, feature type and XY bounding box"""
+import bisect
+from array import array
+
+from gcodeutils.gcoder import Arc, arc_move_gcodes
+
+__author__ = 'olivier'
+
+
+def move_bounds(segments, row):
+    """return the (xmin, ymin, xmax, ymax) bounds of the path of a move, arcs possibly sweeping past their ends"""
+    line = segments.lines[row]
+    start_x, start_y = segments.start_x[row], segments.start_y[row]
+    end_x, end_y = segments.end_x[row], segments.end_y[row]
+    if line.command in arc_move_gcodes:
+        arc = Arc.from_move(start_x, start_y, end_x, end_y, line.i, line.j, line.r, line.command == "G2")
+        if arc is not None:
+            xmin, xmax, ymin, ymax = arc.bounds()
+            return xmin, ymin, xmax, ymax
+    return min(start_x, end_x), min(start_y, end_y), max(start_x, end_x), max(start_y, end_y)
+
+
+class LayerIndex(object):
+    """Sorted Z index of the layers of a GCode and bounding boxes of their moves.
+
+    Bounding boxes are computed from the segment table on first use and follow its invalidation. The Z index is
+    rebuilt when layers are added or removed, filters changing the Z of existing layers must call
+    GCode.invalidate_layer_index()."""
+
+    def __init__(self, gcode):
+        self.gcode = gcode
+        self.layer_count = len(gcode.all_layers)
+        z_layers = sorted((layer.z, layer_idx) for layer_idx, layer in enumerate(gcode.all_layers)
+                          if layer.z is not None)
+        self.zs = array('d', [z for z, _ in z_layers])
+        self.z_layers = array('I', [layer_idx for _, layer_idx in z_layers])
+        self.bboxes = {}
+
+    def is_current(self, gcode):
+        return len(gcode.all_layers) == self.layer_count
+
+    def layers_between(self, zmin=None, zmax=None):
+        """return the indices of the layers whose Z is between zmin and zmax (included), in program order"""
+        start = bisect.bisect_left(self.zs, zmin) if zmin is not None else 0
+        stop = bisect.bisect_right(self.zs, zmax) if zmax is not None else len(self.zs)
+        return sorted(self.z_layers[start:stop])
+
+    def bbox(self, layer_idx):
+        """return the (xmin, ymin, xmax, ymax) bounding box of the moves of a layer, None if it has none"""
+        segments = self.gcode.segments.layer(layer_idx)
+        cached = self.bboxes.get(layer_idx)
+        if cached is not None and cached[0] is segments:
+            return cached[1]
+
+        bbox = None
+        for row, line in enumerate(segments.lines):
+            if not line.is_move:
+                continue
+            bounds = move_bounds(segments, row)
+            if bbox is None:
+                bbox = bounds
+            else:
+                bbox = (min(bbox[0], bounds[0]), min(bbox[1], bounds[1]),
+                        max(bbox[2], bounds[2]), max(bbox[3], bounds[3]))
+        self.bboxes[layer_idx] = (segments, bbox)
+        return bbox
+
+
+class LineView(object):
+    """Lines selected by a query, as references to the lines of the program layers. Lines aren't copied, modifying
+    them modifies the program"""
+
+    def __init__(self, gcode, layer_idxs, line_idxs):
+        self.gcode = gcode
+        self.layer_idxs = layer_idxs
+        self.line_idxs = line_idxs
+
+    def __len__(self):
+        return len(self.layer_idxs)
+
+    def __getitem__(self, idx):
+        return self.gcode.all_layers[self.layer_idxs[idx]][self.line_idxs[idx]]
+
+    def __iter__(self):
+        return (line for _, _, line in self.items())
+
+    def items(self):
+        """return an iterator on the (layer index, line index in the layer, line) of the selected lines"""
+        layer_idx = None
+        layer = None
+        for idx in range(len(self.layer_idxs)):
+            if self.layer_idxs[idx] != layer_idx:
+                layer_idx = self.layer_idxs[idx]
+                layer = self.gcode.all_layers[layer_idx]
+            yield layer_idx, self.line_idxs[idx], layer[self.line_idxs[idx]]
+
+    def layers(self):
+        """return the indices of the layers with selected lines, in program order"""
+        return sorted(set(self.layer_idxs))
+
+
+def _intersects(box, other):
+    return box[0] <= other[2] and other[0] <= box[2] and box[1] <= other[3] and other[1] <= box[3]
+
+
+def _contains(box, other):
+    return box[0] <= other[0] and other[2] <= box[2] and box[1] <= other[1] and other[3] <= box[3]
+
+
+def query(gcode, layers=None, z=None, commands=None, features=None, bbox=None):
+    """return a LineView of the lines matching all the given criteria:
+
+    - layers: (start, stop) range of layer indices, stop excluded
+    - z: (zmin, zmax) range of layer heights, included, either bound may be None
+    - commands: collection of commands (e.g. ('G0', 'G1'))
+    - features: collection of feature codes (see gcodeutils.features)
+    - bbox: (xmin, ymin, xmax, ymax), selecting the moves whose path lies inside the box
+
+    Layers are selected with the Z index and pruned with their bounding boxes before their lines are looked at,
+    features with the feature runs."""
+    index = gcode.layer_index
+
+    if z is not None:
+        layer_candidates = index.layers_between(*z)
+    else:
+        layer_candidates = range(len(gcode.all_layers))
+    if layers is not None:
+        start, stop = layers
+        layer_candidates = [layer_idx for layer_idx in layer_candidates if start <= layer_idx < stop]
+
+    if features is not None:
+        runs = gcode.feature_runs.runs(*features)
+        run_stops = [run_stop for _, _, run_stop in runs]
+    if commands is not None:
+        commands = frozenset(commands)
+
+    layer_idxs = array('I')
+    line_idxs = array('I')
+    for layer_idx in layer_candidates:
+        layer = gcode.all_layers[layer_idx]
+        if not layer:
+            continue
+
+        # lines entirely inside the box when the whole layer is
+        check_bbox = False
+        if bbox is not None:
+            layer_bbox = index.bbox(layer_idx)
+            if layer_bbox is None or not _intersects(bbox, layer_bbox):
+                continue
+            check_bbox = not _contains(bbox, layer_bbox)
+            segments = gcode.segments.layer(layer_idx) if check_bbox else None
+
+        if features is not None:
+            # program index of the first line of the layer, layers being contiguous in the program order
+            layer_start = bisect.bisect_left(gcode.layer_idxs, layer_idx)
+            layer_stop = layer_start + len(layer)
+            rows = []
+            for run in range(bisect.bisect_right(run_stops, layer_start), len(runs)):
+                _, run_start, run_stop = runs[run]
+                if run_start >= layer_stop:
+                    break
+                rows.extend(range(max(run_start, layer_start) - layer_start, min(run_stop, layer_stop) - layer_start))
+        else:
+            rows = range(len(layer))
+
+        for row in rows:
+            line = layer[row]
+            if commands is not None and line.command not in commands:
+                continue
+            if bbox is not None:
+                if not line.is_move:
+                    continue
+                if check_bbox and not _contains(bbox, move_bounds(segments, row)):
+                    continue
+            layer_idxs.append(layer_idx)
+            line_idxs.append(row)
+
+    return LineView(gcode, layer_idxs, line_idxs)
@@ -0,0 +1,238 @@
+"""Raster previews (thumbnails and extrusion heatmaps) of gcode programs, written as PNG with the standard library"""
+from __future__ import division
+
+from array import array
+import base64
+import math
+import struct
+import zlib
+
+from gcodeutils.gcoder import Arc, arc_move_gcodes
+from gcodeutils.spatial import arc_chords
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'olivier'
+
+THUMBNAIL_BEGIN = 'thumbnail begin'
+THUMBNAIL_END = 'thumbnail end'
+# length of the base64 lines of thumbnail blocks, as written by PrusaSlicer
+THUMBNAIL_LINE_LENGTH = 78
+
+DEFAULT_COLOR = (255, 128, 0)
+
+
+def extruding_paths(gcode, layer_idxs=None):
+    """return the (x0, y0, x1, y1, extrusion) columns of the XY paths of the extruding moves of the given layers
+    (all if None), arcs being split into chords"""
+    columns = tuple(array('d') for _ in range(5))
+    x0s, y0s, x1s, y1s, extrusions = columns
+    if layer_idxs is None:
+        layer_idxs = range(len(gcode.all_layers))
+
+    for layer_idx in layer_idxs:
+        segments = gcode.segments.layer(layer_idx)
+        for row, line in enumerate(segments.lines):
+            extrusion = segments.extrusion[row]
+            if not line.is_move or extrusion <= 0:
+                continue
+            start_x, start_y = segments.start_x[row], segments.start_y[row]
+            end_x, end_y = segments.end_x[row], segments.end_y[row]
+            arc = None
+            if line.command in arc_move_gcodes:
+                arc = Arc.from_move(start_x, start_y, end_x, end_y, line.i, line.j, line.r, line.command == "G2")
+            if arc is not None:
+                points = arc_chords(arc)
+            elif start_x != end_x or start_y != end_y:
+                points = [(start_x, start_y), (end_x, end_y)]
+            else:
+                continue
+            piece_extrusion = extrusion / (len(points) - 1)
+            for (x0, y0), (x1, y1) in zip(points, points[1:]):
+                x0s.append(x0)
+                y0s.append(y0)
+                x1s.append(x1)
+                y1s.append(y1)
+                extrusions.append(piece_extrusion)
+    return columns
+
+
+class Raster(object):
+    """Accumulation buffer of segments drawn over a rectangle of the XY plane.
+
+    Segments are sampled once per pixel along their major axis, each sample adding its share of the segment weight
+    to the pixel it falls in, so that the buffer holds the weight (length in pixels by default) drawn over each
+    pixel. Drawing is vectorized with numpy when available. With supersampling, the buffer is that many times
+    larger in each direction and averaged down when read."""
+
+    def __init__(self, width, height, bounds, supersampling=1):
+        self.width = width
+        self.height = height
+        self.supersampling = supersampling
+
+        xmin, ymin, xmax, ymax = bounds
+        buffer_width = width * supersampling
+        buffer_height = height * supersampling
+        # keep the aspect ratio, centering the drawing
+        self.scale = min(buffer_width / max(xmax - xmin, 1e-6), buffer_height / max(ymax - ymin, 1e-6))
+        self.offset_x = (buffer_width - (xmax - xmin) * self.scale) / 2 - xmin * self.scale
+        # Y goes up in gcode, down in images
+        self.offset_y = (buffer_height - (ymax - ymin) * self.scale) / 2 + ymax * self.scale
+
+        if numpy is not None:
+            self.pixels = numpy.zeros((buffer_height, buffer_width))
+        else:
+            self.pixels = array('d', [0.]) * (buffer_width * buffer_height)
+
+    def draw(self, x0s, y0s, x1s, y1s, weights=None):
+        """draw segments given as columns of coordinates, with optional per segment weights"""
+        if not len(x0s):
+            return
+        if numpy is not None:
+            self._numpy_draw(x0s, y0s, x1s, y1s, weights)
+        else:
+            self._python_draw(x0s, y0s, x1s, y1s, weights)
+
+    def _numpy_draw(self, x0s, y0s, x1s, y1s, weights):
+        x0s = numpy.asarray(x0s, dtype=float) * self.scale + self.offset_x
+        y0s = self.offset_y - numpy.asarray(y0s, dtype=float) * self.scale
+        dxs = numpy.asarray(x1s, dtype=float) * self.scale + self.offset_x - x0s
+        dys = self.offset_y - numpy.asarray(y1s, dtype=float) * self.scale - y0s
+        counts = numpy.maximum(1, numpy.ceil(numpy.maximum(numpy.abs(dxs), numpy.abs(dys)))).astype(int)
+        if weights is None:
+            weights = numpy.hypot(dxs, dys)
+        else:
+            weights = numpy.asarray(weights, dtype=float)
+
+        # all the samples of all the segments at once
+        segments = numpy.repeat(numpy.arange(len(counts)), counts)
+        steps = numpy.arange(len(segments)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        ratios = (steps + .5) / counts[segments]
+        xs = numpy.floor(x0s[segments] + ratios * dxs[segments]).astype(int)
+        ys = numpy.floor(y0s[segments] + ratios * dys[segments]).astype(int)
+
+        height, width = self.pixels.shape
+        inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        numpy.add.at(self.pixels, (ys[inside], xs[inside]), (weights / counts)[segments][inside])
+
+    def _python_draw(self, x0s, y0s, x1s, y1s, weights):
+        width = self.width * self.supersampling
+        height = self.height * self.supersampling
+        pixels = self.pixels
+        for segment in range(len(x0s)):
+            x0 = x0s[segment] * self.scale + self.offset_x
+            y0 = self.offset_y - y0s[segment] * self.scale
+            dx = x1s[segment] * self.scale + self.offset_x - x0
+            dy = self.offset_y - y1s[segment] * self.scale - y0
+            count = max(1, int(math.ceil(max(abs(dx), abs(dy)))))
+            weight = (math.hypot(dx, dy) if weights is None else weights[segment]) / count
+            for step in range(count):
+                ratio = (step + .5) / count
+                x = int(math.floor(x0 + ratio * dx))
+                y = int(math.floor(y0 + ratio * dy))
+                if 0 <= x < width and 0 <= y < height:
+                    pixels[y * width + x] += weight
+
+    def values(self):
+        """return the rows of pixel values, averaged over the supersampled pixels"""
+        sampling = self.supersampling
+        if numpy is not None:
+            return self.pixels.reshape(self.height, sampling, self.width, sampling).mean(axis=(1, 3)).tolist()
+
+        buffer_width = self.width * sampling
+        rows = []
+        for y in range(self.height):
+            row = []
+            for x in range(self.width):
+                row.append(sum(self.pixels[(y * sampling + sub_y) * buffer_width + x * sampling + sub_x]
+                               for sub_y in range(sampling) for sub_x in range(sampling)) / sampling ** 2)
+            rows.append(row)
+        return rows
+
+
+def write_png(rows, alpha=False):
+    """return the PNG encoding of an image given as rows of (r, g, b) or (r, g, b, a) byte tuples"""
+    height = len(rows)
+    width = len(rows[0]) if rows else 0
+
+    raw = bytearray()
+    for row in rows:
+        # no filtering
+        raw.append(0)
+        for pixel in row:
+            raw.extend(pixel)
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 6 if alpha else 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(bytes(raw), 9)) +
+            chunk(b'IEND', b''))
+
+
+def heat_color(value):
+    """return the (r, g, b) color of a value between 0 and 1, going from black to red, yellow and white"""
+    value = min(1., max(0., value))
+    return (int(round(255 * min(1., value * 3))), int(round(255 * min(1., max(0., value * 3 - 1)))),
+            int(round(255 * max(0., value * 3 - 2))))
+
+
+def paths_bounds(x0s, y0s, x1s, y1s):
+    """return the (xmin, ymin, xmax, ymax) bounds of paths, at least 1mm wide and deep"""
+    if not len(x0s):
+        return 0., 0., 1., 1.
+    xmin, xmax = min(min(x0s), min(x1s)), max(max(x0s), max(x1s))
+    ymin, ymax = min(min(y0s), min(y1s)), max(max(y0s), max(y1s))
+    margin_x = max(0., 1. - (xmax - xmin)) / 2
+    margin_y = max(0., 1. - (ymax - ymin)) / 2
+    return xmin - margin_x, ymin - margin_y, xmax + margin_x, ymax + margin_y
+
+
+def _prepare(gcode, width, height, supersampling, layer_idxs, bounds):
+    """return the extruding paths of the given layers and a raster framing them, or framing the extruding paths of
+    the whole program when no bounds are given"""
+    paths = extruding_paths(gcode, layer_idxs)
+    if bounds is None:
+        bounds = paths_bounds(*(paths if layer_idxs is None else extruding_paths(gcode))[:4])
+    return paths, Raster(width, height, bounds, supersampling)
+
+
+def render_thumbnail(gcode, width, height, supersampling=4, color=DEFAULT_COLOR, layer_idxs=None, bounds=None):
+    """return a PNG top view of the extruding moves of the given layers (all if None), with a transparent
+    background"""
+    paths, raster = _prepare(gcode, width, height, supersampling, layer_idxs, bounds)
+    raster.draw(*paths[:4])
+    # paths are drawn one pixel wide, a pixel fully crossed by a path being opaque
+    return write_png([[color + (int(round(255 * min(1., value * supersampling))),) for value in row]
+                      for row in raster.values()], alpha=True)
+
+
+def render_heatmap(gcode, width, height, supersampling=1, layer_idxs=None, bounds=None):
+    """return a PNG heatmap of the filament extruded over each pixel by the given layers (all if None)"""
+    paths, raster = _prepare(gcode, width, height, supersampling, layer_idxs, bounds)
+    raster.draw(*paths)
+    values = raster.values()
+    peak = max(max(row) for row in values) or 1.
+    return write_png([[heat_color(value / peak) for value in row] for row in values])
+
+
+def thumbnail_block(png, width, height):
+    """return the comment lines of a slicer style thumbnail block holding a PNG image"""
+    encoded = base64.b64encode(png).decode('ascii')
+    lines = [';', '; {} {}x{} {}'.format(THUMBNAIL_BEGIN, width, height, len(encoded))]
+    lines += ['; ' + encoded[start:start + THUMBNAIL_LINE_LENGTH]
+              for start in range(0, len(encoded), THUMBNAIL_LINE_LENGTH)]
+    lines += ['; ' + THUMBNAIL_END, ';']
+    return lines
+
+
+def embed_thumbnails(gcode, sizes, supersampling=4, color=DEFAULT_COLOR):
+    """insert thumbnail blocks of the given (width, height) sizes at the beginning of a GCode"""
+    lines = []
+    for width, height in sizes:
+        lines += thumbnail_block(render_thumbnail(gcode, width, height, supersampling, color), width, height)
+    gcode.insert_lines([(0, 0, lines)])
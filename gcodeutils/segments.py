@@ -0,0 +1,191 @@
+"""Per layer table of the segments travelled by each line of a GCode"""
+from __future__ import division
+
+from array import array
+from collections import namedtuple
+import math
+
+from gcodeutils.gcoder import Arc, arc_move_gcodes
+
+__author__ = 'olivier'
+
+SEGMENT_COLUMNS = ('start_x', 'start_y', 'start_z', 'end_x', 'end_y', 'end_z', 'length', 'xy_length',
+                   'direction_x', 'direction_y', 'direction_z', 'extrusion', 'extrusion_per_mm', 'feedrate')
+
+Segment = namedtuple('Segment', SEGMENT_COLUMNS)
+
+# state of the program at the beginning of a layer: the last line before it with a known machine position, comments
+# having none, and the extruder position in the program coordinates
+LayerEntry = namedtuple('LayerEntry', ('previous_line', 'e'))
+
+FIRST_LAYER_ENTRY = LayerEntry(None, 0.)
+
+
+def next_layer_entry(entry, layer):
+    """return the LayerEntry following a layer, given the one of its beginning"""
+    previous_line, e = entry
+    for line in layer:
+        if line.current_x is not None:
+            previous_line = line
+        if line.e is None:
+            continue
+        if line.command == "G92" or (line.is_move and not line.relative_e):
+            e = line.e
+        elif line.is_move:
+            e += line.e
+    return LayerEntry(previous_line, e)
+
+
+def same_lines(layer, signature):
+    """return whether a layer still has the length, first and last lines of a layer_signature()"""
+    length, first, last = signature
+    return len(layer) == length and (not layer or (layer[0] is first and layer[-1] is last))
+
+
+def layer_signature(layer):
+    """return the length, first and last lines of a layer, to tell later whether it has been rebuilt"""
+    return len(layer), layer[0] if layer else None, layer[-1] if layer else None
+
+
+class LayerSegments(object):
+    """Segments of the lines of a layer, as columns of floats with one row per line.
+
+    Segments go from the machine position after the previous line to the one after the line, non move lines
+    having null segments. length is the travelled length in space (along the arc for G2/G3), xy_length its projection
+    on the XY plane, direction the unit vector from start to end and extrusion the filament pushed by the line, in
+    program order. Values are derived from the machine state computed while parsing (current_x, ...) and from the
+    LayerEntry of the layer."""
+
+    def __init__(self, gcode, layer_idx, entry=FIRST_LAYER_ENTRY):
+        layer = gcode.all_layers[layer_idx]
+        self.lines = tuple(layer)
+        self.entry = entry
+        self.row_of = None
+
+        for column in SEGMENT_COLUMNS:
+            setattr(self, column, array('d'))
+
+        if entry.previous_line is not None:
+            x, y, z = self._position(entry.previous_line)
+        else:
+            x, y, z = gcode.home_x, gcode.home_y, gcode.home_z
+        # extruder position in the program coordinates
+        e = entry.e
+
+        for line in self.lines:
+            end_x, end_y, end_z = self._position(line, (x, y, z))
+            extrusion = 0.
+            length = 0.
+            xy_length = 0.
+            direction = (0., 0., 0.)
+
+            if line.is_move:
+                if line.e is not None:
+                    if line.relative_e:
+                        extrusion = line.e
+                        e += line.e
+                    else:
+                        extrusion = line.e - e
+                        e = line.e
+
+                chord = math.sqrt((end_x - x) ** 2 + (end_y - y) ** 2 + (end_z - z) ** 2)
+                length = chord
+                xy_length = math.hypot(end_x - x, end_y - y)
+                if chord:
+                    direction = ((end_x - x) / chord, (end_y - y) / chord, (end_z - z) / chord)
+                if line.command in arc_move_gcodes:
+                    arc = Arc.from_move(x, y, end_x, end_y, line.i, line.j, line.r, line.command == "G2")
+                    if arc is not None:
+                        xy_length = arc.length
+                        length = math.hypot(arc.length, end_z - z)
+            elif line.command == "G92" and line.e is not None:
+                e = line.e
+
+            for column, value in zip(SEGMENT_COLUMNS, (x, y, z, end_x, end_y, end_z, length, xy_length) + direction +
+                                     (extrusion, extrusion / length if length else 0., line.current_f or 0.)):
+                getattr(self, column).append(value)
+
+            x, y, z = end_x, end_y, end_z
+
+    @staticmethod
+    def _position(line, default=(0., 0., 0.)):
+        return tuple(default[idx] if value is None else value
+                     for idx, value in enumerate((line.current_x, line.current_y, line.current_z)))
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, row):
+        return Segment(*(getattr(self, column)[row] for column in SEGMENT_COLUMNS))
+
+    def find(self, line):
+        """return the row of a line of the layer, None if it doesn't belong to the layer"""
+        if self.row_of is None:
+            self.row_of = dict((id(layer_line), row) for row, layer_line in enumerate(self.lines))
+        return self.row_of.get(id(line))
+
+    def is_current(self, layer, entry):
+        """return whether the segments still match the layer and its LayerEntry. Only the length and the first and
+        last lines of the layer are checked so that it can be called for each line lookup"""
+        if not same_lines(layer, layer_signature(self.lines)):
+            return False
+        return entry.previous_line is self.entry.previous_line and entry.e == self.entry.e
+
+
+class SegmentTable(object):
+    """Lazily computed segments of a GCode, by layer.
+
+    Segments of a layer are computed on first access and recomputed when the layer has been rebuilt (different
+    length, first or last line) or its LayerEntry has changed since. LayerEntries are computed once from the one of
+    the previous layer and kept with the signature of that layer, so that a rebuilt layer is noticed by the next one.
+    Only the layer right before is checked on lookups: GCodeFilter invalidates the layers it modifies, code modifying
+    lines in place otherwise, or replacing only some of them, must call invalidate(), which also forgets the entries
+    of the following layers."""
+
+    def __init__(self, gcode):
+        self.gcode = gcode
+        self.layers = {}
+        # (LayerEntry of each layer from the first one, signature of the layer before it)
+        self.entries = []
+
+    def entry(self, layer_idx):
+        """return the LayerEntry of a layer"""
+        layers = self.gcode.all_layers
+        if 0 < layer_idx < len(self.entries) and not same_lines(layers[layer_idx - 1], self.entries[layer_idx][1]):
+            # the previous layer has been rebuilt, the entries from this one on are outdated
+            del self.entries[layer_idx:]
+
+        if not self.entries:
+            self.entries.append((FIRST_LAYER_ENTRY, None))
+        while len(self.entries) <= layer_idx:
+            previous_layer = layers[len(self.entries) - 1]
+            entry = next_layer_entry(self.entries[-1][0], previous_layer)
+            self.entries.append((entry, layer_signature(previous_layer)))
+        return self.entries[layer_idx][0]
+
+    def layer(self, layer_idx):
+        """return the LayerSegments of a layer"""
+        segments = self.layers.get(layer_idx)
+        entry = self.entry(layer_idx)
+        if segments is None or not segments.is_current(self.gcode.all_layers[layer_idx], entry):
+            segments = self.layers[layer_idx] = LayerSegments(self.gcode, layer_idx, entry)
+        return segments
+
+    def segment(self, line, layer_idx):
+        """return the Segment of a line, looked up in the given layer and the previous one, None if not found"""
+        for candidate_idx in (layer_idx, layer_idx - 1):
+            if 0 <= candidate_idx < len(self.gcode.all_layers):
+                segments = self.layer(candidate_idx)
+                row = segments.find(line)
+                if row is not None:
+                    return segments[row]
+        return None
+
+    def invalidate(self, layer_idx=None):
+        """forget the segments of a layer, or of all layers"""
+        if layer_idx is None:
+            self.layers.clear()
+            del self.entries[:]
+        else:
+            self.layers.pop(layer_idx, None)
+            del self.entries[layer_idx + 1:]
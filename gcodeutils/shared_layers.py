@@ -0,0 +1,192 @@
+"""Layers laid out in shared memory, so that worker processes exchange them without pickling"""
+from array import array
+
+from gcodeutils.gcoder import Layer, pack_line, unpack_line
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+__author__ = 'olivier'
+
+# whether layers can be shared, multiprocessing.shared_memory is only available from Python 3.8
+SHARED_MEMORY = shared_memory is not None
+
+# sections of a shared block: name and item type, by decreasing alignment so that they need no padding
+SECTIONS = (('z', 'd'), ('durations', 'd'),  # per layer, NaN for None
+            ('line_starts', 'q'), ('float_starts', 'q'), ('tool_starts', 'q'),  # per layer, plus an end
+            ('floats', 'd'),
+            ('raw_offsets', 'q'),  # per line, plus an end
+            ('tools', 'i'), ('masks', 'I'), ('codes', 'H'), ('raws', 'B'))
+
+
+def _optional_float(value):
+    return float('nan') if value is None else value
+
+
+def _optional_value(value):
+    return None if value != value else value
+
+
+class SharedLayersHandle(object):
+    """small picklable reference to shared layers: name of the memory block and length of its sections"""
+    __slots__ = ('name', 'command_names', 'lengths')
+
+    def __init__(self, name, command_names, lengths):
+        self.name = name
+        self.command_names = command_names
+        self.lengths = lengths
+
+    def __getstate__(self):
+        return self.name, self.command_names, self.lengths
+
+    def __setstate__(self, state):
+        self.name, self.command_names, self.lengths = state
+
+
+class SharedLayers(object):
+    """Read only list like view of layers packed (see gcoder.pack_line) in a shared memory block.
+
+    The process creating the layers shares them through their handle, other processes attach to the block with it
+    and read any layer out of the shared memory, its lines being rebuilt from the packed values rather than unpickled
+    or parsed again. The block lives until one of them unlinks it."""
+
+    def __init__(self, block, handle):
+        self.block = block
+        self.handle = handle
+        self.sections = {}
+
+        offset = 0
+        for name, typecode in SECTIONS:
+            length = handle.lengths[name]
+            size = length * array(typecode).itemsize
+            self.sections[name] = block.buf[offset:offset + size].cast(typecode)
+            offset += size
+
+    @classmethod
+    def create(cls, layers):
+        """pack layers into a new shared memory block"""
+        values = dict((name, array(typecode)) for name, typecode in SECTIONS)
+        commands = {}
+        raw_size = 0
+        for layer in layers:
+            values['z'].append(_optional_float(layer.z))
+            values['durations'].append(_optional_float(getattr(layer, 'duration', None)))
+            values['line_starts'].append(len(values['codes']))
+            values['float_starts'].append(len(values['floats']))
+            values['tool_starts'].append(len(values['tools']))
+            for line in layer:
+                code, mask = pack_line(line, commands, values['floats'], values['tools'])
+                values['codes'].append(code)
+                values['masks'].append(mask)
+                values['raw_offsets'].append(raw_size)
+                raw = (line.raw or '').encode('utf-8')
+                values['raws'].frombytes(raw)
+                raw_size += len(raw)
+        values['line_starts'].append(len(values['codes']))
+        values['float_starts'].append(len(values['floats']))
+        values['tool_starts'].append(len(values['tools']))
+        values['raw_offsets'].append(raw_size)
+
+        lengths = dict((name, len(section)) for name, section in values.items())
+        size = sum(section.itemsize * len(section) for section in values.values())
+        block = shared_memory.SharedMemory(create=True, size=max(1, size))
+        shared = cls(block, SharedLayersHandle(block.name, sorted(commands, key=commands.get), lengths))
+        for name, section in values.items():
+            shared.sections[name][:] = section
+        return shared
+
+    @classmethod
+    def attach(cls, handle):
+        """return the layers shared with a handle"""
+        return cls(shared_memory.SharedMemory(name=handle.name), handle)
+
+    def __len__(self):
+        return self.handle.lengths['z']
+
+    def __iter__(self):
+        for layer_idx in range(len(self)):
+            yield self[layer_idx]
+
+    def __getitem__(self, layer_idx):
+        if layer_idx < 0:
+            layer_idx += len(self)
+        if not 0 <= layer_idx < len(self):
+            raise IndexError("layer index out of range")
+
+        sections = self.sections
+        line_start, line_end = sections['line_starts'][layer_idx], sections['line_starts'][layer_idx + 1]
+        floats = iter(sections['floats'][sections['float_starts'][layer_idx]:sections['float_starts'][layer_idx + 1]])
+        tools = iter(sections['tools'][sections['tool_starts'][layer_idx]:sections['tool_starts'][layer_idx + 1]])
+        raw_offsets = sections['raw_offsets'][line_start:line_end + 1]
+        raws = sections['raws']
+
+        command_names = self.handle.command_names
+        layer = Layer([unpack_line(raws[start:end].tobytes().decode('utf-8'), code, mask, command_names, floats, tools)
+                       for start, end, code, mask in zip(raw_offsets, raw_offsets[1:],
+                                                         sections['codes'][line_start:line_end],
+                                                         sections['masks'][line_start:line_end])],
+                      _optional_value(sections['z'][layer_idx]))
+        duration = _optional_value(sections['durations'][layer_idx])
+        if duration is not None:
+            layer.duration = duration
+        return layer
+
+    def close(self):
+        """release the view of the layers, the shared block is left to other processes"""
+        for section in self.sections.values():
+            section.release()
+        self.sections = {}
+        self.block.close()
+
+    def unlink(self):
+        """close the layers and free the shared block"""
+        self.close()
+        self.block.unlink()
+
+
+def prepare_workers():
+    """start the resource tracker of this process before creating worker processes, so that they share it: blocks
+    exported by a worker then outlive it, and are reclaimed when this process ends if they're never imported"""
+    resource_tracker.ensure_running()
+
+
+def export_layers(layers):
+    """share layers in a new memory block, return its handle. The receiving process frees the block with
+    import_layers, see also prepare_workers."""
+    shared = SharedLayers.create(layers)
+    shared.close()
+    return shared.handle
+
+
+def import_layers(handle):
+    """return the layers exported with a handle as a list, freeing their block"""
+    shared = SharedLayers.attach(handle)
+    try:
+        return list(shared)
+    finally:
+        shared.unlink()
+
+
+def import_all_layers(handles):
+    """return the layers exported with an iterator of handles, such as the results of Pool.imap, as a list. All
+    blocks are freed even when getting a handle fails, the first error being raised once the handles are exhausted."""
+    layers = []
+    error = None
+    while True:
+        try:
+            handle = next(handles)
+        except StopIteration:
+            break
+        except Exception as exception:  # pylint: disable=broad-except
+            error = error or exception
+            continue
+
+        if error is None:
+            layers += import_layers(handle)
+        else:
+            SharedLayers.attach(handle).unlink()
+    if error is not None:
+        raise error
+    return layers
@@ -0,0 +1,230 @@
+"""Per layer uniform grid index over the XY paths of the moves, for radius, nearest and intersection queries"""
+from __future__ import division
+
+from array import array
+import math
+
+from gcodeutils.gcoder import Arc, arc_move_gcodes
+
+__author__ = 'olivier'
+
+# maximum distance between an arc and the chords approximating it
+ARC_TOLERANCE = 0.01
+
+
+def point_segment_distance(x, y, x0, y0, x1, y1):
+    """return the distance between a point and a segment"""
+    dx = x1 - x0
+    dy = y1 - y0
+    length_2 = dx * dx + dy * dy
+    if length_2:
+        ratio = min(1., max(0., ((x - x0) * dx + (y - y0) * dy) / length_2))
+        x0 += ratio * dx
+        y0 += ratio * dy
+    return math.hypot(x - x0, y - y0)
+
+
+def _orientation(ax, ay, bx, by, cx, cy):
+    cross = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+    return (cross > 0) - (cross < 0)
+
+
+def _on_segment(ax, ay, bx, by, cx, cy):
+    """whether c, collinear with a and b, lies on the segment ab"""
+    return min(ax, bx) <= cx <= max(ax, bx) and min(ay, by) <= cy <= max(ay, by)
+
+
+def segments_intersect(ax, ay, bx, by, cx, cy, dx, dy):
+    """return whether the segments ab and cd intersect, touching included"""
+    o1 = _orientation(ax, ay, bx, by, cx, cy)
+    o2 = _orientation(ax, ay, bx, by, dx, dy)
+    o3 = _orientation(cx, cy, dx, dy, ax, ay)
+    o4 = _orientation(cx, cy, dx, dy, bx, by)
+    if o1 != o2 and o3 != o4:
+        return True
+    return ((o1 == 0 and _on_segment(ax, ay, bx, by, cx, cy)) or (o2 == 0 and _on_segment(ax, ay, bx, by, dx, dy)) or
+            (o3 == 0 and _on_segment(cx, cy, dx, dy, ax, ay)) or (o4 == 0 and _on_segment(cx, cy, dx, dy, bx, by)))
+
+
+def arc_chords(arc, tolerance=ARC_TOLERANCE):
+    """return the points of the chords approximating an arc within the given tolerance"""
+    if arc.radius > tolerance:
+        max_angle = 2 * math.acos(1 - tolerance / arc.radius)
+    else:
+        max_angle = math.pi / 2
+    count = max(1, int(math.ceil(abs(arc.sweep) / max_angle)))
+    return [(arc.center_x + arc.radius * math.cos(arc.start_angle + arc.sweep * step / count),
+             arc.center_y + arc.radius * math.sin(arc.start_angle + arc.sweep * step / count))
+            for step in range(count + 1)]
+
+
+class SegmentGrid(object):
+    """Uniform grid over the XY paths of the moves of a layer.
+
+    Paths are stored as pieces (arcs being split into chords), each one registered in every cell its bounding box
+    overlaps. Queries return rows of the LayerSegments the grid is built from. extruding selects the indexed moves:
+    only extruding ones when True, only travels when False, all when None."""
+
+    def __init__(self, segments, cell_size=None, extruding=None, arc_tolerance=ARC_TOLERANCE):
+        self.segments = segments
+        self.extruding = extruding
+
+        self.x0 = array('d')
+        self.y0 = array('d')
+        self.x1 = array('d')
+        self.y1 = array('d')
+        self.rows = array('I')
+
+        for row, line in enumerate(segments.lines):
+            if not line.is_move:
+                continue
+            if extruding is not None and (segments.extrusion[row] > 0) != extruding:
+                continue
+            start_x, start_y = segments.start_x[row], segments.start_y[row]
+            end_x, end_y = segments.end_x[row], segments.end_y[row]
+            arc = None
+            if line.command in arc_move_gcodes:
+                arc = Arc.from_move(start_x, start_y, end_x, end_y, line.i, line.j, line.r, line.command == "G2")
+            if arc is not None:
+                points = arc_chords(arc, arc_tolerance)
+            elif start_x != end_x or start_y != end_y:
+                points = [(start_x, start_y), (end_x, end_y)]
+            else:
+                continue
+            for (x0, y0), (x1, y1) in zip(points, points[1:]):
+                self.x0.append(x0)
+                self.y0.append(y0)
+                self.x1.append(x1)
+                self.y1.append(y1)
+                self.rows.append(row)
+
+        self.cells = {}
+        if not self.rows:
+            self.cell_size = cell_size or 1.
+            self.min_cell = self.max_cell = (0, 0)
+            return
+
+        xmin = min(min(self.x0), min(self.x1))
+        ymin = min(min(self.y0), min(self.y1))
+        xmax = max(max(self.x0), max(self.x1))
+        ymax = max(max(self.y0), max(self.y1))
+        if cell_size is None:
+            # about one piece per cell, pieces of a layer being spread over its area
+            cell_size = math.sqrt(max(xmax - xmin, 1.) * max(ymax - ymin, 1.) / len(self.rows))
+        self.cell_size = cell_size
+        self.min_cell = self.cell(xmin, ymin)
+        self.max_cell = self.cell(xmax, ymax)
+
+        cells = self.cells
+        for piece in range(len(self.rows)):
+            x0, y0, x1, y1 = self.x0[piece], self.y0[piece], self.x1[piece], self.y1[piece]
+            for key in self._cells_overlapping(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)):
+                pieces = cells.get(key)
+                if pieces is None:
+                    pieces = cells[key] = array('I')
+                pieces.append(piece)
+
+    def cell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def _cells_overlapping(self, xmin, ymin, xmax, ymax):
+        min_x, min_y = self.cell(xmin, ymin)
+        max_x, max_y = self.cell(xmax, ymax)
+        # clamp to the grid so that huge query boxes don't enumerate empty cells
+        min_x, min_y = max(min_x, self.min_cell[0]), max(min_y, self.min_cell[1])
+        max_x, max_y = min(max_x, self.max_cell[0]), min(max_y, self.max_cell[1])
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                yield cell_x, cell_y
+
+    def _ring_cells(self, center_x, center_y, ring):
+        """yield the cells of the grid on the perimeter of the square of cells at ring cells from a cell"""
+        min_x, min_y = self.min_cell
+        max_x, max_y = self.max_cell
+        if ring == 0:
+            if min_x <= center_x <= max_x and min_y <= center_y <= max_y:
+                yield center_x, center_y
+            return
+
+        # bottom and top rows, then left and right columns without their corners
+        for cell_y in (center_y - ring, center_y + ring):
+            if min_y <= cell_y <= max_y:
+                for cell_x in range(max(center_x - ring, min_x), min(center_x + ring, max_x) + 1):
+                    yield cell_x, cell_y
+        for cell_x in (center_x - ring, center_x + ring):
+            if min_x <= cell_x <= max_x:
+                for cell_y in range(max(center_y - ring + 1, min_y), min(center_y + ring - 1, max_y) + 1):
+                    yield cell_x, cell_y
+
+    def _candidates(self, xmin, ymin, xmax, ymax):
+        seen = set()
+        for key in self._cells_overlapping(xmin, ymin, xmax, ymax):
+            for piece in self.cells.get(key, ()):
+                if piece not in seen:
+                    seen.add(piece)
+                    yield piece
+
+    def _piece_distance(self, piece, x, y):
+        return point_segment_distance(x, y, self.x0[piece], self.y0[piece], self.x1[piece], self.y1[piece])
+
+    def within(self, x, y, radius):
+        """return the sorted rows of the moves passing within radius of a point"""
+        rows = set()
+        for piece in self._candidates(x - radius, y - radius, x + radius, y + radius):
+            if self.rows[piece] not in rows and self._piece_distance(piece, x, y) <= radius:
+                rows.add(self.rows[piece])
+        return sorted(rows)
+
+    def nearest(self, x, y, max_distance=None):
+        """return the (row, distance) of the move nearest to a point, None if there's none (within max_distance)"""
+        if not self.rows:
+            return None
+
+        best = None
+        center_x, center_y = self.cell(x, y)
+        # rings of cells around the point, from the first one reaching the grid up to the farthest grid corner
+        min_x, min_y = self.min_cell
+        max_x, max_y = self.max_cell
+        first_ring = max(min_x - center_x, center_x - max_x, min_y - center_y, center_y - max_y, 0)
+        max_ring = max(abs(center_x - min_x), abs(center_x - max_x), abs(center_y - min_y), abs(center_y - max_y))
+        for ring in range(first_ring, max_ring + 1):
+            # pieces outside the rings searched so far are at least that far from the point
+            if best is not None and best[1] <= (ring - 1) * self.cell_size:
+                break
+            if max_distance is not None and (ring - 1) * self.cell_size > max_distance:
+                break
+            for key in self._ring_cells(center_x, center_y, ring):
+                for piece in self.cells.get(key, ()):
+                    distance = self._piece_distance(piece, x, y)
+                    if best is None or distance < best[1]:
+                        best = (self.rows[piece], distance)
+
+        if best is None or (max_distance is not None and best[1] > max_distance):
+            return None
+        return best
+
+    def intersecting(self, x0, y0, x1, y1):
+        """return the sorted rows of the moves crossing or touching the segment from (x0, y0) to (x1, y1)"""
+        rows = set()
+        for piece in self._candidates(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)):
+            if self.rows[piece] not in rows and segments_intersect(x0, y0, x1, y1, self.x0[piece], self.y0[piece],
+                                                                   self.x1[piece], self.y1[piece]):
+                rows.add(self.rows[piece])
+        return sorted(rows)
+
+
+class SpatialIndex(object):
+    """Lazily built SegmentGrids of a GCode, by layer and selection of moves. Grids follow the invalidation of the
+    segment table they're built from."""
+
+    def __init__(self, gcode):
+        self.gcode = gcode
+        self.grids = {}
+
+    def layer(self, layer_idx, extruding=None):
+        """return the SegmentGrid of a layer"""
+        segments = self.gcode.segments.layer(layer_idx)
+        grid = self.grids.get((layer_idx, extruding))
+        if grid is None or grid.segments is not segments:
+            grid = self.grids[(layer_idx, extruding)] = SegmentGrid(segments, extruding=extruding)
+        return grid
@@ -94,6 +94,10 @@ import zlib
 
 import re
 
+from gcodeutils.comments import CommentClassifier
+from gcodeutils.features import INNER_WALL, OUTER_WALL, SKIN, comment_feature, trailing_comment_feature
+from gcodeutils.filter.cache import entry_state
+from gcodeutils.filter.filter import ContextualFilter, context_attribute
 from gcodeutils.gcoder import split, Line, parse_coordinates, unsplit, linear_move_gcodes
 from .vector3 import Vector3
 
@@ -124,11 +128,13 @@ class LineIteratorForwardLegacy(object):
 
     logger = logging.getLogger('iterator')
 
-    def __init__(self, line_index, lines):
+    def __init__(self, line_index, lines, markers=None):
         self.first_visited_index = None
         self.line_index = line_index
         self.first_visited_index = None
         self.lines = lines
+        # marker classes of the lines, see StretchFilter.MARKERS
+        self.markers = markers if markers is not None else StretchFilter.MARKERS.classify_lines(lines)
         self.increment = 1
         self.stop_on_extrusion_off = True
 
@@ -141,7 +147,7 @@ class LineIteratorForwardLegacy(object):
         """Get index just after the activate command."""
         self.logger.debug("reset index forward")
         for lineIndex in xrange(self.line_index - 1, 0, - 1):
-            if StretchFilter.EXTRUSION_ON_MARKER in self.lines[lineIndex].raw:
+            if self.markers[lineIndex] & StretchFilter.EXTRUSION_ON:
                 return lineIndex + 1
         print('This should never happen in stretch, no activate command was found for this thread.')
         raise StopIteration, "You've reached the end of the line."
@@ -163,7 +169,7 @@ class LineIteratorForwardLegacy(object):
                 self.first_visited_index = self.line_index
 
             line = self.lines[self.line_index]
-            if StretchFilter.EXTRUSION_OFF_MARKER in line.raw and self.stop_on_extrusion_off:
+            if self.markers[self.line_index] & StretchFilter.EXTRUSION_OFF and self.stop_on_extrusion_off:
                 self.line_index = self.reset_index_on_limit()
                 continue
 
@@ -179,8 +185,8 @@ class LineIteratorForwardLegacy(object):
 class LineIteratorBackwardLegacy(LineIteratorForwardLegacy):
     """Backward line iterator class."""
 
-    def __init__(self, line_index, lines):
-        super(LineIteratorBackwardLegacy, self).__init__(line_index, lines)
+    def __init__(self, line_index, lines, markers=None):
+        super(LineIteratorBackwardLegacy, self).__init__(line_index, lines, markers)
         self.increment = -1
 
     def index_setup(self):
@@ -193,7 +199,7 @@ class LineIteratorBackwardLegacy(LineIteratorForwardLegacy):
         self.logger.debug("reset index backward")
 
         for lineIndex in xrange(self.line_index + 1, len(self.lines)):
-            if StretchFilter.EXTRUSION_OFF_MARKER in self.lines[lineIndex].raw:
+            if self.markers[lineIndex] & StretchFilter.EXTRUSION_OFF:
                 return lineIndex - 2
         print('This should never happen in stretch, no deactivate command was found for this thread.')
         raise StopIteration, "You've reached the end of the line."
@@ -204,26 +210,26 @@ class LineIteratorForward(LineIteratorForwardLegacy):
         """Get index just after the activate command."""
         self.logger.debug("reset index forward (modern)")
         for lineIndex in xrange(self.line_index - 1, -1, - 1):
-            if StretchFilter.LOOP_START_MARKER in self.lines[lineIndex].raw:
+            if self.markers[lineIndex] & StretchFilter.LOOP_START:
                 return lineIndex + 1
         print('This should never happen in stretch, no activate command was found for this thread.')
         raise StopIteration, "You've reached the end of the line."
 
 
 class CuraLineIteratorForward(LineIteratorForwardLegacy):
-    def __init__(self, line_index, lines):
-        super(CuraLineIteratorForward, self).__init__(line_index, lines)
+    def __init__(self, line_index, lines, markers=None):
+        super(CuraLineIteratorForward, self).__init__(line_index, lines, markers)
         self.stop_on_extrusion_off = False
 
     def index_setup(self):
-        if StretchFilter.LOOP_STOP_MARKER in self.lines[self.line_index].raw:
+        if self.markers[self.line_index] & StretchFilter.LOOP_STOP:
             self.line_index = self.reset_index_on_limit()
 
     def reset_index_on_limit(self):
         """Get index just after the activate command."""
         self.logger.debug("reset index forward (modern)")
         for lineIndex in xrange(self.line_index - 1, -1, - 1):
-            if StretchFilter.LOOP_START_MARKER in self.lines[lineIndex].raw:
+            if self.markers[lineIndex] & StretchFilter.LOOP_START:
                 return lineIndex
         print('This should never happen in stretch, no activate command was found for this thread.')
         raise StopIteration, "You've reached the end of the line."
@@ -233,7 +239,7 @@ class LineIteratorBackward(LineIteratorBackwardLegacy):
     def index_setup(self):
         if self.line_index < 0:
             self.line_index = self.reset_index_on_limit()
-        elif StretchFilter.LOOP_START_MARKER in self.lines[self.line_index + 1].raw:  # if just before a loop start
+        elif self.markers[self.line_index + 1] & StretchFilter.LOOP_START:  # if just before a loop start
             self.line_index = self.reset_index_on_limit()
 
     def reset_index_on_limit(self):
@@ -242,21 +248,21 @@ class LineIteratorBackward(LineIteratorBackwardLegacy):
         self.logger.debug("reset index backward (modern)")
 
         for lineIndex in xrange(self.line_index + 1, len(self.lines)):
-            if StretchFilter.EXTRUSION_OFF_MARKER in self.lines[lineIndex].raw:
+            if self.markers[lineIndex] & StretchFilter.EXTRUSION_OFF:
                 return lineIndex - 2
         print('This should never happen in stretch, no deactivate command was found for this thread.')
         raise StopIteration, "You've reached the end of the line."
 
 
 class CuraLineIteratorBackward(LineIteratorBackwardLegacy):
-    def __init__(self, line_index, lines):
-        super(CuraLineIteratorBackward, self).__init__(line_index, lines)
+    def __init__(self, line_index, lines, markers=None):
+        super(CuraLineIteratorBackward, self).__init__(line_index, lines, markers)
         self.stop_on_extrusion_off = False
 
     def index_setup(self):
         if self.line_index < 0:
             self.line_index = self.reset_index_on_limit()
-        elif StretchFilter.LOOP_START_MARKER in self.lines[self.line_index + 1].raw:  # if just before a loop start
+        elif self.markers[self.line_index + 1] & StretchFilter.LOOP_START:  # if just before a loop start
             self.line_index = self.reset_index_on_limit()
 
     def reset_index_on_limit(self):
@@ -265,7 +271,7 @@ class CuraLineIteratorBackward(LineIteratorBackwardLegacy):
         self.logger.debug("reset index backward (modern)")
 
         for lineIndex in xrange(self.line_index + 1, len(self.lines)):
-            if StretchFilter.LOOP_STOP_MARKER in self.lines[lineIndex].raw:
+            if self.markers[lineIndex] & StretchFilter.LOOP_STOP:
                 return lineIndex - 1
         print('This should never happen in stretch, no deactivate command was found for this thread.')
         raise StopIteration, "You've reached the end of the line."
@@ -290,7 +296,7 @@ class StretchRepository:
         self.stretchFromDistanceOverEdgeWidth = stretch_from_distance_over_edge_width
 
 
-class StretchFilter:
+class StretchFilter(ContextualFilter):
     """A class to stretch a skein of extrusions."""
 
     EXTRUSION_ON_MARKER = 'stretch-extrusion-on'
@@ -300,34 +306,99 @@ class StretchFilter:
     OUTER_EDGE_START_MARKER = LOOP_START_MARKER + ' stretch-outer-edge-start'
     LOOP_STOP_MARKER = 'stretch-loop-stop'
 
+    # marker classes of the lines, edge starts being loop starts too
+    LOOP_START, INNER_EDGE_START, OUTER_EDGE_START, LOOP_STOP, EXTRUSION_ON, EXTRUSION_OFF = (1, 2, 4, 8, 16, 32)
+    MARKERS = CommentClassifier()
+    MARKERS.register(INNER_EDGE_START_MARKER, INNER_EDGE_START | LOOP_START)
+    MARKERS.register(OUTER_EDGE_START_MARKER, OUTER_EDGE_START | LOOP_START)
+    MARKERS.register(LOOP_START_MARKER, LOOP_START)
+    MARKERS.register(LOOP_STOP_MARKER, LOOP_STOP)
+    MARKERS.register(EXTRUSION_ON_MARKER, EXTRUSION_ON)
+    MARKERS.register(EXTRUSION_OFF_MARKER, EXTRUSION_OFF)
+
+    # state of the stretching of a program
+    gcode = context_attribute('gcode')
+    current_layer = context_attribute('current_layer')
+    current_layer_index = context_attribute('current_layer_index')
+    current_markers = context_attribute('current_markers')
+    line_number_in_layer = context_attribute('line_number_in_layer')
+    extruderActive = context_attribute('extruderActive')
+    feedRateMinute = context_attribute('feedRateMinute')
+    isLoop = context_attribute('isLoop')
+    oldLocation = context_attribute('oldLocation')
+    thread_maximum_absolute_stretch = context_attribute('thread_maximum_absolute_stretch')
+
+    # stretch distances of the program, see set_edge_width
+    edgeWidth = context_attribute('edgeWidth')
+    crossLimitDistance = context_attribute('crossLimitDistance')
+    crossLimitDistanceFraction = context_attribute('crossLimitDistanceFraction')
+    crossLimitDistanceRemainder = context_attribute('crossLimitDistanceRemainder')
+    loopMaximumAbsoluteStretch = context_attribute('loopMaximumAbsoluteStretch')
+    edgeInsideAbsoluteStretch = context_attribute('edgeInsideAbsoluteStretch')
+    edgeOutsideAbsoluteStretch = context_attribute('edgeOutsideAbsoluteStretch')
+    stretchFromDistance = context_attribute('stretchFromDistance')
+
     def __init__(self, **kwargs):
-        self.edgeWidth = 0.4
-        self.extruderActive = False
-        self.feedRateMinute = 959.0
-        self.isLoop = False
-        self.oldLocation = None
-        self.gcode = None
-        self.current_layer = None
-        self.line_number_in_layer = 0
         self.stretchRepository = StretchRepository(**kwargs)
 
-        self.thread_maximum_absolute_stretch = 0
-
         self.line_forward_iterator = LineIteratorForwardLegacy
         self.line_backward_iterator = LineIteratorBackwardLegacy
 
-    def filter(self, gcode):
-        """Parse gcode text and store the stretch gcode."""
+    def new_context(self):
+        context = super(StretchFilter, self).new_context()
+        context.edgeWidth = 0.4
+        context.extruderActive = False
+        context.feedRateMinute = 959.0
+        context.isLoop = False
+        context.oldLocation = None
+        context.gcode = None
+        context.current_layer = None
+        context.current_layer_index = None
+        context.current_markers = None
+        context.line_number_in_layer = 0
+        context.thread_maximum_absolute_stretch = 0
+        return context
+
+    def filter(self, gcode, cache=None):
+        """Parse gcode text and store the stretch gcode. Layers already stretched in a previous run are taken
+        from the optional LayerResultCache."""
         self.gcode = gcode
 
         self.setup_filter()
 
+        state = entry_state(None)
         for self.current_layer_index, current_layer in enumerate(self.gcode.all_layers):
-            self.current_layer = current_layer[:]
-            for self.line_number_in_layer, line in enumerate(self.current_layer):
-                gcode_line = self.parse_line(line)
-                parse_coordinates(gcode_line, split(gcode_line))
-                self.gcode.all_layers[self.current_layer_index][self.line_number_in_layer] = gcode_line
+            if cache is None:
+                self.filter_layer(current_layer)
+                continue
+
+            next_state = entry_state(current_layer[-1]) if current_layer else state
+            cache.run(self, current_layer, state, lambda: self.filter_layer(current_layer))
+            state = next_state
+
+    def filter_layer(self, layer):
+        """Stretch the lines of a layer in place."""
+        self.current_layer = layer[:]
+        self.current_markers = self.MARKERS.classify_lines(self.current_layer)
+        for self.line_number_in_layer, line in enumerate(self.current_layer):
+            gcode_line = self.parse_line(line)
+            parse_coordinates(gcode_line, split(gcode_line))
+            layer[self.line_number_in_layer] = gcode_line
+
+    def get_parameters(self):
+        """Get the settings the stretched result depends on."""
+        return sorted(vars(self.stretchRepository).items()), self.edgeWidth
+
+    def get_carried_state(self):
+        """Get the state carried from one layer to the next one."""
+        old_location = None if self.oldLocation is None else (
+            self.oldLocation.x, self.oldLocation.y, self.oldLocation.z)
+        return old_location, self.feedRateMinute, self.isLoop, self.thread_maximum_absolute_stretch
+
+    def set_carried_state(self, state):
+        """Restore the state carried from one layer to the next one."""
+        old_location, self.feedRateMinute, self.isLoop, self.thread_maximum_absolute_stretch = state
+        self.oldLocation = None if old_location is None else Vector3(*old_location)
 
     def get_cross_limited_stretch(self, crossLimitedStretch, crossLineIterator, locationComplex):
         """Get cross limited relative stretch for a location."""
@@ -396,10 +467,11 @@ class StretchFilter:
 
     def get_stretched_line_from_index_location(self, indexPreviousStart, indexNextStart, location, original_line):
         """Get stretched gcode line from line index and location."""
-        crossIteratorForward = self.line_forward_iterator(indexNextStart, self.current_layer)
-        crossIteratorBackward = self.line_backward_iterator(indexPreviousStart, self.current_layer)
-        iteratorForward = self.line_forward_iterator(indexNextStart, self.current_layer)
-        iteratorBackward = self.line_backward_iterator(indexPreviousStart, self.current_layer)
+        lines, markers = self.current_layer, self.current_markers
+        crossIteratorForward = self.line_forward_iterator(indexNextStart, lines, markers)
+        crossIteratorBackward = self.line_backward_iterator(indexPreviousStart, lines, markers)
+        iteratorForward = self.line_forward_iterator(indexNextStart, lines, markers)
+        iteratorBackward = self.line_backward_iterator(indexPreviousStart, lines, markers)
 
         locationComplex = location.dropAxis()
 
@@ -440,10 +512,11 @@ class StretchFilter:
 
     def is_just_before_extrusion(self):
         """Determine if activate command is before linear move command."""
-        for line in self.current_layer[self.line_number_in_layer + 1:]:
-            if line.command in linear_move_gcodes or self.EXTRUSION_OFF_MARKER in line.raw:
+        for line_idx in range(self.line_number_in_layer + 1, len(self.current_layer)):
+            markers = self.current_markers[line_idx]
+            if self.current_layer[line_idx].command in linear_move_gcodes or markers & self.EXTRUSION_OFF:
                 return False
-            if self.EXTRUSION_ON_MARKER in line.raw:
+            if markers & self.EXTRUSION_ON:
                 return True
         return False
 
@@ -469,16 +542,17 @@ class StretchFilter:
         """Parse a gcode line and add it to the stretch skein."""
 
         # check for loop markers
-        if self.is_inner_edge_begin(line):
+        markers = self.current_markers[self.line_number_in_layer]
+        if self.is_inner_edge_begin(markers):
             self.isLoop = True
             self.thread_maximum_absolute_stretch = self.edgeInsideAbsoluteStretch
-        elif self.is_outer_edge_begin(line):
+        elif self.is_outer_edge_begin(markers):
             self.isLoop = True
             self.thread_maximum_absolute_stretch = self.edgeOutsideAbsoluteStretch
-        elif self.is_loop_begin(line):
+        elif self.is_loop_begin(markers):
             self.isLoop = True
             self.thread_maximum_absolute_stretch = self.loopMaximumAbsoluteStretch
-        elif self.is_loop_end(line):
+        elif self.is_loop_end(markers):
             self.isLoop = False
             self.set_stretch_to_path()
 
@@ -493,17 +567,17 @@ class StretchFilter:
         self.isLoop = False
         self.thread_maximum_absolute_stretch = 0
 
-    def is_loop_begin(self, line):
-        return self.LOOP_START_MARKER in line.raw
+    def is_loop_begin(self, markers):
+        return markers & self.LOOP_START
 
-    def is_loop_end(self, line):
-        return self.LOOP_STOP_MARKER in line.raw
+    def is_loop_end(self, markers):
+        return markers & self.LOOP_STOP
 
-    def is_inner_edge_begin(self, line):
-        return self.INNER_EDGE_START_MARKER in line.raw
+    def is_inner_edge_begin(self, markers):
+        return markers & self.INNER_EDGE_START
 
-    def is_outer_edge_begin(self, line):
-        return self.OUTER_EDGE_START_MARKER in line.raw
+    def is_outer_edge_begin(self, markers):
+        return markers & self.OUTER_EDGE_START
 
     def setup_filter(self):
         raise NotImplementedError
@@ -516,14 +590,26 @@ class Slic3rStretchFilter(StretchFilter):
 
     EDGE_WIDTH_REGEXP = re.compile(r'; external perimeters extrusion width\s+=\s+([\.\d]+)mm')
 
+    # comment classes of the lines, perimeters being told by their feature (see gcodeutils.features)
+    COMMENTS = CommentClassifier()
+    MOVE_TO_FIRST_PERIMETER_POINT = COMMENTS.register('; move to first perimeter point')
+    UNRETRACT = COMMENTS.register('unretract')
+    EDGE_WIDTH = COMMENTS.register('; external perimeters extrusion width')
+
+    next_external_perimeter_is_outer = context_attribute('next_external_perimeter_is_outer')
+    current_type_line = context_attribute('current_type_line')
+
     def __init__(self, **kwargs):
         StretchFilter.__init__(self, **kwargs)
 
         self.line_forward_iterator = LineIteratorForward
         self.line_backward_iterator = LineIteratorBackward
 
-        self.next_external_perimeter_is_outer = None
-        self.current_type_line = None
+    def new_context(self):
+        context = StretchFilter.new_context(self)
+        context.next_external_perimeter_is_outer = None
+        context.current_type_line = None
+        return context
 
     def new_perimeter(self, line, external=False):
 
@@ -560,8 +646,11 @@ class Slic3rStretchFilter(StretchFilter):
         for self.current_layer in self.gcode.all_layers:
             self.next_external_perimeter_is_outer = True
             self.current_type_line = self.UNKNOWN
+            comments = self.COMMENTS.classify_lines(self.current_layer)
+            features = [trailing_comment_feature(line.raw) for line in self.current_layer]
 
             for line_idx, line in enumerate(self.current_layer):
+                line_class = comments[line_idx]
 
                 # checking extrusion
                 if not extruding and line.command in linear_move_gcodes and line.e is not None:
@@ -573,27 +662,27 @@ class Slic3rStretchFilter(StretchFilter):
                     line.raw += " ; " + StretchFilter.EXTRUSION_OFF_MARKER
 
                 # checking perimeter type
-                if '; perimeter external' in line.raw:
+                if features[line_idx] == OUTER_WALL:
 
                     if self.EXTERNAL_PERIMETER != self.current_type_line:
                         self.new_perimeter(line, True)
 
-                elif '; perimeter' in line.raw:
+                elif features[line_idx] == INNER_WALL:
 
                     if self.EXTRA_PERIMETER != self.current_type_line:
                         self.new_perimeter(line)
 
-                elif '; move to first perimeter point' in line.raw:
+                elif line_class & self.MOVE_TO_FIRST_PERIMETER_POINT:
                     # search if next perimeter is external or not
                     for loop_ahead_idx in xrange(line_idx + 1, len(self.current_layer)):
-                        if '; perimeter external' in self.current_layer[loop_ahead_idx].raw:
+                        if features[loop_ahead_idx] == OUTER_WALL:
                             self.new_perimeter(line, True)
                             break
-                        elif '; perimeter' in self.current_layer[loop_ahead_idx].raw:
+                        elif features[loop_ahead_idx] == INNER_WALL:
                             self.new_perimeter(line)
                             break
 
-                elif 'unretract' not in line.raw:
+                elif not line_class & self.UNRETRACT:
 
                     if self.current_type_line in (self.EXTRA_PERIMETER, self.EXTERNAL_PERIMETER):
                         logging.debug("found end of loop")
@@ -602,7 +691,7 @@ class Slic3rStretchFilter(StretchFilter):
                     self.current_type_line = self.UNKNOWN
 
                 # checking for edge width
-                match = self.EDGE_WIDTH_REGEXP.match(line.raw)
+                match = self.EDGE_WIDTH_REGEXP.match(line.raw) if line_class & self.EDGE_WIDTH else None
                 if match:
                     edge_width_found = True
                     self.set_edge_width(float(match.group(1)))
@@ -622,12 +711,31 @@ class CuraStretchFilter(StretchFilter):
 
     CURA_PROFILE_REGEXP = re.compile(r';CURA_PROFILE_STRING:(.*)$')
 
+    # Cura 2 and later serialize their settings in ;SETTING_3 comments split over several lines, newlines escaped.
+    # Edge width settings by preference
+    CURA_SETTINGS_PREFIX = ';SETTING_3 '
+    CURA_SETTING_REGEXP = re.compile(r'(?:^|\\+n)(wall_line_width_0|wall_line_width|line_width|machine_nozzle_size)'
+                                     r' = ([\.\d]+)(?=\\+n|$)')
+    CURA_EDGE_WIDTH_SETTINGS = ('wall_line_width_0', 'wall_line_width', 'line_width', 'machine_nozzle_size')
+
+    # comment classes of the lines, ;TYPE: comments being told by their feature (see gcodeutils.features)
+    COMMENTS = CommentClassifier()
+    PROFILE = COMMENTS.register(';CURA_PROFILE_STRING:')
+    SETTINGS = COMMENTS.register(CURA_SETTINGS_PREFIX)
+
+    current_type_line = context_attribute('current_type_line')
+
     def __init__(self, **kwargs):
         StretchFilter.__init__(self, **kwargs)
 
         self.line_forward_iterator = CuraLineIteratorForward
         self.line_backward_iterator = CuraLineIteratorBackward
 
+    def new_context(self):
+        context = StretchFilter.new_context(self)
+        context.current_type_line = None
+        return context
+
     def new_perimeter(self, line, external=False, outer=False):
 
         if external:
@@ -658,12 +766,15 @@ class CuraStretchFilter(StretchFilter):
 
         edge_width_found = False
         extruding = False
+        settings = []
 
         for self.current_layer in self.gcode.all_layers:
             self.current_type_line = self.UNKNOWN
             next_line_marker = None
+            comments = self.COMMENTS.classify_lines(self.current_layer)
 
             for line_idx, line in enumerate(self.current_layer):
+                line_class = comments[line_idx]
 
                 # checking extrusion
                 if not extruding and line.command in linear_move_gcodes and line.e is not None:
@@ -678,20 +789,21 @@ class CuraStretchFilter(StretchFilter):
                     self.new_perimeter(line, *next_line_marker)
                     next_line_marker = None
 
-                # checking perimeter type
-                if 'TYPE:WALL-OUTER' in line.raw:
+                # checking perimeter type, any other feature ending the current loop
+                feature = comment_feature(line.raw)
+                if feature == OUTER_WALL:
                     self.stop_loop(line)
                     next_line_marker = (True, True)
 
-                elif 'TYPE:WALL-INNER' in line.raw:
+                elif feature == INNER_WALL:
                     self.stop_loop(line)
                     next_line_marker = (True, False)
 
-                elif 'TYPE:SKIN' in line.raw:
+                elif feature == SKIN:
                     self.stop_loop(line)
                     next_line_marker = (False, False)
 
-                elif 'TYPE:FILL' in line.raw:
+                elif feature is not None:
                     self.stop_loop(line)
 
                 # end loop if we reach the end of the current layer
@@ -699,10 +811,14 @@ class CuraStretchFilter(StretchFilter):
                     self.stop_loop(line)
 
                 # checking for edge width
-                match = self.CURA_PROFILE_REGEXP.match(line.raw)
+                match = self.CURA_PROFILE_REGEXP.match(line.raw) if line_class & self.PROFILE else None
                 if match:
                     edge_width_found = self.parse_cura_profile(match.group(1))
+                if line_class & self.SETTINGS and line.raw.startswith(self.CURA_SETTINGS_PREFIX):
+                    settings.append(line.raw[len(self.CURA_SETTINGS_PREFIX):])
 
+        if not edge_width_found and settings:
+            edge_width_found = self.parse_cura_settings(''.join(settings))
         if not edge_width_found:
             logging.warn("no edge width found in comments, picking a default value")
             self.set_edge_width(0.4)
@@ -720,6 +836,19 @@ class CuraStretchFilter(StretchFilter):
 
         return False
 
+    def parse_cura_settings(self, cura_settings):
+        found = {}
+        for match in self.CURA_SETTING_REGEXP.finditer(cura_settings):
+            found.setdefault(match.group(1), float(match.group(2)))
+            logging.debug("found cura setting %s = %s", match.group(1), match.group(2))
+
+        for key in self.CURA_EDGE_WIDTH_SETTINGS:
+            if key in found:
+                self.set_edge_width(found[key])
+                return True
+
+        return False
+
     def stop_loop(self, line):
         if self.current_type_line != self.UNKNOWN:
             logging.debug("found end of loop")
@@ -730,28 +859,39 @@ class CuraStretchFilter(StretchFilter):
 class SkeinforgeStretchFilter(StretchFilter):
     EDGE_WIDTH_REGEXP = re.compile(r'\(<edgeWidth> ([\.\d]+)')
 
-    def parse_initialisation_line(self, line):
+    # comment classes of the lines, from the tags starting them
+    COMMENTS = CommentClassifier()
+    LOOP = COMMENTS.register_expression(r'^\(<loop>')
+    OUTER_EDGE = COMMENTS.register_expression(r'^\(<edge> outer')
+    INNER_EDGE = COMMENTS.register_expression(r'^\(<edge>')
+    END = COMMENTS.register_expression(r'^\(</(?:edge|loop)>\)')
+    EDGE_WIDTH = COMMENTS.register_expression(r'^\(<edgeWidth> ')
+
+    def parse_initialisation_line(self, line, line_class=None):
         # self.distanceFeedRate.search_decimal_places_carried(line.raw)
         if line.raw == '(</extruderInitialization>)':
             return True
-        match = self.EDGE_WIDTH_REGEXP.match(line.raw)
+        if line_class is None:
+            line_class = self.COMMENTS.classify(line.raw)
+        match = self.EDGE_WIDTH_REGEXP.match(line.raw) if line_class & self.EDGE_WIDTH else None
         if match:
             self.set_edge_width(float(match.group(1)))
         return False
 
     def setup_filter(self):
         for self.current_layer in self.gcode.all_layers:
-            for line in self.current_layer:
-                self.parse_initialisation_line(line)
+            comments = self.COMMENTS.classify_lines(self.current_layer)
+            for line, line_class in zip(self.current_layer, comments):
+                self.parse_initialisation_line(line, line_class)
                 if line.command == 'M101':
                     line.raw += '; ' + self.EXTRUSION_ON_MARKER
                 elif line.command == 'M103':
                     line.raw += '; ' + self.EXTRUSION_OFF_MARKER
-                elif line.raw.startswith("(<loop>"):
+                elif line_class & self.LOOP:
                     line.raw += '; ' + self.LOOP_START_MARKER
-                elif line.raw.startswith("(<edge>") and not line.raw.startswith("(<edge> outer"):
+                elif line_class & self.INNER_EDGE:
                     line.raw += '; ' + self.INNER_EDGE_START_MARKER
-                elif line.raw.startswith("(<edge> outer"):
+                elif line_class & self.OUTER_EDGE:
                     line.raw += '; ' + self.OUTER_EDGE_START_MARKER
-                elif line.raw.startswith("(</edge>)") or line.raw.startswith("(</loop>)"):
+                elif line_class & self.END:
                     line.raw += '; ' + self.LOOP_STOP_MARKER
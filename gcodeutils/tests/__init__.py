@@ -1,15 +1,41 @@
+from itertools import chain
 import os
 
-from gcodeutils.gcoder import GCode
+from gcodeutils.filter.filter import DROP, KEEP, STATELESS, GCodeFilter
+from gcodeutils.gcoder import GCode, PICKLED_LINE_ATTRIBUTES
 
 __author__ = 'olivier'
 
 
+def gcode_file_path(filename):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+
+
 def open_gcode_file(filename):
-    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)) as gcode:
+    with open(gcode_file_path(filename)) as gcode:
         return GCode(gcode.readlines())
 
 
 def gcode_eq(lhs, rhs):
     if not lhs == rhs:
         raise AssertionError(lhs.diff(rhs))
+
+
+def raws(lines):
+    """return the raw lines of an iterable of lines, or of the layers of a GCode"""
+    if isinstance(lines, GCode):
+        lines = chain.from_iterable(lines.all_layers)
+    return [line.raw for line in lines]
+
+
+def attributes(line):
+    """return the attributes of a line kept when it's pickled, as a dictionary"""
+    return dict((bit, getattr(line, bit)) for bit in PICKLED_LINE_ATTRIBUTES)
+
+
+class DropComments(GCodeFilter):
+    """filter dropping the comment lines"""
+    state_dependency = STATELESS
+
+    def opcode_filter(self, opcode):
+        return DROP if opcode.command is None else KEEP
@@ -7,6 +7,9 @@
 # along with GCodeUtils.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import pickle
+
+from nose.tools import eq_, ok_
 
 from gcodeutils.filter.arc_optimizer import GCodeArcOptimizerFilter
 from gcodeutils.gcoder import PyLine
@@ -62,8 +65,27 @@ def test_arc_optimization_4():
     gcode_eq(gcode_ref, gcode)
 
 
+def test_filter_context():
+    arc_filter, other_filter = GCodeArcOptimizerFilter(), GCodeArcOptimizerFilter()
+    ok_(arc_filter.queue is not other_filter.queue)
+
+    arc_filter.opcode_filter(open_gcode_file('arc_raw_1.gcode').all_layers[1][0])
+    eq_(1, len(arc_filter.queue))
+
+    # a copied filter starts a new traversal
+    eq_([], pickle.loads(pickle.dumps(arc_filter)).queue)
+
+    context = arc_filter.context
+    arc_filter.context = arc_filter.new_context()
+    eq_([], arc_filter.queue)
+    arc_filter.context = context
+    eq_(1, len(arc_filter.queue))
+
+
 if __name__ == "__main__":
     test_arc_optimization_1()
     test_arc_optimization_2()
     test_arc_optimization_3()
     test_arc_optimization_4()
+    test_filter_context()
+
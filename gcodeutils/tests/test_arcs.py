@@ -0,0 +1,59 @@
+import math
+
+from nose.tools import eq_, ok_, assert_almost_equal
+
+from gcodeutils.gcoder import Arc, GCode
+from gcodeutils.tests import open_gcode_file
+
+__author__ = 'olivier'
+
+
+def test_quarter_circle():
+    arc = Arc.from_move(20, 0, 0, 20, i=-20, j=0, clockwise=False)
+    assert_almost_equal(10 * math.pi, arc.length)
+    for lhs, rhs in zip((0, 20, 0, 20), arc.bounds()):
+        assert_almost_equal(lhs, rhs)
+
+
+def test_arc_sweeps_past_end_points():
+    # half circles going through the bottom, then the top, of a circle centered on (10, 10)
+    arc = Arc.from_move(0, 10, 20, 10, i=10, j=0, clockwise=False)
+    for lhs, rhs in zip((0, 20, 0, 10), arc.bounds()):
+        assert_almost_equal(lhs, rhs)
+
+    arc = Arc.from_move(0, 10, 20, 10, i=10, j=0, clockwise=True)
+    for lhs, rhs in zip((0, 20, 10, 20), arc.bounds()):
+        assert_almost_equal(lhs, rhs)
+
+
+def test_radius_form():
+    for clockwise in (True, False):
+        for radius in (20, -20):
+            arc = Arc.from_move(20, 0, 0, 20, r=radius, clockwise=clockwise)
+            assert_almost_equal(20, arc.radius)
+            # the short arc is a quarter, the long one three quarters of the circle
+            turns = .25 if (radius > 0) else .75
+            assert_almost_equal(turns * 2 * math.pi * 20, arc.length)
+
+
+def test_full_circle():
+    arc = Arc.from_move(0, 0, 0, 0, i=10, j=0)
+    assert_almost_equal(20 * math.pi, arc.length)
+    for lhs, rhs in zip((0, 20, -10, 10), arc.bounds()):
+        assert_almost_equal(lhs, rhs)
+
+
+def test_gcode_arc_extent_and_duration():
+    gcode = GCode(["G1 X0 Y0 F600", "G2 X0 Y0 I10 J0 E10"])
+    eq_((0, 20, -10, 10), (gcode.xmin, gcode.xmax, gcode.ymin, gcode.ymax))
+    # 20 pi mm at 10 mm/s
+    eq_(int(2 * math.pi), gcode.duration.seconds)
+
+
+def test_arcs_match_linear_segments():
+    raw = open_gcode_file('arc_raw_2.gcode')
+    arcs = open_gcode_file('arc_ref_2.gcode')
+
+    eq_(raw.duration, arcs.duration)
+    ok_(abs(raw.xmax - arcs.xmax) < 0.01)
+    ok_(abs(raw.ymax - arcs.ymax) < 0.01)
@@ -0,0 +1,37 @@
+from nose.tools import eq_
+
+from gcodeutils.comments import CommentClassifier
+from gcodeutils.gcoder import GCode
+from gcodeutils.stretch.stretch import StretchFilter
+
+__author__ = 'olivier'
+
+
+def test_classify():
+    classifier = CommentClassifier()
+    external = classifier.register('; perimeter external', 3)
+    perimeter = classifier.register('; perimeter', 2)
+    unretract = classifier.register('unretract')
+    layer = classifier.register_expression(r'^;LAYER:\d+')
+    eq_((3, 2, 4, 8), (external, perimeter, unretract, layer))
+
+    eq_(0, classifier.classify("G1 X10 Y10 E1"))
+    eq_(3, classifier.classify("G1 X10 Y10 E1 ; perimeter external"))
+    eq_(2, classifier.classify("G1 X10 Y10 E1 ; perimeter"))
+    eq_(6, classifier.classify("G1 E1 ; unretract ; perimeter"))
+    eq_(8, classifier.classify(";LAYER:12"))
+    eq_(0, classifier.classify("; ;LAYER:12"))
+
+    gcode = GCode(["G1 X10 Y10 E1 ; perimeter", "G1 E1 ; unretract", "M104 S200"])
+    eq_([2, 4, 0], list(classifier.classify_lines(gcode.lines)))
+    eq_(0, CommentClassifier().classify("; perimeter"))
+
+
+def test_stretch_markers():
+    markers = StretchFilter.MARKERS
+    eq_(StretchFilter.LOOP_START, markers.classify("G1 X1 ; " + StretchFilter.LOOP_START_MARKER))
+    eq_(StretchFilter.LOOP_START | StretchFilter.INNER_EDGE_START | StretchFilter.LOOP_STOP,
+        markers.classify("G1 X1 ; " + StretchFilter.INNER_EDGE_START_MARKER + " ; " + StretchFilter.LOOP_STOP_MARKER))
+    eq_(StretchFilter.LOOP_START | StretchFilter.OUTER_EDGE_START,
+        markers.classify("G1 X1 ; " + StretchFilter.OUTER_EDGE_START_MARKER))
+    eq_(StretchFilter.EXTRUSION_ON, markers.classify("G1 X1 E1 ; " + StretchFilter.EXTRUSION_ON_MARKER))
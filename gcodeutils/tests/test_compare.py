@@ -0,0 +1,62 @@
+from nose.tools import eq_, ok_
+
+from gcodeutils import compare
+from gcodeutils.compare import GCodeComparator
+from gcodeutils.gcoder import GCode
+
+__author__ = 'olivier'
+
+program = """G90
+G1 Z0.2
+G1 X0 Y0 E1
+G1 X10 Y0 E2
+G1 X10 Y10 E3
+G1 Z0.4
+G1 X0 Y10 E4
+G1 X0 Y0 E5
+G1 X10 Y0 E6""".split("\n")
+
+
+def modified(*changes):
+    lines = list(program)
+    for idx, raw in changes:
+        if raw is None:
+            del lines[idx]
+        else:
+            lines[idx] = raw
+    return GCode(lines)
+
+
+def test_every_difference_is_reported():
+    regions = GCodeComparator().diff(GCode(program), modified((3, "G1 X11 Y0 E2"), (7, "G1 X0 Y1 E5")))
+
+    eq_(2, len(regions))
+    eq_([1, 2], [region.layer for region in regions])
+    eq_(["G1 X10 Y0 E2"], [line.raw for line in regions[0].lhs_lines])
+    eq_(["G1 X0 Y1 E5"], [line.raw for line in regions[1].rhs_lines])
+
+
+def test_alignment_of_missing_lines():
+    regions = GCodeComparator().diff(GCode(program), modified((4, None)))
+
+    eq_(1, len(regions))
+    eq_(["G1 X10 Y10 E3"], [line.raw for line in regions[0].lhs_lines])
+    eq_([], regions[0].rhs_lines)
+
+
+def test_per_axis_tolerance():
+    lhs = GCode(program)
+    rhs = modified((3, "G1 X10 Y0 E2.05"))
+
+    ok_(not lhs == rhs)
+    ok_(GCodeComparator(tolerances={'e': 0.1}).equal(lhs, rhs))
+    eq_([], GCodeComparator(tolerances={'e': 0.1}).diff(lhs, rhs))
+
+
+def test_pure_python_comparison():
+    numpy, compare.numpy = compare.numpy, None
+    try:
+        test_every_difference_is_reported()
+        test_per_axis_tolerance()
+    finally:
+        compare.numpy = numpy
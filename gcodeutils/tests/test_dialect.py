@@ -0,0 +1,73 @@
+import io
+
+from nose.tools import eq_, ok_, assert_raises
+
+from gcodeutils.dialect import UNKNOWN, sniff_file, sniff_gcode, sniff_lines
+from gcodeutils.gcode_stretch import stretch_filter_class
+from gcodeutils.gcoder import GCode
+from gcodeutils.stretch.stretch import CuraStretchFilter, SkeinforgeStretchFilter, Slic3rStretchFilter
+from gcodeutils.tests import open_gcode_file
+
+__author__ = 'olivier'
+
+
+def test_generators():
+    dialect = sniff_lines([";FLAVOR:RepRap", ";Generated with Cura_SteamEngine 15.04.6"])
+    eq_(('cura_legacy', '15.04.6'), dialect[:2])
+    eq_('cura', dialect.family)
+    ok_(dialect.confidence > 0.95)
+
+    eq_(('cura', '5.2.1'), sniff_lines([";FLAVOR:Marlin", ";Generated with Cura_SteamEngine 5.2.1"])[:2])
+    eq_(('prusaslicer', '2.5.0+win64'), sniff_lines(["; generated by PrusaSlicer 2.5.0+win64 on 2022"])[:2])
+    eq_(('superslicer', '2.4.58.5'), sniff_lines(["; generated by SuperSlicer 2.4.58.5 on 2022"])[:2])
+    eq_(('slic3r', '1.2.9'), sniff_lines(["; generated by Slic3r 1.2.9 on 2015-10-01"])[:2])
+    eq_(('simplify3d', '4.1.2'), sniff_lines(["; G-Code generated by Simplify3D(R) Version 4.1.2"])[:2])
+    eq_(('skeinforge', '12.03.14'), sniff_lines(["(<format> skeinforge gcode </format>)",
+                                                 "(<version> 12.03.14 </version>)"])[:2])
+    eq_('slic3r', sniff_lines(["; generated by PrusaSlicer 2.5.0"]).family)
+
+
+def test_clues():
+    # without generator comment, clues are combined
+    eq_('cura_legacy', sniff_lines([";CURA_PROFILE_STRING:eNrtWk1z"]).slicer)
+    dialect = sniff_lines([";FLAVOR:Marlin", ";LAYER_COUNT:12", ";TYPE:WALL-OUTER"])
+    eq_(('cura', None), dialect[:2])
+    ok_(0.9 < dialect.confidence < 0.95)
+    eq_('prusaslicer', sniff_lines([";LAYER_CHANGE", ";TYPE:External perimeter"]).slicer)
+    eq_('simplify3d', sniff_lines(["; feature outer perimeter"]).slicer)
+
+    # a single weak clue isn't enough
+    eq_(UNKNOWN, sniff_lines([";LAYER_CHANGE"]))
+    eq_(UNKNOWN, sniff_lines(["G1 X10 Y10", "M104 S200"]))
+
+
+def test_sample_programs():
+    eq_('cura', sniff_gcode(open_gcode_file('cura_square.gcode')).slicer)
+    eq_('slic3r', sniff_gcode(open_gcode_file('slic3r_square.gcode')).slicer)
+    eq_('skeinforge', sniff_gcode(open_gcode_file('skeinforge_square.gcode')).slicer)
+    eq_('skeinforge', sniff_gcode(open_gcode_file('skeinforge_model1_prestretch.gcode'), line_count=50).slicer)
+    eq_(UNKNOWN, sniff_gcode(open_gcode_file('simple1.gcode')))
+
+
+def test_bounded_lines():
+    # clues in the middle of programs aren't looked at
+    gcode = GCode(["G1 X1"] * 100 + [";CURA_PROFILE_STRING:eNrtWk1z"] + ["G1 X1"] * 100)
+    eq_(UNKNOWN, sniff_gcode(gcode, line_count=50))
+    eq_('cura_legacy', sniff_gcode(gcode, line_count=200).slicer)
+
+    gcode_file = io.BytesIO(b"G1 X1\n" * 10000 + b";CURA_PROFILE_STRING:eNrtWk1z\n" + b"G1 X1\n" * 10000)
+    eq_(UNKNOWN, sniff_file(gcode_file, window=1024))
+    gcode_file = io.BytesIO(b"G1 X1\n" * 10000 + b";CURA_PROFILE_STRING:eNrtWk1z\n")
+    eq_('cura_legacy', sniff_file(gcode_file, window=1024).slicer)
+
+
+def test_stretch_filter_class():
+    eq_(CuraStretchFilter, stretch_filter_class(open_gcode_file('cura_square.gcode')))
+    eq_(Slic3rStretchFilter, stretch_filter_class(open_gcode_file('slic3r_square.gcode')))
+    eq_(SkeinforgeStretchFilter, stretch_filter_class(open_gcode_file('skeinforge_square.gcode')))
+    eq_(Slic3rStretchFilter, stretch_filter_class(open_gcode_file('simple1.gcode')))
+    eq_(CuraStretchFilter, stretch_filter_class(open_gcode_file('simple1.gcode'), 'cura'))
+    # programs of slicers no filter handles aren't stretched as another dialect
+    assert_raises(ValueError, stretch_filter_class, GCode(["; G-Code generated by Simplify3D(R) Version 4.1.2"]))
+    eq_(Slic3rStretchFilter, stretch_filter_class(GCode(["; G-Code generated by Simplify3D(R) Version 4.1.2"]),
+                                                  'slic3r'))
@@ -0,0 +1,67 @@
+from nose.tools import eq_, raises
+
+from gcodeutils.features import FEATURE_NAMES, INFILL, INNER_WALL, OUTER_WALL, SKIN, SKIRT, TRAVEL, UNKNOWN, \
+    comment_feature, trailing_comment_feature
+from gcodeutils.gcoder import GCode
+from gcodeutils.tests import open_gcode_file
+
+__author__ = 'olivier'
+
+
+def test_cura_features():
+    gcode = GCode(["G90", ";TYPE:WALL-OUTER", "G1 X10 Y0 E1", "G0 X0 Y10", "G1 X0 Y0 E2", ";TYPE:SKIN",
+                   "M106 S255", "G1 X5 Y5 E3"])
+    eq_([UNKNOWN, OUTER_WALL, OUTER_WALL, TRAVEL, OUTER_WALL, SKIN, SKIN, SKIN], list(gcode.feature_index))
+
+    eq_([(OUTER_WALL, 1, 3), (OUTER_WALL, 4, 5)], gcode.feature_runs.runs(OUTER_WALL))
+    eq_([(TRAVEL, 3, 4), (SKIN, 5, 8)], gcode.feature_runs.runs(SKIN, TRAVEL))
+    eq_(5, len(gcode.feature_runs))
+    eq_(TRAVEL, gcode.feature_runs.feature_at(3))
+    eq_(["G1 X5 Y5 E3"], [line.raw for _, line in gcode.feature_lines(SKIN) if line.is_move])
+
+
+def test_comment_features():
+    # feature comment lines and trailing comments are classified on their own, as by the stretch filters
+    eq_(OUTER_WALL, comment_feature(";TYPE:WALL-OUTER"))
+    eq_(UNKNOWN, comment_feature(";TYPE:NEW-FEATURE"))
+    eq_(None, comment_feature("G1 X1 E1 ; perimeter"))
+    eq_(OUTER_WALL, trailing_comment_feature("G1 X1 E1 ; perimeter external"))
+    eq_(INNER_WALL, trailing_comment_feature("G1 X1 E1 ; perimeter"))
+    eq_(None, trailing_comment_feature("; perimeters extrusion width = 0.50mm"))
+    eq_(None, trailing_comment_feature("G1 X1 ; move to first perimeter point"))
+
+
+def test_prusaslicer_and_simplify3d_features():
+    gcode = GCode([";TYPE:External perimeter", "G1 X10 E1", ";TYPE:Solid infill", "G1 Y10 E2",
+                   "; feature inner perimeter", "G1 X0 E3", "; feature skirt", "G1 Y0 E4", ";TYPE:Unheard of",
+                   "G1 X10 E5"])
+    eq_([OUTER_WALL, SKIN, INNER_WALL, SKIRT, UNKNOWN], [gcode.feature_index[idx] for idx in range(1, 10, 2)])
+
+
+def test_slic3r_features():
+    gcode = GCode(["G1 X10 Y10 F7800 ; move to first perimeter point", "G1 E1 ; unretract",
+                   "G1 X20 Y10 E2 ; perimeter external", "G1 X20 Y20 E3 ; perimeter", "G1 X10 Y20 E4 ; infill",
+                   "G1 X10 Y10 E5"])
+    eq_([TRAVEL, TRAVEL, OUTER_WALL, INNER_WALL, INFILL, UNKNOWN], list(gcode.feature_index))
+
+    gcode = open_gcode_file('slic3r_square.gcode')
+    eq_(4, sum(1 for _ in gcode.feature_lines(OUTER_WALL)))
+
+
+def test_maintained_features():
+    gcode = GCode([";TYPE:FILL", "G1 X10 E1", "G1 Z1", "G1 X0 E2"])
+    gcode.insert_lines([(1, 1, ["M400"])])
+    # the inserted line follows the Z move
+    eq_([INFILL, INFILL, TRAVEL, TRAVEL, INFILL], list(gcode.feature_index))
+    eq_(3, len(gcode.feature_runs))
+
+    gcode.append("G1 X5 Y5")
+    eq_(TRAVEL, gcode.feature_runs.feature_at(5))
+    eq_('travel', FEATURE_NAMES[gcode.feature_index[-1]])
+
+
+@raises(ValueError)
+def test_stale_features():
+    gcode = GCode([";TYPE:FILL", "G1 X10 E1", "G1 X0 E2"])
+    del gcode.all_layers[0][0]
+    gcode.feature_runs
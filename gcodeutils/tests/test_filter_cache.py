@@ -0,0 +1,101 @@
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_
+
+from gcodeutils.filter.cache import LayerResultCache
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.gcoder import GCode
+from gcodeutils.stretch.stretch import SkeinforgeStretchFilter
+from gcodeutils.tests import open_gcode_file, gcode_eq
+
+__author__ = 'olivier'
+
+
+def program(first_layer_x=10):
+    result = ["G90", "M82", "G92 E0"]
+    e = 0
+    for layer in range(1, 6):
+        result.append("G1 Z%.1f" % (layer * 0.2))
+        for x, y in ((first_layer_x if layer == 1 else 10, 0), (10, 10), (0, 10), (0, 0)):
+            e += 1
+            result.append("G1 X%d Y%d E%d" % (x, y, e))
+    return result
+
+
+def with_cache(test):
+    def inner():
+        directory = tempfile.mkdtemp()
+        try:
+            test(directory)
+        finally:
+            shutil.rmtree(directory)
+
+    inner.__name__ = test.__name__
+    return inner
+
+
+@with_cache
+def test_unchanged_layers_are_spliced(directory):
+    GCodeToRelativeExtrusionFilter().filter(GCode(program()), LayerResultCache(directory))
+
+    cache = LayerResultCache(directory)
+    gcode = GCode(program(first_layer_x=11))
+    GCodeToRelativeExtrusionFilter().filter(gcode, cache)
+
+    reference = GCode(program(first_layer_x=11))
+    GCodeToRelativeExtrusionFilter().filter(reference)
+
+    gcode_eq(reference, gcode)
+    eq_(1, cache.misses)
+    ok_(cache.hits >= 4)
+
+
+def relative_program(first_layer_e=1):
+    result = ["G90", "M83"]
+    for layer in range(1, 6):
+        result.append("G1 Z%.1f" % (layer * 0.2))
+        for x, y in ((10, 0), (10, 10), (0, 10), (0, 0)):
+            result.append("G1 X%d Y%d E%d" % (x, y, first_layer_e if layer == 1 else 1))
+    return result
+
+
+@with_cache
+def test_extrusion_changes_dont_invalidate_next_layers(directory):
+    GCodeXYTranslateFilter(x=1, y=1).filter(GCode(relative_program()), LayerResultCache(directory))
+
+    cache = LayerResultCache(directory)
+    gcode = GCode(relative_program(first_layer_e=2))
+    GCodeXYTranslateFilter(x=1, y=1).filter(gcode, cache)
+
+    reference = GCode(relative_program(first_layer_e=2))
+    GCodeXYTranslateFilter(x=1, y=1).filter(reference)
+
+    gcode_eq(reference, gcode)
+    eq_(1, cache.misses)
+    # spliced layers follow the extruder position of the program
+    eq_([line.current_e for line in reference], [line.current_e for line in gcode])
+
+
+@with_cache
+def test_cached_stretch(directory):
+    oracle = open_gcode_file('skeinforge_model1_poststretch.gcode')
+
+    SkeinforgeStretchFilter().filter(open_gcode_file('skeinforge_model1_prestretch.gcode'),
+                                     LayerResultCache(directory))
+
+    cache = LayerResultCache(directory)
+    gcode = open_gcode_file('skeinforge_model1_prestretch.gcode')
+    SkeinforgeStretchFilter().filter(gcode, cache)
+
+    gcode_eq(oracle, gcode)
+    eq_(0, cache.misses)
+
+
+@with_cache
+def test_size_based_eviction(directory):
+    cache = LayerResultCache(directory, max_size=1024)
+    GCodeToRelativeExtrusionFilter().filter(open_gcode_file('skeinforge_model1_prestretch.gcode'), cache)
+
+    ok_(cache.size <= 1024)
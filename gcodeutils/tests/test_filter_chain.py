@@ -0,0 +1,91 @@
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_
+
+from gcodeutils.filter.arc_optimizer import GCodeArcOptimizerFilter
+from gcodeutils.filter.cache import LayerResultCache
+from gcodeutils.filter.chain import FilterChain
+from gcodeutils.filter.filter import DROP, GCodeFilter
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.gcoder import GCode, raw_to_line
+from gcodeutils.tests import DropComments, open_gcode_file, gcode_eq, raws
+
+__author__ = 'olivier'
+
+
+class DoubleM106(GCodeFilter):
+    def opcode_filter(self, opcode):
+        if opcode.command == 'M106':
+            return [opcode, raw_to_line('M106 S255')]
+
+
+class Holding(GCodeFilter):
+    """filter holding back all the lines until the end of the program"""
+
+    def __init__(self):
+        self.held = []
+
+    def opcode_filter(self, opcode):
+        self.held.append(opcode)
+        return DROP
+
+    def flush(self):
+        held, self.held = self.held, []
+        return held
+
+
+def test_chain_equals_passes():
+    for filename in ('simple3.gcode', 'cura_square.gcode', 'slic3r_square.gcode'):
+        gcode = open_gcode_file(filename)
+        gcode_oracle = open_gcode_file(filename)
+
+        GCodeXYTranslateFilter(x=1, y=2).filter(gcode_oracle)
+        GCodeToRelativeExtrusionFilter().filter(gcode_oracle)
+
+        FilterChain(GCodeXYTranslateFilter(x=1, y=2), GCodeToRelativeExtrusionFilter()).filter(gcode)
+
+        gcode_eq(gcode_oracle, gcode)
+
+
+def test_result_protocol():
+    gcode = GCode(["G90", "; fan", "M106 S128", "G1 X10", "; end"])
+    FilterChain(DropComments(), DoubleM106()).filter(gcode)
+    eq_(["G90", "M106 S128", "M106 S255", "G1 X10"], raws(gcode))
+
+
+def test_unchanged_layers():
+    gcode = GCode(["G90", "G1 Z0.2", "G1 X10", "G1 Z0.4", "; comment", "G1 X20"])
+    lines = [list(layer) for layer in gcode.all_layers]
+    FilterChain(DoubleM106(), GCodeXYTranslateFilter()).filter(gcode)
+    for layer, layer_lines in zip(gcode.all_layers, lines):
+        eq_(len(layer_lines), len(layer))
+        ok_(all(line is original for line, original in zip(layer, layer_lines)))
+
+
+def test_flush():
+    gcode = GCode(["G90", "G1 Z0.2", "G1 X10", "; comment", "G1 X20"])
+    FilterChain(Holding(), DropComments(), Holding()).filter(gcode)
+    eq_(["G90", "G1 Z0.2", "G1 X10", "G1 X20"], raws(gcode))
+
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    gcode_oracle = open_gcode_file('arc_raw_1.gcode')
+    GCodeArcOptimizerFilter().filter(gcode_oracle)
+    FilterChain(GCodeArcOptimizerFilter(), DropComments()).filter(gcode)
+    eq_([raw for raw in raws(gcode_oracle) if not raw.startswith(';')], raws(gcode))
+
+
+def test_cache():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = LayerResultCache(directory, 1024 * 1024)
+        for _ in range(2):
+            gcode = open_gcode_file('cura_square.gcode')
+            FilterChain(GCodeXYTranslateFilter(x=1, y=2), GCodeToRelativeExtrusionFilter()).filter(gcode, cache)
+        gcode_oracle = open_gcode_file('cura_square.gcode')
+        FilterChain(GCodeXYTranslateFilter(x=1, y=2), GCodeToRelativeExtrusionFilter()).filter(gcode_oracle)
+        gcode_eq(gcode_oracle, gcode)
+        ok_(cache.hits > 0)
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,57 @@
+from nose.tools import eq_, ok_
+
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.gcoder import GCode, SharedLayer
+from gcodeutils.tests import gcode_eq
+
+__author__ = 'olivier'
+
+
+def tower(layers=20):
+    program = ["G90", "M83", "G92 E0"]
+    for layer in range(1, layers + 1):
+        program += ["G1 Z%.2f F600" % (layer * 0.2),
+                    "G1 X10 Y10 F3000",
+                    "G1 X20 Y10 E0.5",
+                    "G1 X20 Y20 E0.5 ; wall",
+                    "G1 X10 Y20 E0.5",
+                    "G1 X10 Y10 E0.5"]
+    return program
+
+
+def test_tower_layers_are_shared():
+    gcode = GCode(tower(), share_layers=True)
+    shared = [layer for layer in gcode.all_layers if isinstance(layer, SharedLayer)]
+    # the first layer of the tower is the template of the 19 others
+    eq_(22, len(gcode.all_layers))
+    eq_(19, len(shared))
+    eq_(len(set(id(layer.template) for layer in shared)), 1)
+
+
+def test_shared_layers_write_and_compare_as_original():
+    reference = GCode(tower())
+    gcode = GCode(tower(), share_layers=True)
+
+    eq_([raw for layer in reference.all_layers for raw in layer.raw_lines()],
+        [raw for layer in gcode.all_layers for raw in layer.raw_lines()])
+    gcode_eq(reference, gcode)
+    eq_([line.raw for line in reference], [line.raw for line in gcode])
+    eq_(reference.lines[-1].current_z, list(gcode)[-1].current_z)
+
+    for ref_layer, layer in zip(reference.all_layers, gcode.all_layers):
+        for ref_line, line in zip(ref_layer, layer):
+            eq_(ref_line.raw, line.raw)
+            eq_(ref_line.z, line.z)
+            ok_(abs(ref_line.current_z - line.current_z) < 1e-6)
+            ok_(abs(ref_line.current_e - line.current_e) < 1e-6)
+
+
+def test_filters_see_normal_layers():
+    reference = GCode(tower())
+    gcode = GCode(tower(), share_layers=True)
+
+    GCodeXYTranslateFilter(x=1, y=2).filter(reference)
+    GCodeXYTranslateFilter(x=1, y=2).filter(gcode)
+
+    ok_(not any(isinstance(layer, SharedLayer) for layer in gcode.all_layers))
+    gcode_eq(reference, gcode)
@@ -0,0 +1,125 @@
+from nose.tools import eq_, ok_
+
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.gcoder import GCode
+from gcodeutils.layer_store import DiskLayerStore, layer_footprint
+from gcodeutils.stretch.stretch import SkeinforgeStretchFilter
+from gcodeutils.tests import open_gcode_file, gcode_eq, gcode_file_path
+
+__author__ = 'olivier'
+
+
+def open_out_of_core_gcode_file(filename, memory_budget=16 * 1024):
+    with open(gcode_file_path(filename)) as gcode:
+        return GCode(gcode, layer_store=DiskLayerStore(memory_budget=memory_budget))
+
+
+def test_out_of_core_parsing():
+    gcode = open_out_of_core_gcode_file('skeinforge_model1_prestretch.gcode')
+    reference = open_gcode_file('skeinforge_model1_prestretch.gcode')
+
+    ok_(isinstance(gcode.all_layers, DiskLayerStore))
+    ok_(len(gcode.all_layers.cache) < len(gcode.all_layers))
+    eq_(len(reference.all_layers), len(gcode.all_layers))
+    eq_(reference.duration, gcode.duration)
+    gcode_eq(reference, gcode)
+
+
+def test_out_of_core_filtering():
+    gcode = open_out_of_core_gcode_file('skeinforge_model1_prestretch.gcode')
+    oracle = open_gcode_file('skeinforge_model1_poststretch.gcode')
+
+    SkeinforgeStretchFilter().filter(gcode)
+
+    gcode_eq(oracle, gcode)
+
+
+def test_out_of_core_layers_are_written_back():
+    gcode = open_out_of_core_gcode_file('simple3.gcode', memory_budget=0)
+    oracle = open_gcode_file('simple3-relative.gcode')
+
+    GCodeToRelativeExtrusionFilter().filter(gcode)
+
+    gcode_eq(oracle, gcode)
+
+
+class WriteRecorder(object):
+    """file wrapper recording the records written"""
+
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+        self.writes = []
+
+    def write(self, record):
+        self.writes.append(record)
+        self.wrapped.write(record)
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+
+def test_unchanged_layers_are_not_written_back():
+    gcode = open_out_of_core_gcode_file('skeinforge_model1_prestretch.gcode')
+    store = gcode.all_layers
+    # the layers still cached after parsing were never written
+    store.flush()
+    file_size = store.file_size
+
+    store.file = WriteRecorder(store.file)
+    for layer in store:
+        layer.raw_lines()
+    eq_([], store.file.writes)
+    eq_(file_size, store.file_size)
+
+
+def test_file_space_is_reused():
+    gcode = open_out_of_core_gcode_file('skeinforge_model1_prestretch.gcode')
+    store = gcode.all_layers
+
+    # every pass grows the records of the layers it modifies
+    for _ in range(4):
+        GCodeXYTranslateFilter(x=1.5, y=1.5).filter(gcode)
+        store.flush()
+    ok_(store.file_size < 2 * sum(store.lengths))
+
+    # freed areas don't overlap live records
+    areas = sorted(list(zip(store.offsets, store.lengths)) + store.free_areas)
+    for (offset, length), (next_offset, _) in zip(areas, areas[1:]):
+        ok_(offset + length <= next_offset)
+
+    reference = open_gcode_file('skeinforge_model1_prestretch.gcode')
+    for _ in range(4):
+        GCodeXYTranslateFilter(x=1.5, y=1.5).filter(reference)
+    gcode_eq(reference, gcode)
+
+    gcode.close()
+    ok_(store.file.closed)
+
+
+def test_held_layers_keep_their_modifications():
+    gcode = open_out_of_core_gcode_file('simple3.gcode', memory_budget=0)
+    store = gcode.all_layers
+    layer = store[0]
+    store[1]
+    ok_(0 not in store.cache)
+
+    # modified after being evicted, the layer is handed out again and written back once released
+    del layer[1:]
+    ok_(store[0] is layer)
+    store[1]
+    raws = layer.raw_lines()
+    del layer
+    store[2]
+    eq_({}, store.held)
+    eq_(raws, store[0].raw_lines())
+
+
+def test_footprint_follows_modifications():
+    gcode = open_out_of_core_gcode_file('skeinforge_model1_prestretch.gcode', memory_budget=1024 * 1024 * 1024)
+    store = gcode.all_layers
+    layer = store[1]
+    layer += layer[:]
+    store[2]
+
+    eq_(sum(layer_footprint(cached) for cached in store.cache.values()), store.cache_footprint)
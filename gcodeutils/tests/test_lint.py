@@ -0,0 +1,48 @@
+from nose.tools import eq_
+
+from gcodeutils import gcode_lint
+from gcodeutils.gcode_lint import BuildVolume, GCodeLinter, lint_lines
+from gcodeutils.gcoder import GCode
+from gcodeutils.planner import MachineProfile
+
+__author__ = 'olivier'
+
+PROGRAM = ["G90", "M82", "G1 X10 Y10 E1 F1200", "", "M104 S200", "G1 X20 Y10 E2", "G1 X20 Y210 E3",
+           "G1 X30 Y30 E20 F30000", "G2 X30 Y-10 I0 J-20 E21", "G1 E22"]
+
+
+def check(linter):
+    return [(violation.line_number, violation.check) for violation in lint_lines(PROGRAM, linter)]
+
+
+def test_lint():
+    linter = GCodeLinter(build_volume=BuildVolume.from_size((200, 200, 200)),
+                         profile=MachineProfile(max_velocity={'x': 300., 'y': 300., 'z': 5., 'e': 25.}))
+    # line numbers count the empty line
+    # line 8 is too fast along Y and E, the arc ends out of the volume and the retraction is too fast
+    eq_([(3, 'cold-extrusion'), (7, 'volume'), (8, 'e-jump'), (8, 'speed'), (8, 'speed'), (9, 'volume'),
+         (9, 'speed'), (10, 'speed')], check(linter))
+
+
+def test_lint_without_numpy():
+    numpy = gcode_lint.numpy
+    gcode_lint.numpy = None
+    try:
+        test_lint()
+    finally:
+        gcode_lint.numpy = numpy
+
+
+def test_default_checks():
+    eq_([(3, 'cold-extrusion'), (8, 'e-jump')], check(GCodeLinter()))
+    eq_([], GCodeLinter().lint(GCode(["M109 S200", "G1 X10 E1"])))
+    eq_([], GCodeLinter().lint(GCode([])))
+
+
+def test_arc_volume():
+    linter = GCodeLinter(build_volume=BuildVolume.from_size((100, 100, 100), (-50, -30, 0)))
+    # the half circle sweeps down to Y -40 while its ends are in bounds
+    violations = linter.lint(GCode(["M104 S200", "G1 X-40 Y0 E1", "G3 X40 Y0 I40 J0 E2"]))
+    eq_([(3, 'volume', "G3 X40 Y0 I40 J0 E2")], [(violation.line_number, violation.check, violation.raw)
+                                              for violation in violations])
+    eq_([], linter.lint(GCode(["M104 S200", "G1 X-40 Y0 E1", "G2 X40 Y0 I40 J0 E2"])))
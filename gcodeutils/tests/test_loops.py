@@ -0,0 +1,149 @@
+import math
+
+from nose.tools import eq_, ok_, assert_almost_equal
+
+from gcodeutils import loops
+from gcodeutils.gcoder import GCode
+from gcodeutils.loops import CLOCKWISE, COUNTER_CLOCKWISE, points_in_polygon, points_near_polygon, shoelace_areas
+from gcodeutils.tests import open_gcode_file
+
+__author__ = 'olivier'
+
+
+def square(xmin, ymin, xmax, ymax, clockwise=False):
+    corners = [(xmax, ymin), (xmax, ymax), (xmin, ymax), (xmin, ymin)]
+    if clockwise:
+        corners = [(xmin, ymax), (xmax, ymax), (xmax, ymin), (xmin, ymin)]
+    lines = ["G0 X{} Y{}".format(xmin, ymin)]
+    lines += ["G1 X{} Y{} E1".format(x, y) for x, y in corners]
+    return lines
+
+
+def holed_square():
+    """two perimeters around a square with two perimeters around a hole, and an infill line"""
+    return GCode(["G90", "M83", "G1 Z0.2"] + square(0, 0, 20, 20) + square(0.5, 0.5, 19.5, 19.5) +
+                 square(7.5, 7.5, 12.5, 12.5, clockwise=True) + square(8, 8, 12, 12, clockwise=True) +
+                 ["G0 X1 Y1", "G1 X5 Y5 E1", "G1 E-1", "G0 X1 Y19", "G1 E1", "G1 X5 Y19 E1", "G1 X5 Y15 E1"])
+
+
+def check_shoelace_and_inside():
+    xs = [0, 10, 10, 0, 0, 0, 4]
+    ys = [0, 0, 10, 10, 0, 4, 0]
+    eq_([100, -8], list(shoelace_areas(xs, ys, [0, 4, 7])))
+    eq_([True, False, False], points_in_polygon([5, 15, 5], [5, 5, -1], xs[:4], ys[:4]))
+    ok_(points_near_polygon([5, 10.5], [5, 5], xs[:4], ys[:4], 1))
+    ok_(points_near_polygon([5] * 100 + [5], [5] * 100 + [9.5], xs[:4], ys[:4], 1))
+    ok_(not points_near_polygon([5, 12, 5], [5, 12, -1.5], xs[:4], ys[:4], 1))
+
+
+def test_shoelace_and_inside():
+    check_shoelace_and_inside()
+
+
+def test_shoelace_and_inside_without_numpy():
+    saved, loops.numpy = loops.numpy, None
+    try:
+        check_shoelace_and_inside()
+    finally:
+        loops.numpy = saved
+
+
+def check_holed_square():
+    gcode = holed_square()
+    layer_loops = gcode.loops.layer(1)
+    eq_(4, len(layer_loops))
+
+    assert_almost_equal(400, layer_loops.areas[0])
+    assert_almost_equal(19 * 19, layer_loops.areas[1])
+    assert_almost_equal(-25, layer_loops.areas[2])
+    assert_almost_equal(-16, layer_loops.areas[3])
+    assert_almost_equal(80, layer_loops.perimeters[0])
+    eq_(COUNTER_CLOCKWISE, layer_loops.winding(0))
+    eq_(CLOCKWISE, layer_loops.winding(3))
+    eq_([(0, 0), (20, 0), (20, 20), (0, 20)], layer_loops.polygon(0))
+    eq_((0, 0, 20, 20), layer_loops.bounds[0])
+
+    eq_([-1, 0, 1, 2], list(layer_loops.parents))
+    eq_([0, 1, 2, 3], list(layer_loops.depths))
+    eq_([False, False, True, True], [layer_loops.is_hole(loop) for loop in range(4)])
+
+    # rows of the LayerSegments, travels excluded
+    eq_([2, 3, 4, 5], list(layer_loops.rows(0)))
+    ok_(all(layer_loops.segments.lines[row].raw.startswith("G1") for row in layer_loops.rows(3)))
+
+
+def test_holed_square():
+    check_holed_square()
+
+
+def test_holed_square_without_numpy():
+    saved, loops.numpy = loops.numpy, None
+    try:
+        check_holed_square()
+    finally:
+        loops.numpy = saved
+
+
+def circle(radius, points, center_x=0.):
+    coordinates = [(center_x + radius * math.cos(2 * math.pi * point / points),
+                    radius * math.sin(2 * math.pi * point / points)) for point in range(points + 1)]
+    return ["G0 X%.4f Y%.4f" % coordinates[0]] + ["G1 X%.4f Y%.4f E0.01" % point for point in coordinates[1:]]
+
+
+def check_large_loops():
+    # perimeters of many points, two shells around two islands
+    gcode = GCode(["G90", "M83", "G1 Z0.2"] + circle(20, 1500) + circle(19.5, 1500) + circle(10, 1500) +
+                  circle(2, 200, 5) + circle(1.5, 150, -5))
+    layer_loops = gcode.loops.layer(1)
+    eq_([-1, 0, 1, 2, 2], list(layer_loops.parents))
+    eq_([0, 1, 2, 3, 3], list(layer_loops.depths))
+    eq_([0, 0, 1, 2, 2], list(layer_loops.levels))
+
+
+def test_large_loops():
+    check_large_loops()
+
+
+def test_large_loops_without_numpy():
+    saved, loops.numpy = loops.numpy, None
+    try:
+        check_large_loops()
+    finally:
+        loops.numpy = saved
+
+
+def test_arc_loop():
+    # a full circle inside a square, far enough from it to be an island in a hole
+    gcode = GCode(["G90", "M82", "G1 Z0.2"] + ["G0 X0 Y0", "G1 X40 Y0 E1", "G1 X40 Y40 E2", "G1 X0 Y40 E3",
+                                                "G1 X0 Y0 E4"] +
+                  ["G0 X25 Y20", "G2 X25 Y20 I-5 J0 E5"] + ["G0 X22 Y20", "G3 X22 Y20 I-2 J0 E6"])
+    layer_loops = gcode.loops.layer(1)
+    eq_(3, len(layer_loops))
+    # chords cut the arc by up to the arc tolerance
+    assert_almost_equal(-math.pi * 25, layer_loops.areas[1], delta=0.3)
+    assert_almost_equal(2 * math.pi * 5, layer_loops.perimeters[1], delta=0.05)
+    eq_([0, 1, 2], list(layer_loops.depths))
+    eq_([0, 1, 2], list(layer_loops.levels))
+    eq_([False, True, False], [layer_loops.is_hole(loop) for loop in range(3)])
+
+
+def test_open_paths():
+    gcode = GCode(["G90", "M82", "G1 Z0.2", "G0 X0 Y0", "G1 X10 Y0 E1", "G1 X10 Y10 E2", "G1 X0 Y10 E3",
+                   "G0 X0 Y0", "G1 X5 Y5 E4"])
+    eq_(0, len(gcode.loops.layer(1)))
+
+
+def test_sample_programs():
+    gcode = open_gcode_file('cura_square.gcode')
+    for layer_idx in range(len(gcode.all_layers)):
+        layer_loops = gcode.loops.layer(layer_idx)
+        for loop in range(len(layer_loops)):
+            ok_(layer_loops.perimeters[loop] > 0)
+            ok_(layer_loops.first_rows[loop] <= layer_loops.last_rows[loop])
+
+    # the index follows the invalidation of the segment table
+    gcode = holed_square()
+    first = gcode.loops.layer(1)
+    ok_(first is gcode.loops.layer(1))
+    gcode.segments.invalidate(1)
+    ok_(first is not gcode.loops.layer(1))
@@ -0,0 +1,141 @@
+import io
+
+from nose.tools import eq_, ok_, assert_almost_equal
+
+from gcodeutils.metadata import parse_duration, read_file_metadata, read_head_tail, read_metadata, \
+    seekable
+from gcodeutils.tests import gcode_file_path
+
+__author__ = 'olivier'
+
+CURA_HEADER = b""";FLAVOR:Marlin
+;TIME:6666
+;Filament used: 1.5m
+;Layer height: 0.2
+;Generated with Cura_SteamEngine 4.8.0
+;LAYER_COUNT:42
+"""
+
+PRUSA_FOOTER = b"""; filament used [mm] = 1234.56
+; filament used [g] = 3.72
+; estimated printing time (normal mode) = 1h 2m 3s
+; external perimeters extrusion width = 0.45mm
+; layer_height = 0.15
+; nozzle_diameter = 0.4
+"""
+
+SIMPLIFY3D_HEADER = b"""; G-Code generated by Simplify3D(R) Version 4.1.2
+;   layerHeight,0.25
+;   extruderDiameter,0.4
+;   extruderWidth,0.48
+"""
+
+SIMPLIFY3D_FOOTER = b""";   Build time: 1 hours 30 minutes
+;   Filament length: 4567.8 mm (4.57 m)
+;   Plastic weight: 13.62 g (0.03 lb)
+"""
+
+BODY_LINE = b"G1 X10 Y10 E1\n"
+
+
+class NonSeekable(object):
+    """Iterable over lines which can't be seeked"""
+
+    def __init__(self, data):
+        self.lines = io.BytesIO(data).readlines()
+
+    def __iter__(self):
+        return iter(self.lines)
+
+
+def test_parse_duration():
+    eq_(3723, parse_duration("1h 2m 3s"))
+    eq_(90061, parse_duration("1d 1h 1m 1s"))
+    eq_(5400, parse_duration("1 hours 30 minutes"))
+    eq_(None, parse_duration("soon"))
+
+
+def test_cura_header():
+    gcode_file = io.BytesIO(CURA_HEADER + BODY_LINE * 10000)
+    metadata = read_metadata(gcode_file, window=1024)
+    eq_('cura', metadata['slicer'])
+    eq_('4.8.0', metadata['slicer_version'])
+    eq_(6666, metadata['estimated_time'])
+    assert_almost_equal(1500, metadata['filament_used'])
+    eq_(42, metadata['layer_count'])
+    assert_almost_equal(0.2, metadata['layer_height'])
+    # the file is rewound for later readers
+    eq_(0, gcode_file.tell())
+
+
+def test_prusaslicer_footer():
+    data = b"; generated by PrusaSlicer 2.3.0+linux\n" + BODY_LINE * 10000 + PRUSA_FOOTER
+    metadata = read_metadata(io.BytesIO(data), window=1024)
+    eq_('prusaslicer', metadata['slicer'])
+    eq_('2.3.0+linux', metadata['slicer_version'])
+    assert_almost_equal(1234.56, metadata['filament_used'])
+    assert_almost_equal(3.72, metadata['filament_weight'])
+    eq_(3723, metadata['estimated_time'])
+    assert_almost_equal(0.45, metadata['extrusion_width'])
+    assert_almost_equal(0.15, metadata['layer_height'])
+    assert_almost_equal(0.4, metadata['nozzle_diameter'])
+
+
+def test_simplify3d():
+    data = SIMPLIFY3D_HEADER + BODY_LINE * 10000 + SIMPLIFY3D_FOOTER
+    metadata = read_metadata(io.BytesIO(data), window=1024)
+    eq_('simplify3d', metadata['slicer'])
+    eq_('4.1.2', metadata['slicer_version'])
+    eq_(5400, metadata['estimated_time'])
+    assert_almost_equal(4567.8, metadata['filament_used'])
+    assert_almost_equal(13.62, metadata['filament_weight'])
+    assert_almost_equal(0.25, metadata['layer_height'])
+    assert_almost_equal(0.48, metadata['extrusion_width'])
+
+
+def test_head_tail_window():
+    # comments in the middle of big files aren't read
+    data = CURA_HEADER + BODY_LINE * 10000 + b";LAYER_COUNT:1\n;middle\n" + BODY_LINE * 10000 + PRUSA_FOOTER
+    lines = read_head_tail(io.BytesIO(data), window=1024)
+    ok_(';middle' not in lines)
+    eq_(';FLAVOR:Marlin', lines[0])
+    eq_('; nozzle_diameter = 0.4', lines[-1])
+    # lines cut by the windows are dropped
+    ok_(all(line in ('G1 X10 Y10 E1', '') or line.startswith(';') for line in lines))
+
+    eq_(None, read_head_tail(NonSeekable(data)))
+
+
+def test_streaming_fallback():
+    data = b";LAYER:0\n" + BODY_LINE * 5000 + b";LAYER:1\n" + BODY_LINE * 5000 + b";LAYER:2\n" + BODY_LINE * 5000
+
+    # no layer count in the header nor footer
+    eq_({}, read_metadata(io.BytesIO(data), window=1024))
+
+    # a required key triggers a scan of the whole file, counting layer changes
+    gcode_file = io.BytesIO(data)
+    eq_(3, read_metadata(gcode_file, window=1024, required=('layer_count',))['layer_count'])
+    eq_(0, gcode_file.tell())
+
+    # non seekable files are always scanned
+    eq_(3, read_metadata(NonSeekable(data), window=1024)['layer_count'])
+
+
+def test_seekable():
+    ok_(seekable(io.BytesIO(BODY_LINE)))
+    ok_(not seekable(NonSeekable(BODY_LINE)))
+    with open(gcode_file_path('cura_square.gcode')) as gcode_file:
+        ok_(seekable(gcode_file))
+
+
+def test_sample_files():
+    metadata = read_file_metadata(gcode_file_path('skeinforge_model1_prestretch.gcode'), window=4096,
+                                  required=('layer_count',))
+    eq_('skeinforge', metadata['slicer'])
+    eq_('12.03.14', metadata['slicer_version'])
+    assert_almost_equal(0.4, metadata['layer_height'])
+    assert_almost_equal(0.72, metadata['extrusion_width'])
+    eq_(31, metadata['layer_count'])
+
+    metadata = read_file_metadata(gcode_file_path('slic3r_square.gcode'))
+    assert_almost_equal(0.72, metadata['extrusion_width'])
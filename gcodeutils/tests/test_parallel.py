@@ -0,0 +1,113 @@
+from nose.tools import eq_
+
+from gcodeutils.filter.arc_optimizer import GCodeArcOptimizerFilter
+from gcodeutils.filter.chain import FilterChain
+from gcodeutils.filter.filter import GCodeFilter, STATELESS, LAYER_STATE, CARRIED_STATE, context_attribute
+from gcodeutils.filter.parallel import ParallelFilterRunner, free_threading
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.gcoder import GCode
+from gcodeutils.tests import DropComments, open_gcode_file, gcode_eq, raws
+from gcodeutils.tests.test_layer_store import open_out_of_core_gcode_file
+
+__author__ = 'olivier'
+
+SAMPLES = ('simple3.gcode', 'cura_square.gcode', 'slic3r_square.gcode')
+
+
+class NumberLayerLines(GCodeFilter):
+    """filter numbering the lines of each layer in a comment"""
+    state_dependency = LAYER_STATE
+
+    layer_idx = context_attribute('layer_idx')
+    line_number = context_attribute('line_number')
+
+    def new_context(self):
+        context = super(NumberLayerLines, self).new_context()
+        context.layer_idx = context.line_number = None
+        return context
+
+    def opcode_filter(self, opcode):
+        if self.layer_idx != self.current_layer_idx:
+            self.layer_idx, self.line_number = self.current_layer_idx, 0
+        self.line_number += 1
+        opcode.raw += " ; %d:%d" % (self.current_layer_idx, self.line_number)
+        return opcode
+
+
+def check_parallel(filename, make_filter, **kwargs):
+    gcode = open_gcode_file(filename)
+    gcode_oracle = open_gcode_file(filename)
+
+    make_filter().filter(gcode_oracle)
+    layer_filter = make_filter()
+    ParallelFilterRunner(layer_filter, **kwargs).filter(gcode)
+
+    gcode_eq(gcode_oracle, gcode)
+    eq_(raws(gcode_oracle), raws(gcode))
+    return layer_filter
+
+
+def test_carried_state():
+    for filename in SAMPLES:
+        for chunk_size in (1, 3, None):
+            check_parallel(filename, lambda: GCodeXYTranslateFilter(x=1, y=2), jobs=2, chunk_size=chunk_size)
+            layer_filter = check_parallel(filename, GCodeToRelativeExtrusionFilter, jobs=2, chunk_size=chunk_size)
+
+            # the filter is left in the state reached after filtering
+            oracle_filter = GCodeToRelativeExtrusionFilter()
+            oracle_filter.filter(open_gcode_file(filename))
+            eq_(oracle_filter.get_carried_state(), layer_filter.get_carried_state())
+
+
+def test_independent_layers():
+    for filename in SAMPLES:
+        check_parallel(filename, DropComments, jobs=2, chunk_size=2)
+        check_parallel(filename, NumberLayerLines, jobs=3)
+        check_parallel(filename, lambda: FilterChain(DropComments(), NumberLayerLines()), jobs=2)
+
+
+def test_threads():
+    for filename in SAMPLES:
+        check_parallel(filename, lambda: GCodeXYTranslateFilter(x=1, y=2), jobs=3, chunk_size=1, threads=True)
+        check_parallel(filename, GCodeToRelativeExtrusionFilter, jobs=3, chunk_size=1, threads=True)
+        check_parallel(filename, lambda: FilterChain(DropComments(), NumberLayerLines()), jobs=2, threads=True)
+    check_parallel('arc_raw_1.gcode', GCodeArcOptimizerFilter, jobs=2, threads=True)
+
+    eq_(free_threading(), ParallelFilterRunner(DropComments()).threads)
+
+
+def test_layer_store():
+    # layers are evicted from the store while filtered ones are handed back
+    for make_filter in (lambda: GCodeXYTranslateFilter(x=5), GCodeToRelativeExtrusionFilter):
+        for kwargs in ({}, {'threads': True}, {'shared_memory': False}):
+            gcode = open_out_of_core_gcode_file('skeinforge_model1_prestretch.gcode', memory_budget=1024)
+            gcode_oracle = open_gcode_file('skeinforge_model1_prestretch.gcode')
+
+            make_filter().filter(gcode_oracle)
+            ParallelFilterRunner(make_filter(), jobs=3, **kwargs).filter(gcode)
+            eq_(raws(gcode_oracle), raws(gcode))
+
+
+def test_serial_fallback():
+    check_parallel('arc_raw_1.gcode', GCodeArcOptimizerFilter, jobs=2, chunk_size=1)
+    check_parallel('cura_square.gcode', lambda: FilterChain(GCodeXYTranslateFilter(x=1, y=2),
+                                                            GCodeToRelativeExtrusionFilter()), jobs=2)
+    check_parallel('cura_square.gcode', GCodeToRelativeExtrusionFilter, jobs=1)
+
+
+def test_state_dependency():
+    eq_(STATELESS, FilterChain(DropComments()).state_dependency)
+    eq_(LAYER_STATE, FilterChain(DropComments(), NumberLayerLines()).state_dependency)
+    eq_(CARRIED_STATE, FilterChain(NumberLayerLines(), GCodeToRelativeExtrusionFilter()).state_dependency)
+
+
+def test_scan_layer():
+    gcode = GCode(["M83", "G1 Z0.2", "G1 X1 E1", "M82", "G92 E0", "G1 Z0.4", "G1 X2 E3.5", "G91", "G92 X0",
+                   "G1 Z0.6", "G90", "G92", "G1 X3"])
+    for make_filter in (lambda: GCodeXYTranslateFilter(x=1, y=2), GCodeToRelativeExtrusionFilter):
+        scanned, filtered = make_filter(), make_filter()
+        for layer in gcode.all_layers:
+            scanned.scan_layer(layer)
+            filtered.parse_layer(list(layer), filtered.opcode_filter)
+            eq_(filtered.get_carried_state(), scanned.get_carried_state())
@@ -0,0 +1,66 @@
+from itertools import chain
+import pickle
+
+from nose.tools import eq_, ok_, assert_raises
+
+from gcodeutils.gcoder import GCode, PyLine, Layer, SharedLayer, pack_lines, unpack_lines
+from gcodeutils.tests import attributes, open_gcode_file, gcode_eq
+from gcodeutils.tests.test_layer_sharing import tower
+
+__author__ = 'olivier'
+
+
+def test_protocol_lookups():
+    line = PyLine("G1 X1")
+    eq_(None, line.x)
+    assert_raises(AttributeError, getattr, line, '__reduce_foo__')
+    ok_(not hasattr(line, '__len__'))
+
+
+def test_line_pickling():
+    gcode = GCode(["G90", "M82", "G1 Z0.2 F1200", "G1 X10 Y5 E1.5", "T1", "; comment", "M83", "G1 X0 E-1"])
+    for line in gcode.lines:
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            eq_(attributes(line), attributes(pickle.loads(pickle.dumps(line, protocol))))
+
+
+def test_packed_lines():
+    gcode = GCode(["G90", "M82", "G1 Z0.2 F1200", "G1 X10 Y5 E1.5", "T1", "; comment", "G91", "M83", "G1 X0 E-1"])
+    lines = unpack_lines(pack_lines(gcode.lines))
+    eq_([attributes(line) for line in gcode.lines], [attributes(line) for line in lines])
+
+    # flags which are unset, false or true are told apart
+    eq_([None, False, True], [lines[0].relative, lines[2].relative, lines[-1].relative])
+
+
+def test_layer_pickling():
+    gcode = open_gcode_file('skeinforge_model1_prestretch.gcode')
+    for layer in gcode.all_layers:
+        copy = pickle.loads(pickle.dumps(layer, pickle.HIGHEST_PROTOCOL))
+        ok_(type(copy) is Layer)
+        eq_((layer.z, layer.duration), (copy.z, copy.duration))
+        eq_([attributes(line) for line in layer], [attributes(line) for line in copy])
+
+    # layers are smaller than their lines pickled one by one
+    layers = pickle.dumps(gcode.all_layers, pickle.HIGHEST_PROTOCOL)
+    lines = pickle.dumps([list(layer) for layer in gcode.all_layers], pickle.HIGHEST_PROTOCOL)
+    ok_(len(layers) < len(lines))
+
+
+def test_shared_layer_pickling():
+    gcode = GCode(tower(), share_layers=True)
+    layer = [layer for layer in gcode.all_layers if isinstance(layer, SharedLayer)][-1]
+    raw_lines = layer.raw_lines()
+    eq_(raw_lines, pickle.loads(pickle.dumps(layer, pickle.HIGHEST_PROTOCOL)).raw_lines())
+
+
+def test_gcode_pickling():
+    gcode = open_gcode_file('cura_square.gcode')
+    gcode.segments
+    copy = pickle.loads(pickle.dumps(gcode, pickle.HIGHEST_PROTOCOL))
+
+    gcode_eq(gcode, copy)
+    eq_(gcode.duration, copy.duration)
+    eq_([line.raw for line in gcode.lines], [line.raw for line in copy.lines])
+    ok_(all(line is layer_line for line, layer_line in zip(copy.lines, chain.from_iterable(copy.all_layers))))
+    eq_(len(gcode.segments.layer(1)), len(copy.segments.layer(1)))
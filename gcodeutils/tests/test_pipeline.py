@@ -0,0 +1,90 @@
+import itertools
+import threading
+import time
+from StringIO import StringIO
+
+from nose.tools import eq_, ok_, assert_raises
+
+from gcodeutils.filter.filter import KEEP
+from gcodeutils.filter.pipeline import Pipeline, layer_batches
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.stream import StreamFilter, parse_lines, run_pipeline
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.tests import gcode_file_path
+
+__author__ = 'olivier'
+
+
+class Failing(StreamFilter):
+    def process(self, window):
+        if window.current.command == 'M107':
+            raise ValueError("failing on M107")
+        return KEEP
+
+
+class BlockingOutput(object):
+    """output file failing after a while without writing anything, as a full disk would"""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        raise IOError("no space left on device")
+
+
+class EventOutput(object):
+    """output file signaling its first write"""
+
+    def __init__(self):
+        self.written = threading.Event()
+        self.text = []
+
+    def write(self, text):
+        self.text.append(text)
+        self.written.set()
+
+
+def test_equals_serial_run():
+    for filename in ('simple3.gcode', 'cura_square.gcode', 'slic3r_square.gcode'):
+        with open(gcode_file_path(filename)) as gcode_file:
+            raw_lines = gcode_file.readlines()
+        serial = run_pipeline(parse_lines(raw_lines), GCodeXYTranslateFilter(x=1, y=2),
+                              GCodeToRelativeExtrusionFilter())
+
+        output = StringIO()
+        Pipeline([GCodeXYTranslateFilter(x=1, y=2), GCodeToRelativeExtrusionFilter()], batch_size=50).run(
+            iter(raw_lines), output)
+        eq_("".join(line.raw + "\n" for line in serial), output.getvalue())
+
+
+def test_layer_batches():
+    lines = parse_lines(["G90", "G1 Z0.2", "G1 X1", "G1 X2", "G1 X3", "G1 Z0.4", "G1 X4", "M107"])
+    eq_([["G90"], ["G1 Z0.2", "G1 X1", "G1 X2"], ["G1 X3"], ["G1 Z0.4", "G1 X4", "M107"]],
+        [[line.raw for line in batch] for batch in layer_batches(lines, batch_size=3)])
+
+
+def test_output_while_reading():
+    output = EventOutput()
+    written_while_reading = []
+
+    def program():
+        for z in range(1, 4):
+            yield "G1 Z%d" % z
+            yield "G1 X%d" % z
+        written_while_reading.append(output.written.wait(10))
+        yield "M107"
+
+    Pipeline(batch_size=2).run(program(), output)
+    eq_([True], written_while_reading)
+    eq_("G1 Z1\nG1 X1\nG1 Z2\nG1 X2\nG1 Z3\nG1 X3\nM107\n", "".join(output.text))
+
+
+def test_failures():
+    assert_raises(ValueError, Pipeline([Failing()]).run, iter(["G90", "M107", "G1 X1"]), StringIO())
+
+    # stages blocked by a failing output stop, with a bounded number of lines read
+    read = []
+    program = ("G1 Z%d" % z for z in itertools.count() if read.append(z) is None)
+    assert_raises(IOError, Pipeline(batch_size=10, queue_size=2).run, program, BlockingOutput(0.5))
+    ok_(len(read) < 200)
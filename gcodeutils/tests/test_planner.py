@@ -0,0 +1,103 @@
+from nose.tools import eq_, ok_, assert_almost_equal
+
+from gcodeutils import planner
+from gcodeutils.gcode_stats import analyze_file
+from gcodeutils.gcoder import GCode
+from gcodeutils.planner import MachineProfile, MotionPlanner, estimate_gcode
+from gcodeutils.tests import open_gcode_file, gcode_file_path
+
+__author__ = 'olivier'
+
+PROFILE = MachineProfile(acceleration=1000., junction_deviation=.05)
+
+
+def plan(moves, profile=PROFILE):
+    motion_planner = MotionPlanner(profile)
+    for move in moves:
+        motion_planner.add_move(*move)
+    return list(motion_planner.durations())
+
+
+def without_numpy(func):
+    def wrapper():
+        numpy = planner.numpy
+        planner.numpy = None
+        try:
+            func()
+        finally:
+            planner.numpy = numpy
+
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def test_trapezoid():
+    # 5mm to accelerate to 100mm/s, 90mm of cruise, 5mm to decelerate
+    assert_almost_equal(1.1, plan([(100, 0, 0, 0, 6000)])[0])
+
+
+def test_triangle():
+    # cruise speed is never reached
+    assert_almost_equal(2 * (1 / 1000.) ** .5, plan([(1, 0, 0, 0, 6000)])[0])
+
+
+def test_aligned_moves_are_chained():
+    assert_almost_equal(1.1, sum(plan([(50, 0, 0, 0, 6000), (50, 0, 0, 0, 6000)])))
+
+
+def test_reversal_stops():
+    durations = plan([(100, 0, 0, 0, 6000), (-100, 0, 0, 0, 6000)])
+    assert_almost_equal(1.1, durations[0])
+    assert_almost_equal(1.1, durations[1])
+
+
+def test_corner_is_slower_than_straight_line():
+    straight = sum(plan([(10, 0, 0, 0, 6000), (10, 0, 0, 0, 6000)]))
+    corner = sum(plan([(10, 0, 0, 0, 6000), (0, 10, 0, 0, 6000)]))
+    ok_(straight < corner < 2 * plan([(10, 0, 0, 0, 6000)])[0])
+
+
+def test_axis_limits():
+    profile = MachineProfile(max_velocity={'z': 5.}, acceleration=1000.)
+    # 0.0125mm to accelerate to 5mm/s
+    assert_almost_equal(10 / 5. + 5 / 1000., plan([(0, 0, 10, 0, 6000)], profile)[0])
+
+
+def test_acceleration_command():
+    gcode = GCode(["G1 X100 F6000", "M204 S500", "G1 X0"])
+    durations = estimate_gcode(gcode, PROFILE).line_durations
+    assert_almost_equal(1.1, durations[0])
+    assert_almost_equal(1.2, durations[2])
+
+
+def check_implementations_agree(profile):
+    gcode = open_gcode_file('cura_square.gcode')
+    reference = estimate_gcode(gcode, profile)
+    numpy = planner.numpy
+    planner.numpy = None
+    try:
+        fallback = estimate_gcode(gcode, profile)
+    finally:
+        planner.numpy = numpy
+    for lhs, rhs in zip(reference.line_durations, fallback.line_durations):
+        assert_almost_equal(lhs, rhs)
+
+
+def test_implementations_agree():
+    for profile in planner.PROFILES.values():
+        yield check_implementations_agree, profile
+
+
+@without_numpy
+def test_trapezoid_without_numpy():
+    test_trapezoid()
+    test_corner_is_slower_than_straight_line()
+
+
+def test_stats_use_the_planner():
+    profile = planner.PROFILES['marlin']
+    gcode = open_gcode_file('cura_square.gcode')
+    stats = analyze_file(gcode_file_path('cura_square.gcode'), profile)
+
+    assert_almost_equal(estimate_gcode(gcode, profile).total, stats['totals']['time'])
+    eq_(gcode.estimate_duration(profile)[1], estimate_gcode(gcode, profile).duration)
@@ -0,0 +1,22 @@
+from nose.tools import eq_
+
+from gcodeutils.gcoder import GCode
+
+__author__ = 'olivier'
+
+
+def test_set_extruder_position():
+    gcode = GCode(["M82", "G1 X1 E5", "G92 E0", "G1 X2 E1", "G92 E3", "G1 X3 E4", "G1 X4 E2"])
+
+    # E positions go on from the current extruder position, whatever the value given to G92
+    eq_([0, 5, 5, 6, 6, 7, 5], [line.current_e for line in gcode])
+    eq_([None, True, None, True, None, True, False], [line.extruding for line in gcode])
+    eq_(7, gcode.filament_length)
+    eq_(2, gcode.abs_e)
+
+
+def test_set_extruder_position_relative():
+    gcode = GCode(["M82", "G1 X1 E5", "G92 E2", "M83", "G1 X2 E1", "G1 X3 E-0.5", "M82", "G1 X4 E4"])
+
+    eq_([0, 5, 5, 5, 6, 5.5, 5.5, 7], [line.current_e for line in gcode])
+    eq_([None, True, None, None, True, False, None, True], [line.extruding for line in gcode])
@@ -0,0 +1,63 @@
+from nose.tools import eq_, ok_, raises
+
+from gcodeutils.filter.progress import GCodeProgressFilter
+from gcodeutils.gcoder import GCode
+from gcodeutils.layer_store import DiskLayerStore
+from gcodeutils.planner import PROFILES
+from gcodeutils.tests import open_gcode_file, gcode_file_path
+
+__author__ = 'olivier'
+
+
+def progress_markers(gcode):
+    return [line.raw for layer in gcode.all_layers for line in layer if line.command == 'M73']
+
+
+def test_cumulative_index():
+    gcode = open_gcode_file('skeinforge_model1_prestretch.gcode')
+
+    eq_(len(gcode), len(gcode.time_index))
+    eq_(int(gcode.time_index[-1]), gcode.duration.seconds)
+    ok_(all(lhs <= rhs for lhs, rhs in zip(gcode.time_index, gcode.time_index[1:])))
+
+
+def test_insert_lines():
+    gcode = GCode(["G1 X10 E1 F600", "G1 Z1", "G1 X20 E2", "G1 X30 E3"])
+    gcode.insert_lines([(1, 1, ["M117 middle"]), (0, 0, ["M117 start"]), (1, 0, ["M117 layer"])])
+
+    # the Z move starts the second layer
+    eq_(["M117 start", "G1 X10 E1 F600", "M117 layer", "G1 Z1", "M117 middle", "G1 X20 E2", "G1 X30 E3"],
+        [line.raw for line in gcode])
+    eq_(len(gcode), len(gcode.time_index))
+    ok_(gcode.has_current_index())
+    middle = gcode.all_layers[1][2]
+    eq_(10, middle.current_x)
+    eq_(1, middle.current_z)
+    eq_(gcode.time_index[3], gcode.time_index[4])
+
+
+def test_progress_markers():
+    gcode = open_gcode_file('skeinforge_model1_prestretch.gcode')
+    GCodeProgressFilter(10).filter(gcode)
+
+    markers = progress_markers(gcode)
+    eq_(11, len(markers))
+    eq_("M73 P0 R15", markers[0])
+    eq_("M73 P100 R0", markers[-1])
+    eq_(["M73 P{}".format(percentage) for percentage in range(0, 101, 10)],
+        [marker.split(' R')[0] for marker in markers])
+
+
+def test_progress_markers_with_planner():
+    with open(gcode_file_path('skeinforge_model1_prestretch.gcode')) as gcode_file:
+        gcode = GCode(gcode_file, layer_store=DiskLayerStore(memory_budget=16 * 1024))
+    GCodeProgressFilter(25, PROFILES['marlin']).filter(gcode)
+
+    eq_(5, len(progress_markers(gcode)))
+
+
+@raises(ValueError)
+def test_stale_index():
+    gcode = open_gcode_file('simple3.gcode')
+    del gcode.all_layers[0][0]
+    GCodeProgressFilter(10).filter(gcode)
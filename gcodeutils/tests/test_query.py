@@ -0,0 +1,59 @@
+from nose.tools import eq_, ok_
+
+from gcodeutils.features import INFILL, OUTER_WALL
+from gcodeutils.gcoder import GCode
+
+__author__ = 'olivier'
+
+
+def program():
+    lines = ["G90", "M82", "G92 E0"]
+    e = 0
+    for z in (0.2, 0.4, 0.6, 0.8):
+        e += 1
+        lines += ["G1 Z{}".format(z), ";TYPE:WALL-OUTER", "G1 X0 Y0", "G1 X10 Y0 E{}".format(e),
+                  "G1 X10 Y10 E{}".format(e + .5), ";TYPE:FILL", "G1 X20 Y20 E{}".format(e + .8),
+                  "M106 S255"]
+    return GCode(lines)
+
+
+def test_layer_and_z_query():
+    gcode = program()
+    eq_([2, 3, 4], gcode.query(z=(0.3, 0.8)).layers())
+    eq_([2, 3, 4], gcode.query(z=(0.3, None)).layers())
+    eq_([1, 2], gcode.query(z=(None, 0.5)).layers())
+    eq_([2], gcode.query(layers=(2, 3), z=(0.3, 0.8)).layers())
+
+    view = gcode.query(z=(0.4, 0.4), commands=('M106',))
+    eq_(1, len(view))
+    eq_("M106 S255", view[0].raw)
+    ok_(view[0] is gcode.all_layers[2][-1])
+    eq_([(2, 7)], [(layer_idx, line_idx) for layer_idx, line_idx, _ in view.items()])
+
+
+def test_feature_query():
+    gcode = program()
+    view = gcode.query(layers=(3, 5), features=(OUTER_WALL,), commands=('G1',))
+    eq_(["G1 X10 Y0 E3", "G1 X10 Y10 E3.5", "G1 X10 Y0 E4", "G1 X10 Y10 E4.5"], [line.raw for line in view])
+    eq_(["G1 X20 Y20 E1.8"], [line.raw for line in gcode.query(layers=(0, 2), features=(INFILL,))
+                              if line.is_move])
+
+
+def test_bbox_query():
+    gcode = program()
+    view = gcode.query(bbox=(-1, -1, 11, 11))
+    # moves coming from (20, 20) aren't inside, only the first layer starts from the origin
+    eq_(4 + 3 * 2, len(view))
+    ok_(all(line.command == "G1" and "X20" not in line.raw for line in view))
+
+    # layers entirely inside the box are selected without looking at their moves
+    eq_(4 * 5, len(gcode.query(bbox=(-1, -1, 21, 21))))
+    eq_(0, len(gcode.query(bbox=(30, 30, 40, 40))))
+
+
+def test_arc_bbox_query():
+    gcode = GCode(["G1 X10 Y0 Z0.2 E1", "G2 X-10 Y0 I-10 J0 E2"])
+    eq_(1, len(gcode.query(bbox=(-11, -1, 11, 11), commands=('G1',))))
+    # the arc sweeps down to Y -10
+    eq_(0, len(gcode.query(bbox=(-11, -1, 11, 11), commands=('G2',))))
+    eq_(1, len(gcode.query(bbox=(-11, -11, 11, 11), commands=('G2',))))
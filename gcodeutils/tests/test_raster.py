@@ -0,0 +1,103 @@
+import base64
+import struct
+import zlib
+
+from nose.tools import eq_, ok_, assert_almost_equal
+
+from gcodeutils import raster
+from gcodeutils.gcoder import GCode
+from gcodeutils.raster import Raster, embed_thumbnails, extruding_paths, render_heatmap, render_thumbnail, \
+    thumbnail_block
+
+__author__ = 'olivier'
+
+
+def square():
+    return GCode(["G90", "M82", "G1 Z0.2", "G1 X0 Y0", "G1 X10 Y0 E1", "G1 X10 Y10 E2", "G1 X0 Y10 E3",
+                  "G1 X0 Y0 E4", "G0 X5 Y5", "G1 Z0.4", "G1 X10 Y10 E6"])
+
+
+def decode_png(png):
+    """return the width, height, color type and pixel rows of a PNG written by write_png"""
+    eq_(b'\x89PNG\r\n\x1a\n', png[:8])
+    position = 8
+    chunks = {}
+    while position < len(png):
+        length, = struct.unpack('>I', png[position:position + 4])
+        kind = png[position + 4:position + 8]
+        chunks[kind] = png[position + 8:position + 8 + length]
+        position += 12 + length
+    width, height, _, color_type = struct.unpack('>IIBB', chunks[b'IHDR'][:10])
+    channels = 4 if color_type == 6 else 3
+    raw = bytearray(zlib.decompress(chunks[b'IDAT']))
+    stride = width * channels + 1
+    rows = [[tuple(raw[y * stride + 1 + x * channels:y * stride + 1 + (x + 1) * channels]) for x in range(width)]
+            for y in range(height)]
+    return width, height, color_type, rows
+
+
+def test_raster():
+    image = Raster(10, 10, (0, 0, 10, 10))
+    image.draw([0.], [0.5], [10.], [0.5])
+    values = image.values()
+    # Y goes up, the bottom row of the image is crossed
+    eq_([1.] * 10, values[-1])
+    eq_(0, sum(values[0]))
+
+    image = Raster(5, 5, (0, 0, 10, 10), supersampling=2)
+    image.draw([0.], [0.5], [10.], [0.5], [20.])
+    assert_almost_equal(1., image.values()[-1][0])
+
+
+def test_raster_without_numpy():
+    numpy = raster.numpy
+    raster.numpy = None
+    try:
+        test_raster()
+        eq_(decode_png(render_heatmap(square(), 8, 8)), decode_png(render_heatmap_with_numpy(numpy)))
+    finally:
+        raster.numpy = numpy
+
+
+def render_heatmap_with_numpy(numpy):
+    raster.numpy = numpy
+    try:
+        return render_heatmap(square(), 8, 8)
+    finally:
+        raster.numpy = None
+
+
+def test_extruding_paths():
+    x0s, y0s, x1s, y1s, extrusions = extruding_paths(square())
+    eq_(5, len(x0s))
+    eq_([1, 1, 1, 1, 2], list(extrusions))
+    eq_((5, 5, 10, 10), (x0s[-1], y0s[-1], x1s[-1], y1s[-1]))
+
+
+def test_png():
+    width, height, color_type, rows = decode_png(render_thumbnail(square(), 16, 12))
+    eq_((16, 12, 6), (width, height, color_type))
+    # the square is centered horizontally, its outline opaque, its inside transparent but for the diagonal
+    eq_((255, 128, 0, 255), rows[0][2])
+    eq_(0, rows[0][1][3])
+    eq_(0, rows[3][9][3])
+
+    width, height, color_type, rows = decode_png(render_heatmap(square(), 10, 10, layer_idxs=[2]))
+    eq_(2, color_type)
+    # only the diagonal of the second layer
+    ok_(rows[0][9] != (0, 0, 0))
+    eq_((0, 0, 0), rows[0][0])
+
+
+def test_thumbnail_block():
+    png = render_thumbnail(square(), 16, 16)
+    block = thumbnail_block(png, 16, 16)
+    ok_(block[1].startswith('; thumbnail begin 16x16 '))
+    eq_('; thumbnail end', block[-2])
+    ok_(all(len(line) <= 80 for line in block))
+    eq_(png, base64.b64decode(''.join(line[2:] for line in block[2:-2])))
+
+    gcode = square()
+    embed_thumbnails(gcode, [(16, 16), (32, 32)])
+    eq_(block, [line.raw for line in gcode.all_layers[0][:len(block)]])
+    ok_(gcode.has_current_index())
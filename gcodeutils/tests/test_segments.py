@@ -0,0 +1,119 @@
+import copy
+import math
+
+from nose.tools import eq_, ok_, assert_almost_equal
+
+from gcodeutils.filter.filter import KEEP, GCodeFilter
+from gcodeutils.gcoder import GCode
+
+__author__ = 'olivier'
+
+
+def program():
+    return GCode(["G90", "M82", "G1 X3 Y4 E1 F600", "; comment", "G92 E0", "G1 Z1", "G1 X6 Y8 E0.5",
+                  "G2 X6 Y8 I1 J0 E1"])
+
+
+def test_segments():
+    gcode = program()
+    eq_(2, len(gcode.all_layers) - 1)
+
+    first = gcode.segments.layer(0)
+    eq_(len(gcode.all_layers[0]), len(first))
+    move = first[2]
+    eq_((0, 0, 0, 3, 4, 0), move[:6])
+    eq_(5, move.length)
+    eq_((.6, .8, 0), (move.direction_x, move.direction_y, move.direction_z))
+    eq_(1, move.extrusion)
+    eq_(.2, move.extrusion_per_mm)
+    eq_(600, move.feedrate)
+    # comments keep the position and don't extrude
+    eq_((3, 4, 0, 3, 4, 0, 0), first[3][:7])
+
+
+def test_segments_across_layers():
+    second = program().segments.layer(1)
+
+    # the layer starts where the previous one ended, extrusion is counted from the G92
+    eq_((3, 4, 0, 3, 4, 1), second[0][:6])
+    eq_((3, 4, 1, 6, 8, 1), second[1][:6])
+    eq_(.5, second[1].extrusion)
+    assert_almost_equal(2 * math.pi, second[2].length)
+    eq_(.5, second[2].extrusion)
+
+
+def test_xy_length():
+    gcode = GCode(["G90", "M82", "G1 X3 Y4 Z12 E1", "G2 X3 Y4 Z13 I1 J0 E2"])
+    move, arc = gcode.segments.layer(1)[0], gcode.segments.layer(2)[0]
+
+    # length is travelled in space, xy_length in the XY plane
+    eq_(13, move.length)
+    eq_(5, move.xy_length)
+    assert_almost_equal(math.hypot(2 * math.pi, 1), arc.length)
+    assert_almost_equal(2 * math.pi, arc.xy_length)
+
+
+def test_invalidation():
+    gcode = program()
+    segments = gcode.segments.layer(1)
+    ok_(gcode.segments.layer(1) is segments)
+
+    del gcode.all_layers[1][0]
+    ok_(gcode.segments.layer(1) is not segments)
+    eq_(2, len(gcode.segments.layer(1)))
+
+    segments = gcode.segments.layer(1)
+    gcode.segments.invalidate(1)
+    ok_(gcode.segments.layer(1) is not segments)
+
+
+def test_layer_entries():
+    gcode = program()
+    entry = gcode.segments.entry(2)
+    eq_((gcode.all_layers[1][-1], 1), entry)
+    # entries are computed once, and again once a previous layer is rebuilt or invalidated
+    ok_(gcode.segments.entry(2) is entry)
+    gcode.all_layers[1][-1:] = [gcode.all_layers[1][-1], gcode.all_layers[1][1]]
+    eq_((gcode.all_layers[1][-1], .5), gcode.segments.entry(2))
+    ok_(gcode.segments.entry(2) is not entry)
+
+    entry = gcode.segments.entry(2)
+    gcode.segments.invalidate(0)
+    ok_(gcode.segments.entry(2) is not entry)
+    eq_(entry, gcode.segments.entry(2))
+
+
+class SetFeedrate(GCodeFilter):
+    """filter changing the feedrate of extruding moves, in place or on a copy of the lines"""
+
+    def __init__(self, feedrate, in_place):
+        self.feedrate = feedrate
+        self.in_place = in_place
+
+    def opcode_filter(self, opcode):
+        if not opcode.is_move or not opcode.e:
+            return KEEP
+        line = opcode if self.in_place else copy.copy(opcode)
+        line.current_f = self.feedrate
+        return line
+
+
+def test_filter_invalidation():
+    for feedrate, in_place in ((1200, True), (2400, False)):
+        gcode = program()
+        segments = gcode.segments.layer(1)
+        layer_length = len(gcode.all_layers[1])
+
+        SetFeedrate(feedrate, in_place).filter(gcode)
+        eq_(layer_length, len(gcode.all_layers[1]))
+        ok_(gcode.segments.layer(1) is not segments)
+        eq_(feedrate, gcode.segments.layer(1)[1].feedrate)
+
+
+def test_line_lookup():
+    gcode = program()
+    line = gcode.all_layers[1][1]
+    eq_(5, gcode.segments.segment(line, 1).length)
+    # lines are also looked up in the previous layer
+    eq_(5, gcode.segments.segment(gcode.all_layers[0][2], 1).length)
+    eq_(None, gcode.segments.segment(line, 0))
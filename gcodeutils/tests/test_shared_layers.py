@@ -0,0 +1,86 @@
+import os
+import pickle
+from unittest import SkipTest
+
+from nose.tools import eq_, assert_raises
+
+from gcodeutils.filter.filter import GCodeFilter, KEEP, STATELESS
+from gcodeutils.filter.parallel import ParallelFilterRunner
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.shared_layers import SHARED_MEMORY, SharedLayers, export_layers, import_layers
+from gcodeutils.tests import attributes, open_gcode_file, gcode_eq
+
+__author__ = 'olivier'
+
+
+def setup_module():
+    if not SHARED_MEMORY:
+        raise SkipTest("multiprocessing.shared_memory is not available")
+
+
+def test_shared_layers():
+    gcode = open_gcode_file('skeinforge_model1_prestretch.gcode')
+    gcode.all_layers[1][0].raw += u" ; \u00e9paisseur"
+    gcode.all_layers[2].z = None
+
+    shared = SharedLayers.create(gcode.all_layers)
+    try:
+        attached = SharedLayers.attach(pickle.loads(pickle.dumps(shared.handle)))
+        try:
+            eq_(len(gcode.all_layers), len(attached))
+            for layer, shared_layer in zip(gcode.all_layers, attached):
+                eq_((layer.z, layer.duration), (shared_layer.z, shared_layer.duration))
+                eq_(list(map(attributes, layer)), list(map(attributes, shared_layer)))
+            eq_(list(map(attributes, gcode.all_layers[-1])), list(map(attributes, attached[-1])))
+            assert_raises(IndexError, attached.__getitem__, len(attached))
+        finally:
+            attached.close()
+    finally:
+        shared.unlink()
+
+
+def test_exported_layers():
+    gcode = open_gcode_file('cura_square.gcode')
+    eq_([list(map(attributes, layer)) for layer in gcode.all_layers],
+        [list(map(attributes, layer)) for layer in import_layers(export_layers(gcode.all_layers))])
+    eq_([], import_layers(export_layers([])))
+
+
+def test_parallel_filter():
+    gcode = open_gcode_file('cura_square.gcode')
+    gcode_oracle = open_gcode_file('cura_square.gcode')
+
+    GCodeToRelativeExtrusionFilter().filter(gcode_oracle)
+    ParallelFilterRunner(GCodeToRelativeExtrusionFilter(), jobs=2, chunk_size=2, shared_memory=True).filter(gcode)
+
+    gcode_eq(gcode_oracle, gcode)
+    eq_([line.raw for layer in gcode_oracle.all_layers for line in layer],
+        [line.raw for layer in gcode.all_layers for line in layer])
+
+
+class FailingFilter(GCodeFilter):
+    """filter failing on a layer"""
+    state_dependency = STATELESS
+
+    def __init__(self, layer_idx):
+        self.layer_idx = layer_idx
+
+    def opcode_filter(self, opcode):
+        if self.current_layer_idx == self.layer_idx:
+            raise ValueError("layer %d" % self.layer_idx)
+        return KEEP
+
+
+def shared_blocks():
+    return set(name for name in os.listdir('/dev/shm') if name.startswith('psm_')) if os.path.isdir('/dev/shm') \
+        else set()
+
+
+def test_failing_worker():
+    blocks = shared_blocks()
+    gcode = open_gcode_file('skeinforge_model1_prestretch.gcode')
+
+    # the chunks filtered before and after the failing one are freed
+    assert_raises(ValueError, ParallelFilterRunner(FailingFilter(4), jobs=2, chunk_size=2, shared_memory=True).filter,
+                  gcode)
+    eq_(blocks, shared_blocks())
@@ -0,0 +1,79 @@
+from nose.tools import eq_, ok_, assert_almost_equal
+
+from gcodeutils.gcoder import GCode
+from gcodeutils.spatial import ARC_TOLERANCE, SegmentGrid
+from gcodeutils.tests import open_gcode_file
+
+__author__ = 'olivier'
+
+
+def square():
+    # 10mm square perimeter, a travel across it and an arc outside of it
+    return GCode(["G90", "M82", "G1 Z0.2", "G1 X0 Y0 E0", "G1 X10 Y0 E1", "G1 X10 Y10 E2", "G1 X0 Y10 E3",
+                  "G1 X0 Y0 E4", "G0 X20 Y5", "G2 X30 Y5 I5 J0 E5"])
+
+
+def test_within():
+    gcode = square()
+    grid = gcode.spatial.layer(1)
+    layer = gcode.all_layers[1]
+
+    eq_(["G1 X0 Y10 E3"], [layer[row].raw for row in grid.within(5, 9, 1.5)])
+    eq_(["G1 X10 Y10 E2", "G1 X0 Y10 E3"], [layer[row].raw for row in grid.within(9.5, 9.5, 1)])
+    # the travel crosses the square
+    eq_(["G1 X10 Y0 E1", "G0 X20 Y5"], [layer[row].raw for row in grid.within(5, 1, 1.5)])
+    eq_([], grid.within(5, 5, 1))
+    # the clockwise arc goes up to Y 10
+    eq_(["G2 X30 Y5 I5 J0 E5"], [layer[row].raw for row in grid.within(25, 10, 0.1)])
+    eq_([], grid.within(25, 0, 0.1))
+
+
+def test_nearest():
+    gcode = square()
+    grid = gcode.spatial.layer(1)
+    layer = gcode.all_layers[1]
+
+    row, distance = grid.nearest(5, 9)
+    eq_("G1 X0 Y10 E3", layer[row].raw)
+    assert_almost_equal(1, distance)
+    eq_(None, grid.nearest(5, 9, max_distance=0.5))
+
+    row, distance = grid.nearest(25, 5)
+    eq_("G2 X30 Y5 I5 J0 E5", layer[row].raw)
+    # arcs are approximated by chords
+    assert_almost_equal(5, distance, delta=ARC_TOLERANCE)
+
+    # travels only
+    row, distance = gcode.spatial.layer(1, extruding=False).nearest(5, 9)
+    eq_("G0 X20 Y5", layer[row].raw)
+
+
+def test_nearest_brute_force():
+    gcode = open_gcode_file('skeinforge_model1_prestretch.gcode')
+    grid = gcode.spatial.layer(5)
+    for x, y in ((0, 0), (10, 10), (-3, 25), (200, 200), (-1000, 40), (35, 1e4)):
+        distance = min(grid._piece_distance(piece, x, y) for piece in range(len(grid.rows)))
+        assert_almost_equal(distance, grid.nearest(x, y)[1])
+    eq_(None, grid.nearest(200, 200, max_distance=1))
+
+
+def test_intersecting():
+    gcode = square()
+    grid = gcode.spatial.layer(1, extruding=True)
+    layer = gcode.all_layers[1]
+
+    eq_(["G1 X10 Y0 E1", "G1 X10 Y10 E2"], [layer[row].raw for row in grid.intersecting(5, -1, 11, 5)])
+    eq_([], grid.intersecting(2, 2, 8, 8))
+    # does the travel cross a printed perimeter ? It starts on the corner of the first and last sides
+    travel = [line.raw for line in layer].index("G0 X20 Y5")
+    segments = gcode.segments.layer(1)
+    eq_(["G1 X10 Y0 E1", "G1 X10 Y10 E2", "G1 X0 Y0 E4"], [layer[row].raw for row in grid.intersecting(
+        segments.start_x[travel], segments.start_y[travel], segments.end_x[travel], segments.end_y[travel])])
+
+
+def test_cell_size():
+    gcode = square()
+    grid = SegmentGrid(gcode.segments.layer(1), cell_size=100)
+    eq_(1, len(grid.cells))
+    eq_(sorted(SegmentGrid(gcode.segments.layer(1)).within(5, 5, 6)), grid.within(5, 5, 6))
+    ok_(grid.nearest(1000, 1000) is not None)
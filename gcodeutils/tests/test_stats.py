@@ -0,0 +1,61 @@
+from nose.tools import eq_, ok_
+
+from gcodeutils.gcode_stats import analyze, analyze_file
+from gcodeutils.features import FEATURE_NAMES
+from gcodeutils.tests import gcode_file_path, open_gcode_file
+
+__author__ = 'olivier'
+
+PROGRAM = """G21
+G90
+M82
+G1 Z0.2 F600
+G1 X10 Y0 E1 F1200
+;TYPE:WALL-OUTER
+G1 X10 Y10 E2
+G1 E1.5 F1800
+G0 X20 Y10 F6000
+G92 E0
+;TYPE:FILL
+G1 X20 Y20 E1 F1200
+G1 Z0.4
+G1 X30 Y20 E2
+""".splitlines()
+
+
+def test_layers_and_features():
+    stats = analyze(PROGRAM)
+
+    # the initial Z move happens before any extrusion, in a preamble layer
+    eq_(3, stats['layer_count'])
+    eq_([None, 0.2, 0.4], [layer['z'] for layer in stats['layers']])
+    eq_(1, stats['totals']['retractions'])
+    eq_(10., stats['totals']['travel'])
+    eq_(3., stats['layers'][1]['filament'])
+    eq_(1., stats['layers'][2]['filament'])
+    eq_(1., stats['features']['outer-wall']['filament'])
+    eq_(2., stats['features']['infill']['filament'])
+    # retractions and moves not extruding are travel
+    eq_(1, stats['features']['travel']['retractions'])
+    eq_(10., stats['features']['travel']['travel'])
+
+
+def test_totals_match_layers():
+    stats = analyze_file(gcode_file_path('cura_square.gcode'))
+
+    ok_(stats['layer_count'] > 0)
+    ok_('skirt' in stats['features'])
+    for bit in ('filament', 'moves', 'retractions'):
+        eq_(stats['totals'][bit], sum(layer[bit] for layer in stats['layers']))
+        eq_(stats['totals'][bit], sum(feature[bit] for feature in stats['features'].values()))
+
+
+def test_features_match_gcode():
+    stats = analyze_file(gcode_file_path('cura_square.gcode'))
+    gcode = open_gcode_file('cura_square.gcode')
+
+    moves = {}
+    for feature, line in zip(gcode.feature_index, gcode):
+        if line.is_move:
+            moves[FEATURE_NAMES[feature]] = moves.get(FEATURE_NAMES[feature], 0) + 1
+    eq_(moves, dict((name, feature['moves']) for name, feature in stats['features'].items()))
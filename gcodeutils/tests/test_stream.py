@@ -0,0 +1,164 @@
+import itertools
+import math
+import re
+
+from nose.tools import eq_, ok_
+
+from gcodeutils.filter.arc_optimizer import GCodeArcOptimizerFilter
+from gcodeutils.filter.filter import KEEP
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.stream import StreamFilter, end_of_loop, parse_lines, run_pipeline
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.gcoder import raw_to_line
+from gcodeutils.tests import gcode_file_path, open_gcode_file, raws
+
+__author__ = 'olivier'
+
+ARC_COMMENT_EXP = re.compile(r'; generated from (\d+) segments')
+
+
+def sample_lines(filename):
+    with open(gcode_file_path(filename)) as gcode_file:
+        return gcode_file.readlines()
+
+
+class Recorder(StreamFilter):
+    """filter recording the windows it's given"""
+
+    def __init__(self, lookahead=0, lookbehind=0):
+        self.lookahead = lookahead
+        self.lookbehind = lookbehind
+        self.windows = []
+
+    def process(self, window):
+        self.windows.append((raws(window.previous()), window.current.raw, raws(window.upcoming())))
+        eq_(window.ahead(1), window.upcoming()[0] if window.upcoming() else None)
+        eq_(window.behind(1), window.previous()[-1] if window.previous() else None)
+        return KEEP
+
+
+class MarkLoopStarts(StreamFilter):
+    """filter commenting the first move of loops with their length in moves"""
+    lookahead = staticmethod(end_of_loop)
+    lookbehind = 1
+
+    def process(self, window):
+        line = window.current
+        if line.is_move and line.e is not None and (window.behind(1) is None or end_of_loop(window.behind(1))):
+            moves = 1 + len([ahead for ahead in window.upcoming() if not end_of_loop(ahead)])
+            return [line, raw_to_line("; loop of %d moves" % moves)]
+        return KEEP
+
+
+class MergeRepeats(StreamFilter):
+    """filter replacing repeated lines by a count of repeats"""
+    lookahead = 3
+
+    def process(self, window):
+        repeats = 0
+        while window.ahead(repeats + 1) is not None and window.ahead(repeats + 1).raw == window.current.raw:
+            repeats += 1
+        window.consume(repeats)
+        return [window.current, raw_to_line("; repeated %d times" % repeats)] if repeats else KEEP
+
+
+def test_parse_lines():
+    lines = list(parse_lines(["G90", "", "M82", "G1 X1 Y2 E1", "; comment", "G91", "G1 X1 E1"]))
+    eq_(["G90", "M82", "G1 X1 Y2 E1", "; comment", "G91", "G1 X1 E1"], raws(lines))
+    eq_((1, 2, 1), (lines[2].current_x, lines[2].current_y, lines[2].current_e))
+    eq_((2, 2, 2), (lines[5].current_x, lines[5].current_y, lines[5].current_e))
+
+
+def test_windows():
+    recorder = Recorder(lookahead=2, lookbehind=1)
+    eq_(["G1 X1", "G1 X2", "G1 X3", "G1 X4"],
+        raws(recorder.stream(parse_lines(["G1 X1", "G1 X2", "G1 X3", "G1 X4"]))))
+    eq_([([], "G1 X1", ["G1 X2", "G1 X3"]),
+         (["G1 X1"], "G1 X2", ["G1 X3", "G1 X4"]),
+         (["G1 X2"], "G1 X3", ["G1 X4"]),
+         (["G1 X3"], "G1 X4", [])], recorder.windows)
+
+
+def test_loop_lookahead():
+    program = ["G90", "M83", "G0 X0 Y0", "G1 X10 E1", "; corner", "G1 Y10 E1", "G1 X0 E1", "G0 X20", "G1 X30 E1",
+               "G0 Z1"]
+    eq_(["G90", "M83", "G0 X0 Y0", "G1 X10 E1", "; loop of 4 moves", "; corner", "G1 Y10 E1", "G1 X0 E1", "G0 X20",
+         "G1 X30 E1", "; loop of 1 moves", "G0 Z1"], raws(MarkLoopStarts().stream(parse_lines(program))))
+
+    # the lookahead is bounded
+    recorder = Recorder(lookahead=end_of_loop)
+    recorder.max_lookahead = 2
+    list(recorder.stream(parse_lines(["G1 X1 E1", "G1 X2 E1", "G1 X3 E1", "G1 X4 E1", "G0 X0"])))
+    eq_(["G1 X2 E1", "G1 X3 E1"], recorder.windows[0][2])
+    eq_(["G0 X0"], recorder.windows[3][2])
+
+
+def test_consumed_lines():
+    program = ["G1 X1", "M106", "M106", "M106", "M106", "M106", "G1 X2", "G1 X2"]
+    # repeats are only seen up to the lookahead
+    eq_(["G1 X1", "M106", "; repeated 3 times", "M106", "G1 X2", "; repeated 1 times"],
+        raws(MergeRepeats().stream(parse_lines(program))))
+
+
+def test_constant_memory():
+    # unbounded input is filtered lazily
+    program = itertools.chain(["G90", "M82"], ("G1 X%d E%d" % (x, x) for x in itertools.count(1)))
+    pipeline = run_pipeline(parse_lines(program), GCodeXYTranslateFilter(x=1), GCodeToRelativeExtrusionFilter())
+    eq_(["G90", "M83", "G1 X2.000 E1.00000", "G1 X3.000 E1.00000"], raws(itertools.islice(pipeline, 4)))
+
+
+def test_ported_filters():
+    for filename in ('simple3.gcode', 'cura_square.gcode', 'slic3r_square.gcode'):
+        gcode = open_gcode_file(filename)
+        GCodeXYTranslateFilter(x=1, y=2).filter(gcode)
+        GCodeToRelativeExtrusionFilter().filter(gcode)
+
+        lines = run_pipeline(parse_lines(sample_lines(filename)), GCodeXYTranslateFilter(x=1, y=2),
+                             GCodeToRelativeExtrusionFilter())
+        eq_([raw for layer in gcode.all_layers for raw in layer.raw_lines()], raws(lines))
+
+
+def test_arc_optimizer():
+    for filename in ('arc_raw_1.gcode', 'arc_raw_2.gcode', 'arc_raw_4.gcode'):
+        gcode = open_gcode_file(filename)
+        GCodeArcOptimizerFilter().filter(gcode)
+
+        lines = raws(GCodeArcOptimizerFilter().stream(parse_lines(sample_lines(filename))))
+        ok_(any(raw.startswith(("G2", "G3")) for raw in lines))
+        eq_([raw for layer in gcode.all_layers for raw in layer.raw_lines()], lines)
+
+
+def circles():
+    """yield an unbounded program printing 40 sided polygons"""
+    yield "G90"
+    yield "M83"
+    while True:
+        yield "G0 X20 Y0 F6000"
+        for step in range(1, 41):
+            angle = 2 * math.pi * step / 40
+            yield "G1 X%.4f Y%.4f E0.1 F1200" % (20 * math.cos(angle), 20 * math.sin(angle))
+
+
+def test_streamed_arcs():
+    # arcs are found in unbounded input
+    lines = raws(itertools.islice(GCodeArcOptimizerFilter().stream(parse_lines(circles())), 100))
+    ok_(len([raw for raw in lines if raw.startswith("G3")]) > 5)
+
+
+def test_bounded_arc_optimizer():
+    arcs = []
+    for max_lookahead in (GCodeArcOptimizerFilter.max_lookahead, 12):
+        arc_filter = GCodeArcOptimizerFilter()
+        arc_filter.max_lookahead = max_lookahead
+        lines = raws(arc_filter.stream(parse_lines(sample_lines('arc_raw_1.gcode'))))
+        segments = [int(match.group(1)) for match in (ARC_COMMENT_EXP.search(raw) for raw in lines) if match]
+        ok_(max(segments) < max_lookahead)
+        arcs.append(len(segments))
+    # long arcs are split when streaming
+    ok_(arcs[1] > arcs[0])
+
+    # but not when filtering a whole program
+    gcode, gcode_oracle = open_gcode_file('arc_raw_1.gcode'), open_gcode_file('arc_raw_1.gcode')
+    arc_filter.filter(gcode)
+    GCodeArcOptimizerFilter().filter(gcode_oracle)
+    eq_(raws(gcode_oracle), raws(gcode))
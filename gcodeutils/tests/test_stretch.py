@@ -1,6 +1,10 @@
 import logging
+from multiprocessing.pool import ThreadPool
+
+from nose.tools import eq_
 
 from gcodeutils.stretch.stretch import SkeinforgeStretchFilter, Slic3rStretchFilter, CuraStretchFilter
+from gcodeutils.gcoder import GCode
 from gcodeutils.tests import open_gcode_file, gcode_eq
 
 __author__ = 'olivier'
@@ -37,3 +41,33 @@ def test_square_stretch_cura():
     logging.basicConfig(level=logging.DEBUG)
     CuraStretchFilter().filter(simple_square_gcode)
     simple_square_gcode.write()
+
+
+def test_cura_settings_edge_width():
+    # settings of Cura 4 and later, split over several comments
+    gcode = GCode([';FLAVOR:Marlin', ';TYPE:WALL-OUTER', 'G1 X1 Y1 E1',
+                   r';SETTING_3 {"global_quality": "[general]\\nversion = 4\\n[values]\\nline_width = 0.42\\n", "extru',
+                   r';SETTING_3 der_quality": ["[general]\\nversion = 4\\n[values]\\nwall_line_wid',
+                   r';SETTING_3 th_0 = 0.35\\n"]}'])
+    stretch_filter = CuraStretchFilter()
+    stretch_filter.gcode = gcode
+    stretch_filter.setup_filter()
+    eq_(0.35, stretch_filter.edgeWidth)
+
+
+def test_shared_stretch_filter():
+    # a single filter can stretch several programs at the same time, each one in its own context
+    stretch_filter = Slic3rStretchFilter()
+    gcodes = [open_gcode_file('slic3r_square.gcode') for _ in range(4)]
+    gcode_oracle = open_gcode_file('slic3r_square.gcode')
+    Slic3rStretchFilter().filter(gcode_oracle)
+
+    pool = ThreadPool(4)
+    try:
+        pool.map(stretch_filter.filter, gcodes)
+    finally:
+        pool.close()
+        pool.join()
+
+    for gcode in gcodes:
+        eq_([layer.raw_lines() for layer in gcode_oracle.all_layers], [layer.raw_lines() for layer in gcode.all_layers])
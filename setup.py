@@ -87,6 +87,7 @@ setup(
     extras_require={
         'dev': ['check-manifest', 'pylint'],
         'test': ['nose'],
+        'numpy': ['numpy'],
     },
 
     # If there are data files included in your packages that need to be
@@ -112,6 +113,8 @@ setup(
             'gcode_mod=gcodeutils.gcode_mod:main',
             'gcode_stretch=gcodeutils.gcode_stretch:main',
             'gcode_optimize_arcs=gcodeutils.gcode_optimize_arcs:main',
+            'gcode_stats=gcodeutils.gcode_stats:main',
+            'gcode_lint=gcodeutils.gcode_lint:main',
         ],
     },
 